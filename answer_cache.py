@@ -0,0 +1,171 @@
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from agents_enum import Agent
+from cache import LRUCache
+
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Default lifetime in seconds of answers produced by each source; web answers go stale fastest.
+DEFAULT_TTLS = {
+    Agent.SQL_DB_AGENT.value: 86400.0,
+    Agent.VECTOR_DB_AGENT.value: 86400.0,
+    Agent.WEB_SEARCH_AGENT.value: 3600.0,
+    Agent.GENERATE.value: 3600.0,
+}
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.!").strip().lower()
+
+
+class AnswerCache:
+    """Final answers keyed on the standalone question.
+
+    Lookups try an exact match on the normalized question in memory, then in the optional
+    SQLite tier, then (with an embedding model) the most similar question in memory above
+    `similarity_threshold`. Each answer records the agents that produced it and expires
+    after the shortest TTL among them.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 512,
+        ttls: Optional[Dict[str, float]] = None,
+        sqlite_path: Optional[str] = None,
+        embedding_model: any = None,
+        similarity_threshold: float = 0.95,
+    ) -> None:
+        self.memory = LRUCache(max_size)
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.sqlite_path = sqlite_path
+        self.embedding_model = embedding_model
+        self.similarity_threshold = similarity_threshold
+        self._embeddings: OrderedDict = OrderedDict()
+        self._lock = Lock()
+        self._stats = {"exact_hits": 0, "similar_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+        if sqlite_path:
+            with sqlite3.connect(sqlite_path) as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS answers ("
+                    "key TEXT PRIMARY KEY, question TEXT, answer TEXT, source TEXT, created_at REAL, expires_at REAL)"
+                )
+
+    @classmethod
+    def from_env(cls) -> "AnswerCache":
+        ttls = {
+            source: float(os.getenv(f"ANSWER_CACHE_TTL_{source.upper()}", os.getenv("ANSWER_CACHE_TTL", ttl)))
+            for source, ttl in DEFAULT_TTLS.items()
+        }
+        threshold = os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD")
+        embedding_model = None
+        if threshold:
+            from model_registry import sentence_transformer
+
+            embedding_model = sentence_transformer(EMBEDDING_MODEL)
+        return cls(
+            max_size=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+            ttls=ttls,
+            sqlite_path=os.getenv("ANSWER_CACHE_SQLITE_PATH") or None,
+            embedding_model=embedding_model,
+            similarity_threshold=float(threshold or 0.95),
+        )
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _embed(self, question: str) -> np.ndarray:
+        return np.asarray(self.embedding_model.encode(question, normalize_embeddings=True))
+
+    def lookup(self, question: str) -> Optional[Dict]:
+        key = normalize_question(question)
+        entry = self.memory.get(key)
+        if entry is not None:
+            self._count("exact_hits")
+            return entry
+
+        entry = self._lookup_disk(key)
+        if entry is not None:
+            self._remember(key, entry, entry["expires_at"] - time.time() if entry["expires_at"] else None)
+            self._count("disk_hits")
+            return entry
+
+        if self.embedding_model is not None:
+            entry = self._lookup_similar(question)
+            if entry is not None:
+                self._count("similar_hits")
+                return entry
+
+        self._count("misses")
+        return None
+
+    def _lookup_disk(self, key: str) -> Optional[Dict]:
+        if not self.sqlite_path:
+            return None
+        with sqlite3.connect(self.sqlite_path) as conn:
+            row = conn.execute(
+                "SELECT question, answer, source, expires_at FROM answers WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"question": row[0], "answer": row[1], "source": row[2], "expires_at": row[3]}
+
+    def _lookup_similar(self, question: str) -> Optional[Dict]:
+        with self._lock:
+            keys = list(self._embeddings)
+            if not keys:
+                return None
+            matrix = np.stack(list(self._embeddings.values()))
+        scores = matrix @ self._embed(question)
+        for index in np.argsort(-scores):
+            if scores[index] < self.similarity_threshold:
+                return None
+            entry = self.memory.get(keys[index])
+            if entry is not None:
+                return entry
+            # Expired or evicted from the memory tier.
+            with self._lock:
+                self._embeddings.pop(keys[index], None)
+        return None
+
+    def _remember(self, key: str, entry: Dict, ttl: Optional[float]) -> None:
+        self.memory.set(key, entry, ttl=ttl)
+        if self.embedding_model is not None:
+            embedding = self._embed(entry["question"])
+            with self._lock:
+                self._embeddings[key] = embedding
+                self._embeddings.move_to_end(key)
+                while len(self._embeddings) > self.memory.max_size:
+                    self._embeddings.popitem(last=False)
+
+    def store(self, question: str, answer: str, sources: List[str]) -> None:
+        sources = sorted(set(sources)) or [Agent.GENERATE.value]
+        ttl = min(self.ttls.get(source, self.ttls[Agent.GENERATE.value]) for source in sources)
+        if ttl <= 0:
+            return
+        key = normalize_question(question)
+        expires_at = time.time() + ttl
+        entry = {"question": question, "answer": answer, "source": ",".join(sources), "expires_at": expires_at}
+        self._remember(key, entry, ttl)
+        if self.sqlite_path:
+            with sqlite3.connect(self.sqlite_path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO answers (key, question, answer, source, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, question, answer, entry["source"], time.time(), expires_at),
+                )
+        self._count("stores")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,368 @@
+"""Benchmarks of the query pipeline against the scripted backends of fake_backends.py.
+
+python benchmarks.py throughput --concurrency 16 64 256
+python benchmarks.py ttft
+python benchmarks.py startup
+python benchmarks.py fanout
+python benchmarks.py nodes --save-baseline nodes_baseline.json   # later: --baseline nodes_baseline.json
+python benchmarks.py tiers
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from fake_backends import FakeChatModel, olympics_responder, stubbed_backends
+from stress_test import QUESTION_TEMPLATES, build_questions
+
+
+def build_query_processor(llm_latency: float, backend_latency: float, token_latency: float = 0.0, **kwargs) -> any:
+    from query_processor import QueryProcessor
+
+    llm = FakeChatModel(responder=olympics_responder, latency=llm_latency, token_latency=token_latency)
+    with stubbed_backends(backend_latency):
+        # The stubs are only in place inside this block, so the agents must be built now.
+        return QueryProcessor(llm, startup_mode="eager", **kwargs)
+
+
+@contextmanager
+def peak_threads(interval: float = 0.01) -> Iterator[Dict[str, int]]:
+    """Sample the number of live threads while the block runs; the maximum is left in `["peak"]`."""
+    result = {"peak": threading.active_count()}
+    done = threading.Event()
+
+    def sample() -> None:
+        while not done.wait(interval):
+            result["peak"] = max(result["peak"], threading.active_count() - 1)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield result
+    finally:
+        done.set()
+        sampler.join()
+
+
+def run_sync(queryProcessor: any, questions: List[str], concurrency: int) -> Tuple[List[str], float, List[float]]:
+    """Answer the questions with `processQuery` on a pool of `concurrency` threads."""
+    def answer(question: str) -> Tuple[str, float]:
+        start = time.perf_counter()
+        return queryProcessor.processQuery(question, []), time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(answer, questions))
+    return [answer for answer, _ in results], time.perf_counter() - start, [latency for _, latency in results]
+
+
+async def run_async(queryProcessor: any, questions: List[str], concurrency: int) -> Tuple[List[str], float, List[float]]:
+    """Answer the questions with `aprocessQuery`, at most `concurrency` in flight on one event loop."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(question: str) -> Tuple[str, float]:
+        async with semaphore:
+            start = time.perf_counter()
+            return await queryProcessor.aprocessQuery(question, []), time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(answer(question) for question in questions))
+    return [answer for answer, _ in results], time.perf_counter() - start, [latency for _, latency in results]
+
+
+def throughput(args: argparse.Namespace) -> None:
+    queryProcessor = build_query_processor(args.llm_latency, args.backend_latency)
+    questions = build_questions(args.queries)
+
+    print(f"Queries : {len(questions)} | LLM latency : {args.llm_latency * 1000:.0f} ms | backend latency : {args.backend_latency * 1000:.0f} ms")
+    print(f"{'concurrency':>11} | {'sync q/s':>9} | {'sync p50':>9} | {'threads':>7} | {'async q/s':>9} | {'async p50':>9} | {'threads':>7} | {'different answers':>17}")
+    for concurrency in args.concurrency:
+        with peak_threads() as sync_threads:
+            sync_answers, sync_time, sync_latencies = run_sync(queryProcessor, questions, concurrency)
+        with peak_threads() as async_threads:
+            async_answers, async_time, async_latencies = asyncio.run(run_async(queryProcessor, questions, concurrency))
+        mismatches = sum(expected != actual for expected, actual in zip(sync_answers, async_answers))
+        print(
+            f"{concurrency:>11} | {len(questions) / sync_time:9.1f} | {statistics.median(sync_latencies) * 1000:7.0f}ms | {sync_threads['peak']:>7}"
+            f" | {len(questions) / async_time:9.1f} | {statistics.median(async_latencies) * 1000:7.0f}ms | {async_threads['peak']:>7}"
+            f" | {mismatches:>17}"
+        )
+
+
+def ttft(args: argparse.Namespace) -> None:
+    """Time until the user sees something: the full answer from `processQuery` versus the events of `streamQuery`."""
+    queryProcessor = build_query_processor(args.llm_latency, args.backend_latency, args.token_latency)
+    questions = build_questions(args.queries)
+
+    blocking, first_progress, first_token, complete = [], [], [], []
+    for question in questions:
+        start = time.perf_counter()
+        queryProcessor.processQuery(question, [])
+        blocking.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        progress_at = token_at = None
+        for event in queryProcessor.streamQuery(question, []):
+            now = time.perf_counter() - start
+            if event.kind == "progress" and progress_at is None:
+                progress_at = now
+            elif event.kind == "token" and token_at is None:
+                token_at = now
+        first_progress.append(progress_at)
+        first_token.append(token_at)
+        complete.append(time.perf_counter() - start)
+
+    def summary(values: List[float]) -> str:
+        return f"p50 {statistics.median(values) * 1000:7.0f} ms | mean {statistics.mean(values) * 1000:7.0f} ms"
+
+    print(f"Queries : {len(questions)} | LLM latency : {args.llm_latency * 1000:.0f} ms + {args.token_latency * 1000:.0f} ms/token | backend latency : {args.backend_latency * 1000:.0f} ms")
+    print(f"processQuery, answer shown           : {summary(blocking)}")
+    print(f"streamQuery, first progress update   : {summary(first_progress)}")
+    print(f"streamQuery, first answer token      : {summary(first_token)}")
+    print(f"streamQuery, answer complete         : {summary(complete)}")
+
+
+def startup(args: argparse.Namespace) -> None:
+    """Time until the QueryProcessor is constructed and until questions for each agent are answered, per startup mode."""
+    from query_processor import QueryProcessor
+
+    # One question for each of the SQL, vector DB and web search agents.
+    questions = [template.format(n=0) for template in QUESTION_TEMPLATES[:3]]
+    llm = FakeChatModel(responder=olympics_responder, latency=args.llm_latency)
+
+    print(f"Backend build latency : {args.build_latency:.1f} s each | LLM latency : {args.llm_latency * 1000:.0f} ms")
+    print(f"{'mode':>10} | {'ready':>7} | {'first answer':>12} | {'all agents used':>15}")
+    reports = []
+    for mode in ("eager", "lazy", "background"):
+        with stubbed_backends(args.backend_latency, args.build_latency):
+            start = time.perf_counter()
+            queryProcessor = QueryProcessor(llm, startup_mode=mode)
+            ready = time.perf_counter() - start
+            queryProcessor.processQuery(questions[0], [])
+            first_answer = time.perf_counter() - start
+            for question in questions[1:]:
+                queryProcessor.processQuery(question, [])
+            all_answered = time.perf_counter() - start
+        print(f"{mode:>10} | {ready:6.2f}s | {first_answer:11.2f}s | {all_answered:14.2f}s")
+        reports.append(queryProcessor.startup_report())
+    print("\n".join(reports))
+
+
+# Questions with one part for the SQL agent and one for the vector DB agent.
+MIXED_QUESTION_TEMPLATES = [
+    "How many gold medals has athlete {n} won and explain the scoring rules of event {n}",
+    "Explain the fouls of event {n} and list the medal count of athlete {n}",
+]
+
+
+def fanout(args: argparse.Namespace) -> None:
+    """End-to-end latency of questions that need two agents, with sequential routing and with fan-out routing."""
+    questions = [MIXED_QUESTION_TEMPLATES[index % len(MIXED_QUESTION_TEMPLATES)].format(n=index) for index in range(args.queries)]
+
+    print(f"Mixed questions : {len(questions)} | LLM latency : {args.llm_latency * 1000:.0f} ms | backend latency : {args.backend_latency * 1000:.0f} ms")
+    print(f"{'routing':>10} | {'p50':>9} | {'mean':>9} | {'answers using both agents':>25}")
+    for name, use_fan_out in (("sequential", False), ("fan-out", True)):
+        queryProcessor = build_query_processor(args.llm_latency, args.backend_latency, use_fan_out=use_fan_out)
+        latencies, both = [], 0
+        for question in questions:
+            start = time.perf_counter()
+            answer = queryProcessor.processQuery(question, [])
+            latencies.append(time.perf_counter() - start)
+            # The scripted agents' answers start with these markers, and generate echoes its context.
+            both += "SQL answer" in answer and "Answer from context" in answer
+        print(
+            f"{name:>10} | {statistics.median(latencies) * 1000:7.0f}ms | {statistics.mean(latencies) * 1000:7.0f}ms | "
+            f"{both:>18}/{len(questions)}"
+        )
+
+
+def time_calls(call: Callable[[int], any], iterations: int, warmup: int = 20) -> List[float]:
+    """Seconds taken by each of `iterations` calls of `call(i)`, after `warmup` untimed calls."""
+    for i in range(warmup):
+        call(i)
+    durations = []
+    for i in range(warmup, warmup + iterations):
+        start = time.perf_counter()
+        call(i)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def nodes(args: argparse.Namespace) -> None:
+    """Per-call overhead of the LLM-calling nodes with an LLM that answers instantly, optionally checked against a baseline."""
+    from langchain_core.messages import HumanMessage, ToolMessage
+
+    queryProcessor = build_query_processor(0.0, 0.0)
+    vectorDBAgent = queryProcessor.components["vector_db_agent"].get()
+    webSearchAgent = queryProcessor.components["web_search_agent"].get()
+    question = "Explain the scoring rules of event 0"
+
+    # Inputs vary with the call index so that no cache answers for the node.
+    cases = {
+        "query_processor.generate": lambda i: queryProcessor.generate(
+            {"messages": [HumanMessage(question), HumanMessage(f"Retrieved context from previous agent:\ndocuments {i}")]}
+        ),
+        "vector_db_agent.agent": lambda i: vectorDBAgent.agent({"messages": [HumanMessage(f"{question} {i}")]}),
+        "vector_db_agent.grade_documents": lambda i: vectorDBAgent.grade_documents(
+            {"messages": [HumanMessage(question), ToolMessage(f"documents {i}", tool_call_id="call")], "retrieval_tries": 1}
+        ),
+        "vector_db_agent.generate": lambda i: vectorDBAgent.generate(
+            {"messages": [HumanMessage(question), ToolMessage(f"documents {i}", tool_call_id="call")]}
+        ),
+        "web_search_agent.processQuery": lambda i: webSearchAgent.processQuery(f"Who won event {i} in 2024?"),
+    }
+    # What each call used to pay before the chains were built once in the constructors.
+    construction = {
+        "build_rag_chain()": lambda i: vectorDBAgent.build_rag_chain(),
+        "build_grade_chain()": lambda i: vectorDBAgent.build_grade_chain(),
+        "bind_tools(tools)": lambda i: vectorDBAgent.llm.bind_tools(vectorDBAgent.tools),
+    }
+
+    results = {}
+    print(f"{'node':>32} | {'mean':>9} | {'p95':>9}")
+    for name, call in {**cases, **construction}.items():
+        durations = [duration * 1e6 for duration in time_calls(call, args.iterations)]
+        if name in cases:
+            results[name] = statistics.mean(durations)
+        print(f"{name:>32} | {statistics.mean(durations):7.0f}us | {statistics.quantiles(durations, n=20)[-1]:7.0f}us")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = [
+            name for name, mean in results.items()
+            if name in baseline and mean > baseline[name] * (1 + args.tolerance)
+        ]
+        for name in regressions:
+            print(f"REGRESSION {name} : {results[name]:.0f}us vs baseline {baseline[name]:.0f}us")
+        if regressions:
+            sys.exit(1)
+        print(f"All nodes within {args.tolerance:.0%} of the baseline")
+
+
+# Roles that only route, grade, check or rephrase; the tiered configuration gives them the small model.
+SMALL_MODEL_ROLES = ("router", "grader", "sql_checker", "contextualizer")
+
+
+class CostMeter:
+    """Callback counting the calls and estimated tokens (4 characters each) of one model."""
+
+    def __init__(self, input_price: float, output_price: float) -> None:
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        meter = self
+        self.input_price = input_price
+        self.output_price = output_price
+        self.calls = self.input_tokens = self.output_tokens = 0
+        self.lock = threading.Lock()
+
+        class Handler(BaseCallbackHandler):
+            def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], **kwargs: Any) -> None:
+                tokens = sum(len(str(message.content)) for batch in messages for message in batch) // 4
+                with meter.lock:
+                    meter.calls += 1
+                    meter.input_tokens += tokens
+
+            def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+                message = response.generations[0][0].message
+                tokens = (len(str(message.content)) + len(json.dumps([call["args"] for call in message.tool_calls]))) // 4
+                with meter.lock:
+                    meter.output_tokens += tokens
+
+        self.handler = Handler()
+
+    def cost(self) -> float:
+        return (self.input_tokens * self.input_price + self.output_tokens * self.output_price) / 1e6
+
+
+def tiers(args: argparse.Namespace) -> None:
+    """Latency and estimated cost per question with one large model for every role versus small models for the lighter roles."""
+    from llm_factory import LLM_ROLES
+    from query_processor import QueryProcessor
+
+    questions = build_questions(args.queries)
+    print(f"Queries : {len(questions)} | large model : {args.large_latency * 1000:.0f} ms, ${args.large_price[0]}/${args.large_price[1]} per 1M tokens in/out"
+          f" | small model : {args.small_latency * 1000:.0f} ms, ${args.small_price[0]}/${args.small_price[1]}")
+    print(f"Small model roles in the tiered configuration : {', '.join(SMALL_MODEL_ROLES)}")
+    print(f"{'configuration':>13} | {'p50':>9} | {'mean':>9} | {'cost per question':>17} | {'large calls':>11} | {'small calls':>11}")
+    for name, small_roles in (("single large", ()), ("tiered", SMALL_MODEL_ROLES)):
+        meters = {"large": CostMeter(*args.large_price), "small": CostMeter(*args.small_price)}
+        models = {
+            size: FakeChatModel(responder=olympics_responder, latency=latency, callbacks=[meters[size].handler])
+            for size, latency in (("large", args.large_latency), ("small", args.small_latency))
+        }
+        roles = {role: models["small" if role in small_roles else "large"] for role in LLM_ROLES}
+        with stubbed_backends(args.backend_latency):
+            queryProcessor = QueryProcessor(roles, startup_mode="eager")
+        _, _, latencies = run_sync(queryProcessor, questions, args.concurrency)
+        cost = sum(meter.cost() for meter in meters.values()) / len(questions)
+        print(
+            f"{name:>13} | {statistics.median(latencies) * 1000:7.0f}ms | {statistics.mean(latencies) * 1000:7.0f}ms | "
+            f"{f'${cost:.5f}':>17} | {meters['large'].calls:>11} | {meters['small'].calls:>11}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks of the query pipeline against stubbed LLM and backends")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    throughput_parser = subparsers.add_parser("throughput", help="questions per second of the sync and async paths at several concurrency levels")
+    throughput_parser.add_argument("--queries", type=int, default=256, help="number of questions per concurrency level")
+    throughput_parser.add_argument("--concurrency", type=int, nargs="+", default=[16, 64, 256], help="questions in flight")
+    throughput_parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per fake LLM call")
+    throughput_parser.add_argument("--backend-latency", type=float, default=0.005, help="seconds per stubbed database or search call")
+    throughput_parser.set_defaults(func=throughput)
+
+    ttft_parser = subparsers.add_parser("ttft", help="time to first visible output with and without streaming")
+    ttft_parser.add_argument("--queries", type=int, default=20, help="number of questions")
+    ttft_parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per fake LLM call before its first token")
+    ttft_parser.add_argument("--token-latency", type=float, default=0.03, help="seconds per generated word")
+    ttft_parser.add_argument("--backend-latency", type=float, default=0.005, help="seconds per stubbed database or search call")
+    ttft_parser.set_defaults(func=ttft)
+
+    startup_parser = subparsers.add_parser("startup", help="startup time of the eager, lazy and background startup modes")
+    startup_parser.add_argument("--build-latency", type=float, default=2.0, help="seconds to build each stubbed backend")
+    startup_parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM call")
+    startup_parser.add_argument("--backend-latency", type=float, default=0.005, help="seconds per stubbed database or search call")
+    startup_parser.set_defaults(func=startup)
+
+    fanout_parser = subparsers.add_parser("fanout", help="latency of questions needing two agents with sequential and fan-out routing")
+    fanout_parser.add_argument("--queries", type=int, default=20, help="number of questions")
+    fanout_parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per fake LLM call")
+    fanout_parser.add_argument("--backend-latency", type=float, default=0.005, help="seconds per stubbed database or search call")
+    fanout_parser.set_defaults(func=fanout)
+
+    nodes_parser = subparsers.add_parser("nodes", help="per-call overhead of the LLM-calling nodes, with an optional regression check")
+    nodes_parser.add_argument("--iterations", type=int, default=500, help="timed calls per node")
+    nodes_parser.add_argument("--save-baseline", type=str, default="", help="write the mean time per node to this JSON file")
+    nodes_parser.add_argument("--baseline", type=str, default="", help="exit with status 1 if a node is slower than in this JSON file (timings are machine-specific)")
+    nodes_parser.add_argument("--tolerance", type=float, default=0.3, help="allowed slowdown relative to the baseline")
+    nodes_parser.set_defaults(func=nodes)
+
+    tiers_parser = subparsers.add_parser("tiers", help="latency and cost per question with a single large model versus role-specific model tiers")
+    tiers_parser.add_argument("--queries", type=int, default=40, help="number of questions")
+    tiers_parser.add_argument("--concurrency", type=int, default=8, help="questions in flight")
+    tiers_parser.add_argument("--large-latency", type=float, default=0.8, help="seconds per call of the large fake model")
+    tiers_parser.add_argument("--small-latency", type=float, default=0.2, help="seconds per call of the small fake model")
+    tiers_parser.add_argument("--large-price", type=float, nargs=2, default=[2.0, 6.0], help="input and output price per 1M tokens of the large model")
+    tiers_parser.add_argument("--small-price", type=float, nargs=2, default=[0.1, 0.3], help="input and output price per 1M tokens of the small model")
+    tiers_parser.add_argument("--backend-latency", type=float, default=0.005, help="seconds per stubbed database or search call")
+    tiers_parser.set_defaults(func=tiers)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+
+INDEX_FILE = "bm25_index.json"
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "has", "have",
+    "how", "in", "is", "it", "its", "of", "on", "or", "that", "the", "their", "this", "to", "was",
+    "were", "what", "when", "where", "which", "who", "why", "will", "with",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in STOP_WORDS]
+
+
+def collection_fingerprint(ids: List[str]) -> str:
+    """Document count and a hash of the sorted ids; changes whenever documents are added or removed."""
+    digest = hashlib.sha1("\n".join(sorted(ids)).encode("utf-8")).hexdigest()
+    return f"{len(ids)}:{digest}"
+
+
+class BM25Index:
+    """Okapi BM25 over the documents of the Chroma collection.
+
+    Complements dense retrieval on exact terms such as athlete and rule names. Each document
+    keeps its `data-type` label so searches honour the same metadata filter as Chroma. The
+    fingerprint of the indexed ids is saved with the index so a stale index can be detected.
+    """
+
+    def __init__(self, directory: str, k1: float = 1.5, b: float = 0.75) -> None:
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+        self.data_types: List[Optional[str]] = []
+        self.lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.fingerprint: Optional[str] = None
+
+    @staticmethod
+    def exists(directory: Optional[str]) -> bool:
+        return bool(directory) and os.path.exists(os.path.join(directory, INDEX_FILE))
+
+    @classmethod
+    def load(cls, directory: str) -> "BM25Index":
+        with open(os.path.join(directory, INDEX_FILE), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(directory, data["k1"], data["b"])
+        index.ids = data["ids"]
+        index.data_types = data["data_types"]
+        index.lengths = data["lengths"]
+        index.postings = {term: [tuple(posting) for posting in postings] for term, postings in data["postings"].items()}
+        # Indexes saved before fingerprints were stored never match and are rebuilt.
+        index.fingerprint = data.get("fingerprint")
+        return index
+
+    def save(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, INDEX_FILE)
+        # Write to a temporary file first so a running search process never reads a half-written index.
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "k1": self.k1,
+                    "b": self.b,
+                    "ids": self.ids,
+                    "data_types": self.data_types,
+                    "lengths": self.lengths,
+                    "postings": self.postings,
+                    "fingerprint": self.fingerprint,
+                },
+                f,
+            )
+        os.replace(path + ".tmp", path)
+
+    def build(self, ids: List[str], documents: List[str], metadatas: List[Optional[Dict]]) -> Dict[str, int]:
+        self.ids = list(ids)
+        self.fingerprint = collection_fingerprint(self.ids)
+        self.data_types = [(metadata or {}).get("data-type") for metadata in metadatas]
+        self.lengths = []
+        self.postings = {}
+        for position, document in enumerate(documents):
+            tokens = tokenize(document)
+            self.lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self.postings.setdefault(term, []).append((position, frequency))
+        self.save()
+        return {"documents": len(self.ids), "terms": len(self.postings)}
+
+    def search(self, query: str, k: int, labels: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """Top `k` (document id, score) pairs, restricted to documents whose `data-type` is in `labels` when given."""
+        if not self.ids:
+            return []
+        allowed = set(labels) if labels is not None else None
+        average_length = sum(self.lengths) / len(self.lengths) or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (len(self.ids) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings:
+                if allowed is not None and self.data_types[position] not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / average_length)
+                scores[position] = scores.get(position, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        top = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(self.ids[position], score) for position, score in top]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """Merge ranked id lists; each id scores the sum of 1 / (k + rank) over the lists it appears in."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
+
+
+def read_collection_ids(vectorstore: any, batch_size: int = 10000) -> List[str]:
+    ids: List[str] = []
+    offset = 0
+    while True:
+        batch = vectorstore.get(include=[], limit=batch_size, offset=offset)
+        ids.extend(batch["ids"])
+        if len(batch["ids"]) < batch_size:
+            return ids
+        offset += batch_size
+
+
+def read_collection_metadata(vectorstore: any, batch_size: int = 1000) -> Tuple[List[str], List[str], List[Optional[Dict]]]:
+    ids: List[str] = []
+    documents: List[str] = []
+    metadatas: List[Optional[Dict]] = []
+    offset = 0
+    while True:
+        batch = vectorstore.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        ids.extend(batch["ids"])
+        documents.extend(batch["documents"])
+        metadatas.extend(batch["metadatas"])
+        if len(batch["ids"]) < batch_size:
+            return ids, documents, metadatas
+        offset += batch_size
+
+
+def retrieval_cycles(agents: Dict[str, any], queries: List[str]) -> None:
+    """Average grade -> rewrite -> retrieve cycles per question for each vector DB agent."""
+    from langchain_core.messages import HumanMessage
+
+    for name, agent in agents.items():
+        cycles, latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            state = agent.app.invoke({"messages": [HumanMessage(content=query)]})
+            latencies.append(time.perf_counter() - start)
+            cycles.append(state.get("retrieval_tries", 1))
+        rewrites = sum(cycle > 1 for cycle in cycles)
+        print(
+            f"{name:>6} : {sum(cycles) / len(cycles):.2f} retrieval cycles per question | "
+            f"{rewrites}/{len(queries)} questions rewritten | {sum(latencies) / len(latencies):.1f} s per question"
+        )
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Build the BM25 index for hybrid retrieval and measure its effect on retrieval cycles")
+    parser.add_argument("mode", choices=["build", "cycles"], help="build the index, or compare retrieval cycles of dense and hybrid search")
+    parser.add_argument("--directory", type=str, default="", help="index directory (defaults to BM25_INDEX_DIRECTORY)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    directory = args.directory or os.getenv("BM25_INDEX_DIRECTORY", os.path.join(os.environ["VECTOR_DB_DIRECTORY"], "bm25_index"))
+
+    if args.mode == "build":
+        from langchain_chroma import Chroma
+        from model_registry import SharedEmbeddings
+
+        vectorstore = Chroma(persist_directory=os.environ["VECTOR_DB_DIRECTORY"], embedding_function=SharedEmbeddings(os.environ["EMBEDDINGS_MODEL"]))
+        print(BM25Index(directory).build(*read_collection_metadata(vectorstore)))
+        return
+
+    from llm_factory import create_llm
+    from test_suite import textual_queries
+    from vector_db_agent import VectorDBAgent
+
+    llm = create_llm()
+    retrieval_cycles(
+        {"dense": VectorDBAgent(llm), "hybrid": VectorDBAgent(llm, use_hybrid_search=True)},
+        textual_queries,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+EMBEDDINGS_FILE = "chunk_embeddings.npy"
+METADATA_FILE = "chunk_index.json"
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ChunkIndex:
+    """Chunk embeddings for every document of the Chroma collection, computed offline.
+
+    The embeddings are stored as a float32 matrix (memory-mapped when loaded) and the
+    rows belonging to each parent document are contiguous, so the chunks of the
+    retrieved documents can be gathered without splitting or encoding anything.
+    """
+
+    def __init__(self, directory: str, model_name: str) -> None:
+        self.directory = directory
+        self.model_name = model_name
+        self.chunks: List[str] = []
+        self.spans: Dict[str, Tuple[int, int]] = {}
+        self.hashes: Dict[str, str] = {}
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+
+    @staticmethod
+    def exists(directory: Optional[str]) -> bool:
+        return bool(directory) and os.path.exists(os.path.join(directory, METADATA_FILE))
+
+    @classmethod
+    def load(cls, directory: str, model_name: str) -> "ChunkIndex":
+        with open(os.path.join(directory, METADATA_FILE), "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+
+        if metadata["model_name"] != model_name:
+            raise ValueError(
+                f"Chunk index at '{directory}' was built with '{metadata['model_name']}', "
+                f"but '{model_name}' is configured. Rebuild it with: python chunk_index.py build"
+            )
+
+        index = cls(directory, model_name)
+        index.chunks = metadata["chunks"]
+        index.spans = {parent_id: tuple(span) for parent_id, span in metadata["spans"].items()}
+        index.hashes = metadata["hashes"]
+        index.embeddings = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r")
+        return index
+
+    def save(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Write to temporary files first so a running search process never reads a half-written index.
+        embeddings_path = os.path.join(self.directory, EMBEDDINGS_FILE)
+        with open(embeddings_path + ".tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(self.embeddings, dtype=np.float32))
+        os.replace(embeddings_path + ".tmp", embeddings_path)
+
+        metadata_path = os.path.join(self.directory, METADATA_FILE)
+        with open(metadata_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "model_name": self.model_name,
+                    "chunks": self.chunks,
+                    "spans": self.spans,
+                    "hashes": self.hashes,
+                },
+                f,
+            )
+        os.replace(metadata_path + ".tmp", metadata_path)
+
+    def update(self, ids: List[str], documents: List[str], splitter: any, embedding_model: any, rebuild: bool = False) -> Dict[str, int]:
+        """Synchronise the index with the given collection contents.
+
+        Only documents that are new or whose content changed are split and encoded,
+        unless `rebuild` is set. Documents no longer in the collection are dropped.
+        """
+        current = {} if rebuild else dict(self.spans)
+        contents = dict(zip(ids, documents))
+
+        kept = [
+            parent_id for parent_id in ids
+            if parent_id in current and self.hashes.get(parent_id) == _content_hash(contents[parent_id])
+        ]
+        kept_ids = set(kept)
+        changed = [parent_id for parent_id in ids if parent_id not in kept_ids]
+        removed = [parent_id for parent_id in current if parent_id not in contents]
+
+        new_chunks: List[str] = []
+        new_spans: Dict[str, Tuple[int, int]] = {}
+        blocks = []
+
+        for parent_id in kept:
+            start, end = current[parent_id]
+            new_spans[parent_id] = (len(new_chunks), len(new_chunks) + end - start)
+            new_chunks.extend(self.chunks[start:end])
+            blocks.append(np.asarray(self.embeddings[start:end], dtype=np.float32))
+
+        changed_chunks = []
+        for parent_id in changed:
+            parent_chunks = splitter.split_text(contents[parent_id])
+            offset = len(new_chunks) + len(changed_chunks)
+            new_spans[parent_id] = (offset, offset + len(parent_chunks))
+            changed_chunks.extend(parent_chunks)
+
+        if changed_chunks:
+            blocks.append(
+                np.asarray(
+                    embedding_model.encode(changed_chunks, normalize_embeddings=True, show_progress_bar=True),
+                    dtype=np.float32,
+                )
+            )
+        new_chunks.extend(changed_chunks)
+
+        blocks = [block for block in blocks if len(block)]
+        self.embeddings = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+        self.chunks = new_chunks
+        self.spans = new_spans
+        self.hashes = {parent_id: _content_hash(contents[parent_id]) for parent_id in ids}
+        self.save()
+        # Re-open memory-mapped so the freshly built matrix is not kept in process memory.
+        self.embeddings = np.load(os.path.join(self.directory, EMBEDDINGS_FILE), mmap_mode="r")
+
+        return {"kept": len(kept), "encoded": len(changed), "removed": len(removed), "chunks": len(new_chunks)}
+
+    def gather(self, parent_ids: List[str]) -> Tuple[List[str], np.ndarray, List[str]]:
+        """Return the chunks and their embeddings for the given parents, plus the parents not indexed."""
+        chunks: List[str] = []
+        rows = []
+        missing: List[str] = []
+        for parent_id in parent_ids:
+            span = self.spans.get(parent_id)
+            if span is None:
+                missing.append(parent_id)
+                continue
+            start, end = span
+            chunks.extend(self.chunks[start:end])
+            rows.append(self.embeddings[start:end])
+
+        embeddings = np.concatenate(rows) if rows else np.zeros((0, self.embeddings.shape[-1]), dtype=np.float32)
+        return chunks, embeddings, missing
+
+
+def read_collection(vectorstore: any, batch_size: int = 1000) -> Tuple[List[str], List[str]]:
+    ids: List[str] = []
+    documents: List[str] = []
+    offset = 0
+    while True:
+        batch = vectorstore.get(include=["documents"], limit=batch_size, offset=offset)
+        ids.extend(batch["ids"])
+        documents.extend(batch["documents"])
+        if len(batch["ids"]) < batch_size:
+            return ids, documents
+        offset += batch_size
+
+
+def benchmark(vectorDB: any, indexed_vectorDB: any, queries: List[str]) -> None:
+    for name, db in (("live chunking", vectorDB), ("chunk index", indexed_vectorDB)):
+        db.search(queries[0])  # warm up models and caches
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            db.search(query)
+            latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies) * 1000
+        print(
+            f"{name:>14} : mean {latencies.mean():7.1f} ms | p50 {np.percentile(latencies, 50):7.1f} ms | "
+            f"p95 {np.percentile(latencies, 95):7.1f} ms over {len(queries)} queries"
+        )
+
+    matches = sum(vectorDB.search(query) == indexed_vectorDB.search(query) for query in queries)
+    print(f"Identical results : {matches}/{len(queries)}")
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+    from model_registry import SharedEmbeddings
+    from vector_db import VectorDB
+
+    parser = argparse.ArgumentParser(description="Build and benchmark the precomputed chunk-embedding index")
+    parser.add_argument("mode", choices=["build", "update", "benchmark"], help="full rebuild, incremental update or latency benchmark")
+    parser.add_argument("--directory", type=str, default="", help="index directory (defaults to CHUNK_INDEX_DIRECTORY)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    directory = args.directory or os.getenv(
+        "CHUNK_INDEX_DIRECTORY", os.path.join(os.environ["VECTOR_DB_DIRECTORY"], "chunk_index")
+    )
+    embeddings = SharedEmbeddings(os.environ["EMBEDDINGS_MODEL"])
+
+    if args.mode in {"build", "update"}:
+        # Only a full build starts from an empty index; an update loads the existing one.
+        vectorDB = VectorDB(
+            os.environ["VECTOR_DB_DIRECTORY"],
+            embeddings,
+            use_metadata_filtering=False,
+            chunk_index_directory=directory if args.mode == "update" else None,
+        )
+        print(vectorDB.update_chunk_index(directory, rebuild=args.mode == "build"))
+        return
+
+    from test_suite import textual_queries
+
+    vectorDB = VectorDB(os.environ["VECTOR_DB_DIRECTORY"], embeddings, use_metadata_filtering=False)
+    indexed_vectorDB = VectorDB(
+        os.environ["VECTOR_DB_DIRECTORY"],
+        embeddings,
+        use_metadata_filtering=False,
+        chunk_index_directory=directory,
+    )
+    if indexed_vectorDB.chunk_index is None:
+        raise FileNotFoundError(f"No chunk index found at '{directory}'. Build it with: python chunk_index.py build")
+    benchmark(vectorDB, indexed_vectorDB, textual_queries)
+
+
+if __name__ == "__main__":
+    main()
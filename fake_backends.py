@@ -0,0 +1,274 @@
+"""Deterministic stand-ins for the LLM, MySQL, Chroma and Tavily backends.
+
+Used by the stress test and benchmarks to exercise the real agent graphs without
+network access, API keys or model downloads.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import StructuredTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model whose replies come from `responder(messages, tool_names)`.
+
+    Each reply takes `latency` seconds before the first token plus `token_latency` seconds
+    per word; streamed replies are emitted word by word.
+    """
+
+    responder: Callable[[List[BaseMessage], List[str]], AIMessage]
+    latency: float = 0.0
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _respond(self, messages: List[BaseMessage], kwargs: Dict[str, Any]) -> ChatResult:
+        tool_names = [tool["function"]["name"] for tool in kwargs.get("tools", [])]
+        return ChatResult(generations=[ChatGeneration(message=self.responder(messages, tool_names))])
+
+    def _chunks(self, messages: List[BaseMessage], kwargs: Dict[str, Any]) -> List[ChatGenerationChunk]:
+        message = self._respond(messages, kwargs).generations[0].message
+        if message.tool_calls:
+            tool_call_chunks = [
+                {"name": tool_call["name"], "args": json.dumps(tool_call["args"]), "id": tool_call["id"], "index": index}
+                for index, tool_call in enumerate(message.tool_calls)
+            ]
+            return [ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=tool_call_chunks))]
+        return [ChatGenerationChunk(message=AIMessageChunk(content=word)) for word in re.findall(r"\s*\S+\s*", message.content) or [""]]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        result = self._respond(messages, kwargs)
+        time.sleep(self.latency + self.token_latency * len(result.generations[0].message.content.split()))
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        result = self._respond(messages, kwargs)
+        await asyncio.sleep(self.latency + self.token_latency * len(result.generations[0].message.content.split()))
+        return result
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for chunk in self._chunks(messages, kwargs):
+            time.sleep(self.token_latency)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for chunk in self._chunks(messages, kwargs):
+            await asyncio.sleep(self.token_latency)
+            yield chunk
+
+    def bind_tools(self, tools: List[Any], tool_choice: Any = None, **kwargs: Any) -> Any:
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+
+def _tool_call(name: str, args: Dict[str, Any]) -> AIMessage:
+    return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex}"}])
+
+
+def expected_agent(question: str) -> str:
+    """Routing the scripted LLM applies to a question."""
+    text = question.lower()
+    if "2024" in text:
+        return "web_search_agent"
+    if re.search(r"\b(rules?|scor\w*|fouls?|serv\w*|penalt\w*)\b", text):
+        return "vector_db_agent"
+    return "sql_db_agent"
+
+
+def expected_agents(question: str) -> List[str]:
+    """Agents needed for a question whose parts, joined by 'and', may each need a different agent."""
+    return list(dict.fromkeys(expected_agent(part) for part in re.split(r"\band\b", question) if part.strip()))
+
+
+def _answered_by(context: str) -> Optional[str]:
+    if context.startswith("SQL answer"):
+        return "sql_db_agent"
+    if context.startswith("Answer from context"):
+        return "vector_db_agent"
+    return None
+
+
+def olympics_responder(messages: List[BaseMessage], tool_names: List[str]) -> AIMessage:
+    """Scripted replies for every LLM call made by the query processor and its agents."""
+    question = next((m.content for m in messages if isinstance(m, HumanMessage)), "")
+    texts = [m.content for m in messages if isinstance(m.content, str)]
+
+    if "RouteDecision" in tool_names:
+        # One agent per hop: the next agent after the one whose answer the router sees, then generate.
+        agents = expected_agents(question)
+        contexts = [text for text in texts if text.startswith("Retrieved context from previous agent")]
+        if contexts:
+            answered = _answered_by(contexts[-1].split("\n", 1)[-1])
+            remaining = agents[agents.index(answered) + 1:] if answered in agents else []
+            destination = remaining[0] if remaining else "generate"
+        else:
+            destination = agents[0]
+        return _tool_call("RouteDecision", {"destination": destination})
+    if "FanOutRouteDecision" in tool_names:
+        if any(text.startswith("Retrieved context from previous agent") for text in texts):
+            return _tool_call("FanOutRouteDecision", {"destinations": ["generate"]})
+        return _tool_call("FanOutRouteDecision", {"destinations": expected_agents(question)})
+    if "sql_db_schema" in tool_names:
+        return _tool_call("sql_db_schema", {"table_names": "athletes"})
+    if "SubmitFinalAnswer" in tool_names:
+        results = [text for text in texts if text.startswith("Tool output:\n[(")]
+        if results:
+            return _tool_call("SubmitFinalAnswer", {"final_answer": f"SQL answer {results[-1].removeprefix('Tool output:')}"})
+        return AIMessage(content=f"SELECT answer FROM facts WHERE question = '{question}'")
+    if "search_vector_db" in tool_names:
+        return _tool_call("search_vector_db", {"query": question})
+    if "grade" in tool_names:
+        return _tool_call("grade", {"binary_score": "no" if "obscure" in question.lower() else "yes"})
+    if "tavily_search_results_json" in tool_names:
+        return _tool_call("tavily_search_results_json", {"query": question})
+    if any(isinstance(m, SystemMessage) and "Double check" in m.content for m in messages):
+        return AIMessage(content=messages[-1].content)
+    if "Context:" in question and "Question:" in question:
+        context = question.split("Context:", 1)[1].split("Question:", 1)[0].strip()
+        return AIMessage(content=f"Answer from context: {context}")
+    return AIMessage(content=messages[-1].content)
+
+
+class StubEncoder:
+    """SentenceTransformer replacement producing bag-of-words hash embeddings."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+    def encode(self, texts: Any, normalize_embeddings: bool = False, **kwargs: Any) -> np.ndarray:
+        single = isinstance(texts, str)
+        vectors = []
+        for text in [texts] if single else texts:
+            vector = np.full(64, 0.01, dtype=np.float32)
+            for word in text.lower().split():
+                vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1
+            if normalize_embeddings:
+                vector /= np.linalg.norm(vector)
+            vectors.append(vector)
+        return vectors[0] if single else np.stack(vectors)
+
+
+class StubSQLDB:
+    """In-memory replacement for SQLDB; queries mentioning 'unanswerable' fail."""
+
+    def __init__(self, llm: Any = None, verbose: bool = False, latency: float = 0.0, build_latency: float = 0.0, **kwargs: Any) -> None:
+        time.sleep(build_latency)
+        self.latency = latency
+        self.schema = {
+            "tables": ["athletes"],
+            "table_info": {"athletes": "CREATE TABLE athletes (\n\tathlete_id INTEGER, \n\tname VARCHAR(100)\n)"},
+            "columns": {"athletes": [{"name": "athlete_id", "nullable": False}, {"name": "name", "nullable": True}]},
+        }
+
+    def get_schema(self) -> Dict:
+        return self.schema
+
+    def get_usable_table_names(self) -> List[str]:
+        return list(self.schema["tables"])
+
+    def get_table_info(self, table_names: Optional[List[str]] = None) -> str:
+        return "\n\n".join(self.schema["table_info"][table] for table in table_names or self.schema["tables"])
+
+    def run_query(self, query: str) -> str:
+        time.sleep(self.latency)
+        if "unanswerable" in query.lower():
+            return "Error: (1054, \"Unknown column 'unanswerable'\")"
+        match = re.search(r"question = '(.*)'", query)
+        return f"[('row for {match.group(1) if match else query}',)]"
+
+    def get_tools(self) -> List[StructuredTool]:
+        return [
+            StructuredTool.from_function(
+                func=lambda tool_input="": ", ".join(self.get_usable_table_names()),
+                name="sql_db_list_tables",
+                description="Input is an empty string, output is a comma-separated list of tables in the database.",
+            ),
+            StructuredTool.from_function(
+                func=lambda table_names: self.get_table_info([t.strip() for t in table_names.split(",")]),
+                name="sql_db_schema",
+                description="Get the schema and sample rows for the specified SQL tables.",
+            ),
+        ]
+
+
+class StubVectorDB:
+    """In-memory replacement for VectorDB."""
+
+    def __init__(self, *args: Any, latency: float = 0.0, build_latency: float = 0.0, **kwargs: Any) -> None:
+        time.sleep(build_latency)
+        self.latency = latency
+
+    def search(self, query: str) -> str:
+        time.sleep(self.latency)
+        return f"documents about {query}"
+
+    def search_many(self, queries: List[str]) -> List[str]:
+        return [self.search(query) for query in queries]
+
+    def search_batch(self, queries: List[str]) -> str:
+        return "\n\n".join(self.search_many(queries))
+
+    def prefetch(self, queries: List[str]) -> None:
+        pass
+
+    def as_tool(self) -> StructuredTool:
+        return StructuredTool.from_function(func=self.search, name="search_vector_db", description="Search the vector database")
+
+    def as_batch_tool(self) -> StructuredTool:
+        return StructuredTool.from_function(func=self.search_batch, name="search_vector_db_batch", description="Search the vector database for several queries")
+
+
+def stub_web_search(max_results: int = 2, latency: float = 0.0, build_latency: float = 0.0) -> StructuredTool:
+    time.sleep(build_latency)
+
+    def search(query: str) -> str:
+        time.sleep(latency)
+        return f"web results about {query}"
+
+    return StructuredTool.from_function(func=search, name="tavily_search_results_json", description="Search the web")
+
+
+@contextmanager
+def stubbed_backends(backend_latency: float = 0.0, build_latency: float = 0.0) -> Iterator[None]:
+    """
+    Swap the database, vector store, web search and embedding backends of the agents for stubs.
+    `build_latency` seconds are spent constructing each backend, like opening a connection or loading models.
+    """
+    import query_processor
+    import sql_db_agent
+    import vector_db_agent
+    import web_search_agent
+
+    patches = [
+        (query_processor, "sentence_transformer", lambda *args, **kwargs: StubEncoder()),
+        (sql_db_agent, "SQLDB", lambda llm, verbose=False, **kwargs: StubSQLDB(llm, verbose, latency=backend_latency, build_latency=build_latency)),
+        (sql_db_agent, "sentence_transformer", lambda *args, **kwargs: StubEncoder()),
+        (vector_db_agent, "VectorDB", lambda *args, **kwargs: StubVectorDB(latency=backend_latency, build_latency=build_latency)),
+        (vector_db_agent, "SharedEmbeddings", lambda *args, **kwargs: None),
+        (web_search_agent, "TavilySearchResults", lambda max_results=2: stub_web_search(max_results, backend_latency, build_latency)),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    os.environ.setdefault("VECTOR_DB_DIRECTORY", "unused")
+    os.environ.setdefault("EMBEDDINGS_MODEL", "unused")
+    try:
+        for module, name, replacement in patches:
+            setattr(module, name, replacement)
+        yield
+    finally:
+        for module, name, original in originals:
+            setattr(module, name, original)
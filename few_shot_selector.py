@@ -0,0 +1,97 @@
+import time
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.messages import SystemMessage
+
+from cache import LRUCache
+
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+
+class FewShotSelector:
+    """Picks the few-shot SQL examples whose inputs are most similar to the question.
+
+    Example inputs are embedded once; the rendered example messages are cached per question
+    so retries of the same question reuse them. Selected examples keep their order in
+    `examples`, so questions sharing their first examples also share a longer prompt prefix
+    that the model server can reuse from its cache.
+    """
+
+    def __init__(self, examples: List[Dict], embedding_model: any, k: int = 5, cache_size: int = 256) -> None:
+        self.examples = examples
+        self.embedding_model = embedding_model
+        self.k = k
+        self.example_embeddings = np.asarray(
+            embedding_model.encode([example["input"] for example in examples], normalize_embeddings=True)
+        )
+        self.cache = LRUCache(cache_size)
+
+    def select(self, question: str) -> List[Dict]:
+        question_embedding = np.asarray(self.embedding_model.encode(question, normalize_embeddings=True))
+        scores = self.example_embeddings @ question_embedding
+        top = np.sort(np.argsort(-scores, kind="stable")[: self.k])
+        return [self.examples[i] for i in top]
+
+    def render(self, question: str) -> List[SystemMessage]:
+        messages = self.cache.get(question)
+        if messages is None:
+            messages = [
+                SystemMessage(content=f"User input: {example['input']}\nSQL query: {example['query']}")
+                for example in self.select(question)
+            ]
+            self.cache.set(question, messages)
+        return messages
+
+
+def compare(llm: any, full_prompt: any, selected_prompt: any, selector: FewShotSelector, queries: List[str]) -> None:
+    """Report prompt tokens, time-to-first-token and total latency with all examples versus selected ones."""
+    from langchain_core.messages import HumanMessage
+
+    for name, build in (
+        ("all examples", lambda query: full_prompt.format_messages(messages=[HumanMessage(content=query)])),
+        (f"top {selector.k} examples", lambda query: selected_prompt.format_messages(
+            messages=[HumanMessage(content=query)], examples=selector.render(query)
+        )),
+    ):
+        tokens, first_token, total = [], [], []
+        for query in queries:
+            messages = build(query)
+            tokens.append(llm.get_num_tokens_from_messages(messages))
+            start = time.perf_counter()
+            for index, _ in enumerate(llm.stream(messages)):
+                if index == 0:
+                    first_token.append(time.perf_counter() - start)
+            total.append(time.perf_counter() - start)
+        print(
+            f"{name:>16} : {np.mean(tokens):7.0f} prompt tokens | TTFT {np.mean(first_token) * 1000:6.0f} ms | "
+            f"total {np.mean(total) * 1000:6.0f} ms per query"
+        )
+
+
+if __name__ == "__main__":
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, SystemMessagePromptTemplate
+
+    from few_shots import few_shots
+    from llm_factory import create_llm
+    from model_registry import sentence_transformer
+    from prompts import query_gen_few_shot_system_prompt
+    from test_suite import analytical_queries
+
+    selector = FewShotSelector(few_shots, sentence_transformer(EMBEDDING_MODEL))
+    full_prompt = ChatPromptTemplate.from_messages(
+        [
+            SystemMessagePromptTemplate.from_template(query_gen_few_shot_system_prompt),
+            *[SystemMessage(content=f"User input: {example['input']}\nSQL query: {example['query']}") for example in few_shots],
+            MessagesPlaceholder(variable_name="messages"),
+        ]
+    )
+    selected_prompt = ChatPromptTemplate.from_messages(
+        [
+            SystemMessagePromptTemplate.from_template(query_gen_few_shot_system_prompt),
+            MessagesPlaceholder(variable_name="examples"),
+            MessagesPlaceholder(variable_name="messages"),
+        ]
+    )
+    compare(create_llm(), full_prompt, selected_prompt, selector, analytical_queries)
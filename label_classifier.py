@@ -0,0 +1,146 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List
+
+import numpy as np
+
+
+# Labels of the `data-type` metadata field in the vector database, with the descriptions
+# used by the embedding classifier.
+DATA_TYPE_LABELS = {
+    "Badminton Rules": "Badminton rules: court, shuttlecock, racket, serving, faults and scoring of badminton games",
+    "Basketball Rules": "Basketball rules: court, baskets, three point shots, fouls, violations and scoring in basketball",
+    "Boxing Rules": "Boxing rules: rounds, bouts, referee, judges, punches, weight classes and scoring in boxing",
+    "Breaking Rules": "Breaking and breakdancing rules: battles, b-boys, b-girls, moves, routines and judging of breaking",
+    "Fencing Rules": "Fencing rules: foil, epee, sabre, touches, piste, priority and scoring in fencing",
+    "Gymnastics Rules": "Gymnastics rules: apparatus, routines, code of points, D-score, E-score, deductions and finals",
+    "Handball Rules": "Handball rules: court, goals, passive play, penalties, throws and fouls in handball",
+    "Judo Rules": "Judo rules: ippon, waza-ari, throws, holds, penalties and scoring of judo contests",
+    "Table Tennis Rules": "Table tennis rules: table, net, ball, serving, rallies, equipment and scoring in table tennis",
+    "Taekwondo Rules": "Taekwondo rules: kicks, punches, rounds, protectors and scoring points in taekwondo",
+    "Weightlifting Rules": "Weightlifting rules: snatch, clean and jerk, attempts, lifts and judging of weightlifting competitions",
+    "Wrestling Rules": "Wrestling rules: freestyle, Greco-Roman, falls, pins, passivity, fouls and points in wrestling",
+    "Olympic News": "Olympic news: recent events, announcements, results and stories about the Olympic Games",
+    "Olympic Term Definition": "Olympic terms and definitions: meaning of Olympic concepts, committees, ceremonies and terminology",
+    "Player Data": "Player data: biography, career and achievements of an Olympic athlete or player",
+}
+
+
+# Labels scoring above this are used in the filter. Kept from the zero-shot classifier the filtering
+# started with; both classifiers' scores sum to one over the labels, so the same cut-off applies.
+LABEL_THRESHOLD = 0.15
+# Softmax temperature of the embedding classifier. MiniLM cosine similarities between a query and the
+# label descriptions differ by tenths, so at 0.05 a label 0.1 ahead gets e^2 (about 7.4) times the
+# probability of the next one and only the closest few labels clear LABEL_THRESHOLD. `python
+# label_classifier.py --temperature` reports labels per query and agreement with the zero-shot labels
+# on the textual test_suite questions, to recalibrate it for another model.
+LABEL_TEMPERATURE = 0.05
+
+
+class LabelClassifier(ABC):
+    """Chooses the `data-type` labels used to filter vector database retrieval.
+
+    Subclasses score every label for a query; labels scoring above the threshold are used
+    in the `$in` Chroma filter, or the best label alone when none does.
+    """
+
+    def __init__(self, labels: List[str], threshold: float = LABEL_THRESHOLD) -> None:
+        self.labels = labels
+        self.threshold = threshold
+
+    @abstractmethod
+    def scores_many(self, queries: List[str]) -> List[Dict[str, float]]:
+        """Score of every label for each query."""
+
+    def scores(self, query: str) -> Dict[str, float]:
+        return self.scores_many([query])[0]
+
+    def classify_many(self, queries: List[str]) -> List[List[str]]:
+        return [self._above_threshold(scores) for scores in self.scores_many(queries)]
+
+    def _above_threshold(self, scores: Dict[str, float]) -> List[str]:
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        # An empty `$in` filter matches no documents, so the best label is kept when none clears the threshold.
+        return [label for label in ranked if scores[label] > self.threshold] or ranked[:1]
+
+    def classify(self, query: str) -> List[str]:
+        return self.classify_many([query])[0]
+
+
+class ZeroShotLabelClassifier(LabelClassifier):
+    """Zero-shot NLI classification; one forward pass per label and query."""
+
+    def __init__(self, labels: List[str], threshold: float = LABEL_THRESHOLD, model: str = "facebook/bart-large-mnli", backend: str = None) -> None:
+        from model_registry import zero_shot_classifier
+
+        super().__init__(labels, threshold)
+        self.classifier = zero_shot_classifier(model, backend=backend)
+
+    def scores_many(self, queries: List[str]) -> List[Dict[str, float]]:
+        results = self.classifier(queries, candidate_labels=self.labels)
+        if isinstance(results, dict):
+            results = [results]
+        return [dict(zip(result["labels"], result["scores"])) for result in results]
+
+
+class EmbeddingLabelClassifier(LabelClassifier):
+    """Cosine similarity between the query and label descriptions embedded once at startup.
+
+    Similarities are turned into a softmax distribution over the labels so the same
+    threshold as the zero-shot classifier applies.
+    """
+
+    def __init__(self, embedding_model: any, descriptions: Dict[str, str] = DATA_TYPE_LABELS, threshold: float = LABEL_THRESHOLD, temperature: float = LABEL_TEMPERATURE) -> None:
+        super().__init__(list(descriptions), threshold)
+        self.embedding_model = embedding_model
+        self.temperature = temperature
+        self.label_embeddings = np.asarray(
+            embedding_model.encode(list(descriptions.values()), normalize_embeddings=True)
+        )
+
+    def scores_many(self, queries: List[str]) -> List[Dict[str, float]]:
+        query_embeddings = np.asarray(self.embedding_model.encode(queries, normalize_embeddings=True))
+        logits = (query_embeddings @ self.label_embeddings.T) / self.temperature
+        probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        return [dict(zip(self.labels, row.tolist())) for row in probabilities]
+
+
+def compare(reference: LabelClassifier, candidate: LabelClassifier, queries: List[str]) -> None:
+    results = {}
+    for name, classifier in (("zero-shot", reference), ("embedding", candidate)):
+        classifier.classify(queries[0])  # warm up
+        start = time.perf_counter()
+        results[name] = [classifier.classify(query) for query in queries]
+        elapsed = (time.perf_counter() - start) * 1000 / len(queries)
+        sizes = [len(labels) for labels in results[name]]
+        print(f"{name:>10} : {elapsed:8.1f} ms/query | {np.mean(sizes):.2f} labels/query on average")
+
+    top_agreement = np.mean([
+        bool(ref) and bool(cand) and ref[0] == cand[0]
+        for ref, cand in zip(results["zero-shot"], results["embedding"])
+    ])
+    covered = np.mean([
+        bool(ref) and ref[0] in cand
+        for ref, cand in zip(results["zero-shot"], results["embedding"])
+    ])
+    print(f"Top label agreement with zero-shot : {top_agreement:.1%}")
+    print(f"Zero-shot top label kept in filter : {covered:.1%}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from model_registry import sentence_transformer
+    from test_suite import textual_queries
+    from vector_db import SEMANTIC_FILTERING_MODEL
+
+    parser = argparse.ArgumentParser(description="Compare the embedding label classifier with the zero-shot classifier on the textual test_suite questions")
+    parser.add_argument("--temperature", type=float, default=LABEL_TEMPERATURE, help="softmax temperature of the embedding classifier")
+    parser.add_argument("--threshold", type=float, default=LABEL_THRESHOLD, help="score a label needs to be used in the filter")
+    args = parser.parse_args()
+    compare(
+        ZeroShotLabelClassifier(list(DATA_TYPE_LABELS), args.threshold),
+        EmbeddingLabelClassifier(sentence_transformer(SEMANTIC_FILTERING_MODEL), threshold=args.threshold, temperature=args.temperature),
+        textual_queries,
+    )
@@ -1,26 +1,25 @@
 import os
 from importlib import import_module
-from typing import Optional
+from typing import Any, Dict, Optional, Union
 
 from dotenv import load_dotenv
-from langchain_core.rate_limiters import InMemoryRateLimiter
 
+from rate_limiter import TokenUsageCallback, rate_limiter_for
 
-def _build_rate_limiter() -> InMemoryRateLimiter:
-    requests_per_second = float(os.getenv("LLM_REQUESTS_PER_SECOND", "0.3"))
-    check_every_n_seconds = float(os.getenv("LLM_RATE_LIMIT_CHECK_SECONDS", "0.1"))
-    return InMemoryRateLimiter(
-        requests_per_second=requests_per_second,
-        check_every_n_seconds=check_every_n_seconds,
-    )
+
+# The parts of the pipeline that can run on their own model.
+LLM_ROLES = ("router", "grader", "sql_generator", "sql_checker", "contextualizer", "generator")
 
 
-def create_llm(provider: Optional[str] = None, temperature: Optional[float] = None):
+def create_llm(provider: Optional[str] = None, temperature: Optional[float] = None, model: Optional[str] = None):
     """Create and return an LLM chat model based on environment configuration.
 
     Supported providers:
     - mistral_api: Mistral hosted API via langchain-mistralai
     - ollama_local: Local models served through Ollama via langchain-ollama
+    - pool: Several of the above (LLM_POOL_BACKENDS), with latency-aware routing and failover
+
+    `model` overrides the provider's model from the environment.
     """
     load_dotenv()
 
@@ -29,10 +28,76 @@ def create_llm(provider: Optional[str] = None, temperature: Optional[float] = No
         float(os.getenv("LLM_TEMPERATURE", "0.1")) if temperature is None else temperature
     )
 
-    if selected_provider == "mistral_api":
+    if selected_provider == "pool":
+        from llm_pool import LLMPool
+
+        # Comma-separated backends, each a provider with an optional @base_url for Ollama hosts.
+        entries = [
+            entry.strip()
+            for entry in os.getenv("LLM_POOL_BACKENDS", "ollama_local,mistral_api").split(",")
+            if entry.strip()
+        ]
+        timeout = os.getenv("LLM_POOL_TIMEOUT", "60")
+        backends = []
+        for entry in entries:
+            backend_provider, _, base_url = entry.partition("@")
+            backends.append(
+                _create_provider_llm(
+                    backend_provider.strip().lower(),
+                    selected_temperature,
+                    base_url=base_url.strip() or None,
+                    timeout=float(timeout) if timeout else None,
+                    model=model,
+                )
+            )
+        return LLMPool(
+            backends=backends,
+            names=entries,
+            cooldown=float(os.getenv("LLM_POOL_COOLDOWN_SECONDS", "5")),
+        )
+
+    return _create_provider_llm(selected_provider, selected_temperature, model=model)
+
+
+def create_llm_roles(temperature: Optional[float] = None) -> Dict[str, Any]:
+    """Create one LLM per role in `LLM_ROLES`, configured by LLM_ROLE_<ROLE>_PROVIDER and LLM_ROLE_<ROLE>_MODEL.
+
+    Roles without either variable use the default LLM. Roles with the same provider and model
+    share one instance.
+    """
+    load_dotenv()
+
+    llms = {}
+    roles = {}
+    for role in LLM_ROLES:
+        provider = os.getenv(f"LLM_ROLE_{role.upper()}_PROVIDER") or None
+        model = os.getenv(f"LLM_ROLE_{role.upper()}_MODEL") or None
+        key = (provider, model)
+        if key not in llms:
+            llms[key] = create_llm(provider, temperature, model)
+        roles[role] = llms[key]
+    return roles
+
+
+def resolve_llm(llm: Union[Any, Dict[str, Any]], role: str) -> Any:
+    """The LLM for a role, given either a single LLM or the mapping returned by `create_llm_roles()`."""
+    if isinstance(llm, dict):
+        return llm[role] if role in llm else llm["generator"]
+    return llm
+
+
+def _create_provider_llm(
+    provider: str,
+    temperature: float,
+    base_url: Optional[str] = None,
+    timeout: Optional[float] = None,
+    model: Optional[str] = None,
+):
+    """A single provider's chat model. `timeout` is only set for pooled backends."""
+    if provider == "mistral_api":
         from langchain_mistralai import ChatMistralAI
 
-        model_name = os.getenv("MISTRAL_LLM_MODEL", "mistral-large-latest")
+        model_name = model or os.getenv("MISTRAL_LLM_MODEL", "mistral-large-latest")
         use_rate_limiter = os.getenv("LLM_USE_RATE_LIMITER", "true").strip().lower() in {
             "1",
             "true",
@@ -42,14 +107,21 @@ def create_llm(provider: Optional[str] = None, temperature: Optional[float] = No
 
         kwargs = {
             "model_name": model_name,
-            "temperature": selected_temperature,
+            "temperature": temperature,
         }
         if use_rate_limiter:
-            kwargs["rate_limiter"] = _build_rate_limiter()
+            # Shared by every LLM created for this model, so they draw from one budget.
+            rate_limiter = rate_limiter_for(provider, model_name)
+            kwargs["rate_limiter"] = rate_limiter
+            kwargs["callbacks"] = [TokenUsageCallback(rate_limiter)]
+        if timeout is not None:
+            # In a pool a throttled call goes to another backend instead of being retried here.
+            kwargs["timeout"] = int(timeout)
+            kwargs["max_retries"] = 1
 
         return ChatMistralAI(**kwargs)
 
-    if selected_provider in {"ollama_local", "ollama"}:
+    if provider in {"ollama_local", "ollama"}:
         try:
             ChatOllama = import_module("langchain_ollama").ChatOllama
         except ImportError as exc:
@@ -57,21 +129,28 @@ def create_llm(provider: Optional[str] = None, temperature: Optional[float] = No
                 "LLM_PROVIDER=ollama_local requires 'langchain-ollama'. Install it with: pip install langchain-ollama"
             ) from exc
 
-        model_name = os.getenv("OLLAMA_MODEL", "gpt-oss:20b")
-        base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        model_name = model or os.getenv("OLLAMA_MODEL", "gpt-oss:20b")
+        base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 
         kwargs = {
             "model": model_name,
             "base_url": base_url,
-            "temperature": selected_temperature,
+            "temperature": temperature,
         }
 
+        keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        # Ollama reuses the KV cache of a matching prompt prefix only while the model stays
+        # loaded, and reloads it (dropping the cache) whenever num_ctx changes between calls.
+        kwargs["keep_alive"] = int(keep_alive) if keep_alive.lstrip("-").isdigit() else keep_alive
+
         num_ctx = os.getenv("OLLAMA_NUM_CTX")
         if num_ctx:
             kwargs["num_ctx"] = int(num_ctx)
+        if timeout is not None:
+            kwargs["client_kwargs"] = {"timeout": timeout}
 
         return ChatOllama(**kwargs)
 
     raise ValueError(
-        "Unsupported LLM_PROVIDER. Use one of: 'mistral_api', 'ollama_local'."
+        "Unsupported LLM_PROVIDER. Use one of: 'mistral_api', 'ollama_local', 'pool'."
     )
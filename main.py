@@ -1,14 +1,27 @@
+import os
 from dotenv import load_dotenv
 import streamlit as st
 from query_processor import QueryProcessor
-from llm_factory import create_llm
+from llm_factory import create_llm_roles
 
 load_dotenv()
 
-queryProcessor = QueryProcessor(
-    create_llm(),
-    verbose = True
-    )
+def env_flag(name : str) -> bool:
+    return os.getenv(name, "false").strip().lower() in {"1", "true", "yes", "on"}
+
+@st.cache_resource
+def get_query_processor() -> QueryProcessor:
+    # Built once per server process; the agents are warmed in background threads so the page renders immediately.
+    return QueryProcessor(
+        create_llm_roles(),
+        verbose = True,
+        use_answer_cache = env_flag("USE_ANSWER_CACHE"),
+        use_hybrid_search = env_flag("USE_HYBRID_SEARCH"),
+        use_reranking = env_flag("USE_RERANKING"),
+        startup_mode = "background"
+        )
+
+queryProcessor = get_query_processor()
 
 # Streamlit interface
 st.title("Sports LLM")
@@ -27,14 +40,27 @@ if question := st.chat_input("Enter Your Query"):
     with st.chat_message("user"):
         st.markdown(question)
 
-    response = queryProcessor.processQuery(question, st.session_state.chat_history)
+    # Display bot message in the chat interface as it is generated
+    with st.chat_message("assistant"):
+        status = st.status("Thinking...")
+        final = {}
+
+        def answer_tokens():
+            for event in queryProcessor.streamQuery(question, st.session_state.chat_history):
+                if event.kind == "progress":
+                    status.update(label = event.content + "...")
+                    status.write(event.content)
+                elif event.kind == "token":
+                    yield event.content
+                else:
+                    final["answer"] = event.content
+            status.update(label = "Done", state = "complete", expanded = False)
+
+        streamed = st.write_stream(answer_tokens())
+        response = final.get("answer", streamed)
 
     # Append user message to chat history
     st.session_state.chat_history.append({"role": "user", "content": question})
 
     # Append bot response to chat history
-    st.session_state.chat_history.append({"role": "assistant", "content": response})
-
-    # Display bot message in the chat interface
-    with st.chat_message("assistant"):
-        st.markdown(response)
\ No newline at end of file
+    st.session_state.chat_history.append({"role": "assistant", "content": response})
\ No newline at end of file
@@ -0,0 +1,206 @@
+"""Process-wide registry of the local models used by the agents.
+
+Every agent asks the registry for its sentence-transformer, cross-encoder and zero-shot models
+instead of loading its own copy, so a process running several agents (or several variants of one
+agent, as in `trulens_tester.py`) holds each model once per name, device, dtype and backend
+(`RETRIEVAL_MODEL_BACKEND`, see `onnx_backend.py`).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from onnx_backend import load_sentence_transformer, load_zero_shot_classifier, selected_backend
+
+
+_models: Dict[Tuple, any] = {}
+_load_locks: Dict[Tuple, Lock] = {}
+_lock = Lock()
+_stats = {"loads": 0, "reuses": 0}
+# Turned off only by the report below to measure the cost of loading a copy per use.
+_sharing = True
+
+
+# Prefixes of the models published under 'sentence-transformers/' that are usually referred to by their bare name.
+SENTENCE_TRANSFORMERS_PREFIXES = (
+    "all-", "paraphrase-", "multi-qa-", "msmarco-", "nli-", "stsb-", "distiluse-", "gtr-t5-", "sentence-t5-",
+    "average_word_embeddings_", "clip-ViT-", "LaBSE", "quora-", "use-cmlm-", "allenai-specter", "facebook-dpr-",
+)
+
+
+def canonical_model_name(name: str) -> str:
+    """Bare sentence-transformers names such as 'all-MiniLM-L6-v2' resolve to the 'sentence-transformers/' repository.
+
+    Other bare names, such as 'bert-base-uncased', are top-level Hugging Face repositories and are kept as-is.
+    """
+    name = name.strip()
+    if "/" in name or os.path.isdir(name) or not name.startswith(SENTENCE_TRANSFORMERS_PREFIXES):
+        return name
+    return f"sentence-transformers/{name}"
+
+
+def _default_device(device: Optional[str]) -> Optional[str]:
+    return device or os.getenv("MODEL_DEVICE") or None
+
+
+def _default_dtype(dtype: Optional[str]) -> Optional[str]:
+    return dtype or os.getenv("MODEL_DTYPE") or None
+
+
+def get_model(kind: str, name: str, device: Optional[str], dtype: Optional[str], load: Callable[[], any]) -> any:
+    """Return the shared model for the key, calling `load` only the first time it is requested."""
+    key = (kind, name, device, dtype)
+    if not _sharing:
+        with _lock:
+            _stats["loads"] += 1
+        return load()
+    with _lock:
+        if key in _models:
+            _stats["reuses"] += 1
+            return _models[key]
+        load_lock = _load_locks.setdefault(key, Lock())
+
+    # Different models load in parallel; concurrent requests for the same model wait for one load.
+    with load_lock:
+        with _lock:
+            if key in _models:
+                _stats["reuses"] += 1
+                return _models[key]
+        model = load()
+        with _lock:
+            _models[key] = model
+            _stats["loads"] += 1
+        return model
+
+
+def sentence_transformer(name: str, device: Optional[str] = None, dtype: Optional[str] = None, backend: Optional[str] = None) -> any:
+    name, device, dtype, backend = canonical_model_name(name), _default_device(device), _default_dtype(dtype), selected_backend(backend)
+    if backend != "torch":
+        return get_model(f"sentence_transformer_{backend}", name, device, None, lambda: load_sentence_transformer(name, backend, device))
+
+    from sentence_transformers import SentenceTransformer
+
+    kwargs = {"model_kwargs": {"torch_dtype": dtype}} if dtype else {}
+    return get_model(
+        "sentence_transformer", name, device, dtype,
+        lambda: SentenceTransformer(name, device=device, **kwargs),
+    )
+
+
+def cross_encoder(name: str, device: Optional[str] = None, dtype: Optional[str] = None) -> any:
+    # Reranking always runs with torch; RETRIEVAL_MODEL_BACKEND does not apply.
+    device, dtype = _default_device(device), _default_dtype(dtype)
+
+    from sentence_transformers import CrossEncoder
+
+    kwargs = {"model_kwargs": {"torch_dtype": dtype}} if dtype else {}
+    return get_model(
+        "cross_encoder", name, device, dtype,
+        lambda: CrossEncoder(name, device=device, **kwargs),
+    )
+
+
+def zero_shot_classifier(name: str = "facebook/bart-large-mnli", device: Optional[str] = None, dtype: Optional[str] = None, backend: Optional[str] = None) -> any:
+    device, dtype, backend = _default_device(device), _default_dtype(dtype), selected_backend(backend)
+    if backend != "torch":
+        # ONNX Runtime runs on the CPU.
+        return get_model(f"zero_shot_classifier_{backend}", name, None, None, lambda: load_zero_shot_classifier(name, backend))
+
+    from transformers import pipeline
+
+    kwargs = {"device": device} if device else {}
+    if dtype:
+        kwargs["torch_dtype"] = dtype
+    return get_model(
+        "zero_shot_classifier", name, device, dtype,
+        lambda: pipeline("zero-shot-classification", model=name, **kwargs),
+    )
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        return {**_stats, "models": len(_models)}
+
+
+class SharedEmbeddings(Embeddings):
+    """LangChain embeddings backed by the registry's sentence-transformer.
+
+    Drop-in replacement for `HuggingFaceEmbeddings(model_name=...)` with its default
+    settings, so Chroma and the semantic filtering share one model when the names match.
+    """
+
+    def __init__(self, model_name: str, device: Optional[str] = None, dtype: Optional[str] = None) -> None:
+        self.model_name = canonical_model_name(model_name)
+        self.client = sentence_transformer(self.model_name, device, dtype)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Same preprocessing as HuggingFaceEmbeddings, so stored vectors remain comparable.
+        texts = [text.replace("\n", " ") for text in texts]
+        return self.client.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def _peak_rss_mb() -> float:
+    import resource
+
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _load_variants(shared: bool) -> Dict[str, float]:
+    """Build the four VectorDBAgent variants of trulens_tester.py and measure time and memory."""
+    global _sharing
+    from dotenv import load_dotenv
+    from llm_factory import create_llm
+    from vector_db_agent import VectorDBAgent
+
+    load_dotenv()
+    _sharing = shared
+    llm = create_llm()
+    variants = [
+        {"use_semantic_filtering": False, "use_metadata_filtering": False},
+        {"use_metadata_filtering": False},
+        {"use_semantic_filtering": False},
+        {},
+    ]
+    start = time.perf_counter()
+    agents = []
+    for kwargs in variants:
+        agents.append(VectorDBAgent(llm, **kwargs))
+    return {"startup_seconds": time.perf_counter() - start, "peak_rss_mb": _peak_rss_mb(), **stats()}
+
+
+def report() -> None:
+    """Run the four-variant evaluation setup with and without sharing, each in a fresh process."""
+    results = {}
+    for mode in ("separate", "shared"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--variant", mode], check=True, capture_output=True, text=True
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    for mode, result in results.items():
+        print(
+            f"{mode:>8} models : startup {result['startup_seconds']:6.1f} s | peak RSS {result['peak_rss_mb']:7.0f} MB | "
+            f"{result['loads']} model loads, {result['reuses']} reuses"
+        )
+    saved = results["separate"]["peak_rss_mb"] - results["shared"]["peak_rss_mb"]
+    print(f"Memory saved : {saved:.0f} MB | startup {results['separate']['startup_seconds'] / results['shared']['startup_seconds']:.1f}x faster")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report startup time and memory of the four VectorDBAgent variants with and without shared models")
+    parser.add_argument("--variant", choices=["separate", "shared"], help="measure one setup in this process and print JSON")
+    args = parser.parse_args()
+    if args.variant:
+        print(json.dumps(_load_variants(args.variant == "shared")))
+    else:
+        report()
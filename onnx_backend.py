@@ -0,0 +1,179 @@
+"""ONNX Runtime backends for the retrieval models, with optional dynamic int8 quantization.
+
+`RETRIEVAL_MODEL_BACKEND` selects how `model_registry` loads the sentence-transformer and
+zero-shot models: `torch` (default), `onnx` or `onnx_int8`. Exported models are written once to
+`ONNX_MODEL_DIRECTORY` and reused on later starts.
+
+python onnx_backend.py parity      # embedding cosine similarity and label agreement against torch
+python onnx_backend.py benchmark   # latency and memory of each backend
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from importlib import import_module
+from typing import Dict, List
+
+import numpy as np
+
+
+BACKENDS = ("torch", "onnx", "onnx_int8")
+
+
+def selected_backend(backend: str = None) -> str:
+    backend = (backend or os.getenv("RETRIEVAL_MODEL_BACKEND", "torch")).strip().lower()
+    if backend not in BACKENDS:
+        raise ValueError("Unsupported RETRIEVAL_MODEL_BACKEND. Use one of: 'torch', 'onnx', 'onnx_int8'.")
+    return backend
+
+
+def _export_directory(name: str, backend: str) -> str:
+    root = os.getenv("ONNX_MODEL_DIRECTORY", os.path.join(os.path.expanduser("~"), ".cache", "arena_insight", "onnx"))
+    return os.path.join(root, name.replace("/", "--"), backend)
+
+
+def _quantization_config() -> str:
+    # Instruction set targeted by the int8 kernels: arm64, avx2, avx512 or avx512_vnni.
+    return os.getenv("ONNX_QUANTIZATION", "avx2").strip().lower()
+
+
+def _require(module: str, extra: str) -> any:
+    try:
+        return import_module(module)
+    except ImportError as exc:
+        raise ImportError(
+            f"RETRIEVAL_MODEL_BACKEND=onnx requires '{extra}'. Install it with: pip install {extra}"
+        ) from exc
+
+
+def load_sentence_transformer(name: str, backend: str, device: str = None) -> any:
+    """Load `name` with ONNX Runtime, exporting (and quantizing) it on first use."""
+    _require("onnxruntime", "sentence-transformers[onnx]")
+    sentence_transformers = import_module("sentence_transformers")
+    directory = _export_directory(name, backend)
+    file_name = "model.onnx" if backend == "onnx" else f"model_qint8_{_quantization_config()}.onnx"
+
+    if not os.path.exists(os.path.join(directory, "onnx", file_name)):
+        model = sentence_transformers.SentenceTransformer(name, device=device, backend="onnx")
+        model.save_pretrained(directory)
+        if backend == "onnx_int8":
+            sentence_transformers.export_dynamic_quantized_onnx_model(
+                model, quantization_config=_quantization_config(), model_name_or_path=directory
+            )
+    return sentence_transformers.SentenceTransformer(
+        directory, device=device, backend="onnx", model_kwargs={"file_name": f"onnx/{file_name}"}
+    )
+
+
+def load_zero_shot_classifier(name: str, backend: str) -> any:
+    """Zero-shot classification pipeline running an ONNX export of `name`."""
+    onnxruntime = _require("optimum.onnxruntime", "optimum[onnxruntime]")
+    transformers = import_module("transformers")
+    directory = _export_directory(name, backend)
+    file_name = "model.onnx" if backend == "onnx" else "model_quantized.onnx"
+
+    if not os.path.exists(os.path.join(directory, file_name)):
+        model = onnxruntime.ORTModelForSequenceClassification.from_pretrained(name, export=True)
+        model.save_pretrained(directory)
+        transformers.AutoTokenizer.from_pretrained(name).save_pretrained(directory)
+        if backend == "onnx_int8":
+            quantization = import_module("optimum.onnxruntime.configuration")
+            config = getattr(quantization.AutoQuantizationConfig, _quantization_config())(is_static=False, per_channel=False)
+            onnxruntime.ORTQuantizer.from_pretrained(model).quantize(save_dir=directory, quantization_config=config)
+
+    model = onnxruntime.ORTModelForSequenceClassification.from_pretrained(directory, file_name=file_name)
+    tokenizer = transformers.AutoTokenizer.from_pretrained(directory)
+    return transformers.pipeline("zero-shot-classification", model=model, tokenizer=tokenizer)
+
+
+def _sample_texts() -> List[str]:
+    from label_classifier import DATA_TYPE_LABELS
+    from test_suite import textual_queries
+
+    return textual_queries + list(DATA_TYPE_LABELS.values())
+
+
+def parity(backend: str) -> None:
+    """Compare `backend` with torch: cosine similarity of embeddings and agreement of zero-shot top labels."""
+    from label_classifier import DATA_TYPE_LABELS, ZeroShotLabelClassifier
+    from model_registry import sentence_transformer
+    from test_suite import textual_queries
+    from vector_db import SEMANTIC_FILTERING_MODEL
+
+    texts = _sample_texts()
+    reference = sentence_transformer(SEMANTIC_FILTERING_MODEL, backend="torch").encode(texts, normalize_embeddings=True)
+    candidate = sentence_transformer(SEMANTIC_FILTERING_MODEL, backend=backend).encode(texts, normalize_embeddings=True)
+    similarities = np.sum(np.asarray(reference) * np.asarray(candidate), axis=1)
+    print(f"Embedding cosine similarity ({backend} vs torch) : mean {similarities.mean():.4f} | min {similarities.min():.4f} over {len(texts)} texts")
+
+    labels = list(DATA_TYPE_LABELS)
+    reference = ZeroShotLabelClassifier(labels, backend="torch").classify_many(textual_queries)
+    candidate = ZeroShotLabelClassifier(labels, backend=backend).classify_many(textual_queries)
+    top_agreement = np.mean([ref[:1] == cand[:1] for ref, cand in zip(reference, candidate)])
+    same_filter = np.mean([set(ref) == set(cand) for ref, cand in zip(reference, candidate)])
+    print(f"Zero-shot top label agreement ({backend} vs torch) : {top_agreement:.1%} | identical label filter : {same_filter:.1%}")
+
+
+def _measure(backend: str) -> Dict[str, float]:
+    """Load both models with `backend` in this process and time them on the sample texts."""
+    import resource
+
+    from label_classifier import DATA_TYPE_LABELS, ZeroShotLabelClassifier
+    from model_registry import sentence_transformer
+    from test_suite import textual_queries
+    from vector_db import SEMANTIC_FILTERING_MODEL
+
+    texts = _sample_texts()
+    start = time.perf_counter()
+    encoder = sentence_transformer(SEMANTIC_FILTERING_MODEL, backend=backend)
+    classifier = ZeroShotLabelClassifier(list(DATA_TYPE_LABELS), backend=backend)
+    load_seconds = time.perf_counter() - start
+
+    encoder.encode(texts[:8])  # warm up
+    start = time.perf_counter()
+    for text in texts:
+        encoder.encode(text)
+    encode_ms = (time.perf_counter() - start) * 1000 / len(texts)
+
+    queries = textual_queries[:10]
+    classifier.classify(queries[0])  # warm up
+    start = time.perf_counter()
+    for query in queries:
+        classifier.classify(query)
+    classify_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    # ru_maxrss is in kilobytes on Linux.
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"load_seconds": load_seconds, "encode_ms": encode_ms, "classify_ms": classify_ms, "peak_rss_mb": peak_rss_mb}
+
+
+def benchmark(backends: List[str]) -> None:
+    """Latency and peak memory of each backend, each measured in a fresh process."""
+    for backend in backends:
+        output = subprocess.run(
+            [sys.executable, __file__, "measure", "--backend", backend], check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{backend:>9} : load {result['load_seconds']:6.1f} s | embedding {result['encode_ms']:6.1f} ms/text | "
+            f"zero-shot {result['classify_ms']:7.1f} ms/query | peak RSS {result['peak_rss_mb']:6.0f} MB"
+        )
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Parity check and benchmark of the ONNX retrieval model backends")
+    parser.add_argument("mode", choices=["parity", "benchmark", "measure"], help="'measure' runs one backend in this process and prints JSON")
+    parser.add_argument("--backend", choices=BACKENDS, default="onnx_int8", help="backend compared with torch (parity) or measured")
+    args = parser.parse_args()
+
+    if args.mode == "parity":
+        parity(args.backend)
+    elif args.mode == "benchmark":
+        benchmark(list(BACKENDS))
+    else:
+        print(json.dumps(_measure(args.backend)))
@@ -0,0 +1,133 @@
+import argparse
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from agents_enum import Agent
+
+
+PRE_ROUTER_MODEL = "all-MiniLM-L6-v2"
+
+
+def training_examples() -> Dict[str, List[str]]:
+    """The labelled sections of `test_suite.py`, keyed by the agent that answers them."""
+    from test_suite import analytical_queries, textual_queries, web_queries
+
+    return {
+        Agent.VECTOR_DB_AGENT.value: textual_queries,
+        Agent.SQL_DB_AGENT.value: analytical_queries,
+        Agent.WEB_SEARCH_AGENT.value: web_queries,
+    }
+
+
+class PreRouter:
+    """Nearest-centroid classifier that picks the first agent for a question without the LLM.
+
+    Each destination is represented by the mean embedding of its example questions. Cosine
+    similarities to the centroids go through a softmax, and a destination is only returned
+    when its probability reaches `threshold`; otherwise the LLM router decides.
+    """
+
+    def __init__(self, embedding_model: any, examples: Optional[Dict[str, List[str]]] = None, threshold: float = 0.8, temperature: float = 0.05) -> None:
+        examples = examples or training_examples()
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.temperature = temperature
+        self.destinations = list(examples)
+        self.centroids = np.stack([
+            self._centroid(np.asarray(embedding_model.encode(questions, normalize_embeddings=True)))
+            for questions in examples.values()
+        ])
+
+    @staticmethod
+    def _centroid(embeddings: np.ndarray) -> np.ndarray:
+        centroid = embeddings.mean(axis=0)
+        return centroid / np.linalg.norm(centroid)
+
+    def probabilities(self, query_embeddings: np.ndarray, centroids: Optional[np.ndarray] = None) -> np.ndarray:
+        logits = (query_embeddings @ (self.centroids if centroids is None else centroids).T) / self.temperature
+        probabilities = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        return probabilities / probabilities.sum(axis=-1, keepdims=True)
+
+    def scores(self, query: str) -> Dict[str, float]:
+        query_embedding = np.asarray(self.embedding_model.encode([query], normalize_embeddings=True))
+        return dict(zip(self.destinations, self.probabilities(query_embedding)[0].tolist()))
+
+    def route(self, query: str) -> Optional[str]:
+        """The destination when the classifier is confident, else None."""
+        scores = self.scores(query)
+        destination = max(scores, key=scores.get)
+        return destination if scores[destination] >= self.threshold else None
+
+
+def leave_one_out(router: PreRouter, examples: Dict[str, List[str]]) -> List[Dict]:
+    """Route each example with centroids computed without it."""
+    embeddings = {
+        destination: np.asarray(router.embedding_model.encode(questions, normalize_embeddings=True))
+        for destination, questions in examples.items()
+    }
+    results = []
+    for label, questions in examples.items():
+        for index, question in enumerate(questions):
+            centroids = np.stack([
+                router._centroid(np.delete(rows, index, axis=0) if destination == label else rows)
+                for destination, rows in embeddings.items()
+            ])
+            probabilities = router.probabilities(embeddings[label][index], centroids)
+            best = int(np.argmax(probabilities))
+            results.append({
+                "question": question,
+                "label": label,
+                "prediction": router.destinations[best],
+                "confident": probabilities[best] >= router.threshold,
+            })
+    return results
+
+
+def evaluate(thresholds: List[float], compare_llm: bool) -> None:
+    """Leave-one-out accuracy and coverage per threshold, optionally against the LLM router on the same questions."""
+    from model_registry import sentence_transformer
+
+    examples = training_examples()
+    router = PreRouter(sentence_transformer(PRE_ROUTER_MODEL), examples)
+    total = sum(len(questions) for questions in examples.values())
+
+    print(f"Questions : {total} ({', '.join(f'{label}: {len(questions)}' for label, questions in examples.items())})")
+    print(f"{'threshold':>9} | {'decided locally':>15} | {'accuracy when decided':>21} | {'LLM calls saved per question':>28}")
+    for threshold in thresholds:
+        router.threshold = threshold
+        results = leave_one_out(router, examples)
+        confident = [result for result in results if result["confident"]]
+        accuracy = np.mean([result["label"] == result["prediction"] for result in confident]) if confident else 0.0
+        # The pre-router only replaces the first routing call of a question.
+        print(f"{threshold:>9.2f} | {len(confident) / total:>15.1%} | {accuracy:>21.1%} | {len(confident) / total:>28.2f}")
+
+    if compare_llm:
+        from dotenv import load_dotenv
+        from langchain_core.messages import HumanMessage
+        from langchain_core.prompts import ChatPromptTemplate
+        from llm_factory import create_llm
+        from prompts import route_system_prompt
+        from query_processor import RouteDecision
+
+        load_dotenv()
+        route_chain = ChatPromptTemplate.from_messages(
+            [("system", route_system_prompt), ("placeholder", "{messages}")]
+        ) | create_llm().with_structured_output(RouteDecision)
+        correct, seconds = 0, []
+        for label, questions in examples.items():
+            for question in questions:
+                start = time.perf_counter()
+                decision = route_chain.invoke({"messages": [HumanMessage(content=question)]})
+                seconds.append(time.perf_counter() - start)
+                correct += decision.destination == label
+        print(f"LLM router : accuracy {correct / total:.1%} | {np.mean(seconds) * 1000:.0f} ms per routing call")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Leave-one-out evaluation of the local pre-router on the labelled test_suite questions")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.7, 0.8, 0.9, 0.95], help="confidence thresholds to evaluate")
+    parser.add_argument("--llm", action="store_true", help="also measure the accuracy of the LLM router on the same questions")
+    args = parser.parse_args()
+    evaluate(args.thresholds, args.llm)
@@ -0,0 +1,82 @@
+"""Prefill time of the static prompts against a local Ollama, with the static prefix first or after the dynamic part.
+
+Ollama keeps the KV cache of the last prompt per parallel slot and only evaluates the tokens after
+the longest prefix shared with it, so a prompt whose static part comes first is mostly served from
+the cache when the same prompt is sent again. Calls are grouped per prompt, as consecutive calls of
+one node would be.
+
+python prefix_cache.py --queries 10
+"""
+import argparse
+import statistics
+from typing import Callable, Dict, List
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+
+def layouts(selector: any) -> Dict[str, Callable[[str, bool], List[BaseMessage]]]:
+    """Messages of the routing, SQL generation and grading prompts, static part first when `stable`."""
+    from prompts import grade_document_prompt, query_gen_few_shot_system_prompt, route_system_prompt
+
+    def route(question: str, stable: bool) -> List[BaseMessage]:
+        system, human = SystemMessage(content=route_system_prompt), HumanMessage(content=question)
+        return [system, human] if stable else [human, system]
+
+    def query_gen(question: str, stable: bool) -> List[BaseMessage]:
+        system, human = SystemMessage(content=query_gen_few_shot_system_prompt), HumanMessage(content=question)
+        examples = selector.render(question)
+        return [system, *examples, human] if stable else [human, system, *examples]
+
+    def grade(question: str, stable: bool) -> List[BaseMessage]:
+        # The selected examples stand in for a retrieved document of a similar length.
+        document = "\n".join(message.content for message in selector.render(question))
+        prompt = grade_document_prompt.format(context=document, question=question)
+        instructions, separator, dynamic = prompt.partition("Here is the retrieved document")
+        return [HumanMessage(content=prompt if stable else separator + dynamic + instructions)]
+
+    return {"route": route, "query_gen": query_gen, "grade": grade}
+
+
+def prefill(llm: any, messages: List[BaseMessage]) -> Dict[str, float]:
+    metadata = llm.invoke(messages).response_metadata
+    return {
+        "tokens": metadata.get("prompt_eval_count") or 0,
+        "ms": (metadata.get("prompt_eval_duration") or 0) / 1e6,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prefill time against a local Ollama with stable and unstable prompt prefixes")
+    parser.add_argument("--queries", type=int, default=10, help="number of analytical test_suite questions")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+
+    from few_shot_selector import EMBEDDING_MODEL, FewShotSelector
+    from few_shots import few_shots
+    from llm_factory import create_llm
+    from model_registry import sentence_transformer
+    from test_suite import analytical_queries
+
+    load_dotenv()
+    # One generated token is enough; only the prompt evaluation is measured.
+    llm = create_llm("ollama_local").model_copy(update={"num_predict": 1})
+    selector = FewShotSelector(few_shots, sentence_transformer(EMBEDDING_MODEL))
+    questions = analytical_queries[: args.queries]
+
+    print(f"Model : {llm.model} | questions : {len(questions)} | keep_alive : {llm.keep_alive}")
+    print(f"{'prompt':>9} | {'layout':>13} | {'evaluated tokens':>16} | {'prefill p50':>11} | {'prefill mean':>12}")
+    for name, build in layouts(selector).items():
+        for layout, stable in (("dynamic first", False), ("static first", True)):
+            # The first call only fills the cache.
+            prefill(llm, build(questions[-1], stable))
+            results = [prefill(llm, build(question, stable)) for question in questions]
+            milliseconds = [result["ms"] for result in results]
+            print(
+                f"{name:>9} | {layout:>13} | {statistics.mean(result['tokens'] for result in results):>16.0f} | "
+                f"{statistics.median(milliseconds):9.0f}ms | {statistics.mean(milliseconds):10.0f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,28 @@ If the information is not present, identify which agent from the given agents wh
 Under no circumstances should you answer the user's question or provide additional context.
 """
 
+fan_out_route_system_prompt = """
+You are a decision-making system tasked with choosing which agents should retrieve the information needed to answer a user's question.
+You are given the following agents :-
+
+name : sql_db_agent
+description : Converts a question to a valid SQL query and queries a SQL database containing numerical and quantitative data about the medals, participation and performance records of athletes and countries to obtain relevant information. 
+
+name : vector_db_agent
+description : Search a vector database created by adding information about various aspects of Olympics for relevant documents.
+
+name : web_search_agent
+description : Search the web for the information regarding the question. Use ONLY for recent events or information that neither the SQL database nor the vector database can contain.
+
+name : generate
+description : Returned if sufficient information to answer the user's query information is present in the previous messages
+
+First, check whether the necessary information to answer the user's query is already available in the messages.
+If the information is present in the previous messages return only 'generate'.
+Otherwise return every agent needed to retrieve the required information. The chosen agents run in parallel, so if the question has parts that different agents can answer, for example an athlete's biography and their medal count, return all of those agents.
+Under no circumstances should you answer the user's question or provide additional context.
+"""
+
 query_check_system_prompt = """
 You are a SQL expert with a strong attention to detail.
 Double check the SQLite query for common mistakes, including:
@@ -44,6 +66,12 @@ If there are any of the above mistakes, rewrite the query. If there are no mista
 You will call the appropriate tool to execute the query after running this check.
 """
 
+query_check_issues_prompt = """
+Static checks of the query above found these problems:
+{issues}
+Fix them if they are real mistakes, together with any other mistakes you find, and output only the final SQL query.
+"""
+
 query_gen_system_prompt = """
 You are a SQL expert with a strong attention to detail.
 
@@ -76,12 +104,13 @@ query_gen_few_shot_system_prompt = query_gen_system_prompt + """
 Here are some examples of user inputs and their corresponding SQL queries:
 """
 
+# The instructions come before the document and question so every grading call starts with the same prefix.
 grade_document_prompt = """
 You are a grader assessing relevance of a retrieved document to a user question. \n 
+If the document contains keyword(s) or semantic meaning related to the user question, grade it as relevant. \n
+Give a binary score 'yes' or 'no' score to indicate whether the document is relevant to the question. \n
 Here is the retrieved document: \n\n {context} \n\n
 Here is the user question: {question} \n
-If the document contains keyword(s) or semantic meaning related to the user question, grade it as relevant. \n
-Give a binary score 'yes' or 'no' score to indicate whether the document is relevant to the question.
 """
 
 sql_context_prompt = """
@@ -2,6 +2,7 @@ from typing import List, Dict
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
 from prompts import contextualize_q_system_prompt
+from llm_factory import resolve_llm
 
 class QueryContextualizer:
     def __init__(self, llm : any, verbose : bool = False) -> None:
@@ -14,7 +15,7 @@ class QueryContextualizer:
                 ("human", "{question}"),
             ]
         )
-        self.chain = contextualize_q_prompt | llm | StrOutputParser()
+        self.chain = contextualize_q_prompt | resolve_llm(llm, "contextualizer") | StrOutputParser()
 
     def contextualize(self, query : str, chatHistory : List[Dict]) -> str:
         if chatHistory:
@@ -25,6 +26,15 @@ class QueryContextualizer:
             print("Contextualized query :", response)
         return response
 
+    async def acontextualize(self, query : str, chatHistory : List[Dict]) -> str:
+        if chatHistory:
+            response = await self.chain.ainvoke({"question" : query, "chatHistory" : chatHistory})
+        else:
+            response = query
+        if self.verbose:
+            print("Contextualized query :", response)
+        return response
+
 if __name__ == '__main__':
     from langchain_google_genai import GoogleGenerativeAI
     import os
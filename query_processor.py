@@ -1,85 +1,313 @@
+import operator
+import os
+import time
 from dotenv import load_dotenv
-from typing import List, Dict, Literal
+from dataclasses import dataclass
+from threading import Lock, Thread
+from typing import Annotated, AsyncIterator, Iterator, List, Dict, Literal
 from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables.config import RunnableConfig, run_in_executor
 from langgraph.graph import END, START, StateGraph, MessagesState
 from pydantic import BaseModel, Field
+from agents_enum import Agent
+from answer_cache import AnswerCache
+from llm_factory import resolve_llm
+from model_registry import sentence_transformer
+from pre_router import PRE_ROUTER_MODEL, PreRouter
 from query_contextualizer import QueryContextualizer
-from prompts import route_system_prompt, rag_prompt
-from sql_db_agent import SQLDBAgent
+from rate_limiter import llm_priority
+from prompts import fan_out_route_system_prompt, route_system_prompt, rag_prompt
+from sql_db_agent import NO_CONTEXT_ANSWER, SQLDBAgent
 from vector_db_agent import VectorDBAgent
 from web_search_agent import WebSearchAgent
 
 
+# Agent that produced each tool output, used to attribute cached answers.
+TOOL_AGENTS = {
+    "sql_db_list_tables" : Agent.SQL_DB_AGENT.value,
+    "sql_db_schema" : Agent.SQL_DB_AGENT.value,
+    "sql_db_query" : Agent.SQL_DB_AGENT.value,
+    "search_vector_db" : Agent.VECTOR_DB_AGENT.value,
+    "search_vector_db_batch" : Agent.VECTOR_DB_AGENT.value,
+    "tavily_search_results_json" : Agent.WEB_SEARCH_AGENT.value,
+}
+
+# Phrases of final answers that report a failure instead of answering (see rag_prompt); such answers are not cached.
+FAILURE_ANSWERS = (NO_CONTEXT_ANSWER.lower(), "enough information")
+
+# Progress shown while the graph runs, keyed by node name; top-level nodes and agent nodes are listed separately.
+PROGRESS_MESSAGES = {
+    "router" : "Deciding where to look",
+    "sql_db_agent" : "Querying the Olympics database",
+    "vector_db_agent" : "Searching the Olympics documents",
+    "web_search_agent" : "Searching the web",
+    "merge" : "Combining the results",
+    "generate" : "Writing the answer",
+}
+AGENT_PROGRESS_MESSAGES = {
+    "model_get_schema" : "Selecting relevant tables",
+    "query_gen" : "Writing a SQL query",
+    "correct_query" : "Checking the SQL query",
+    "execute_query" : "Running the SQL query",
+    "retrieve" : "Retrieving documents",
+    "rewrite" : "Rephrasing the question",
+}
+
+@dataclass
+class StreamEvent:
+    # "progress" for graph hops, "token" for pieces of the final answer, "answer" once with the full answer.
+    kind : Literal["progress", "token", "answer"]
+    content : str
+
+class QueryState(MessagesState):
+    # Routing hops taken for this request; kept in the graph state so concurrent requests don't share it.
+    route_tries : int
+    # Answers of the agents run in parallel by fan-out routing, merged before generating.
+    contexts : Annotated[List[str], operator.add]
+
 class RouteDecision(BaseModel):
     destination: Literal["sql_db_agent", "vector_db_agent", "web_search_agent", "generate"] = Field(
         description="The next node to route to."
     )
 
+class FanOutRouteDecision(BaseModel):
+    destinations: List[Literal["sql_db_agent", "vector_db_agent", "web_search_agent", "generate"]] = Field(
+        description="The agents to run in parallel, or only 'generate'."
+    )
+
+class LazyComponent:
+    """
+    Builds a component with `factory` on first use, or ahead of time in a background thread,
+    and records how long the build took.
+    """
+    def __init__(self, name : str, factory : callable, verbose : bool = False) -> None:
+        self.name = name
+        self.factory = factory
+        self.verbose = verbose
+        self.component = None
+        self.seconds = None
+        self._lock = Lock()
+
+    def get(self) -> any:
+        if self.component is None:
+            with self._lock:
+                if self.component is None:
+                    start = time.perf_counter()
+                    component = self.factory()
+                    self.seconds = time.perf_counter() - start
+                    self.component = component
+                    if self.verbose:
+                        print(f"---BUILT {self.name.upper()} IN {self.seconds:.2f} s---")
+        return self.component
+
+    def warm(self) -> Thread:
+        thread = Thread(target = self._warm, name = f"warm-{self.name}", daemon = True)
+        thread.start()
+        return thread
+
+    def _warm(self) -> None:
+        try:
+            self.get()
+        except Exception as error:
+            # The build is retried, and the error raised, when the component is first used.
+            if self.verbose:
+                print(f"---BACKGROUND BUILD OF {self.name.upper()} FAILED---")
+                print(error)
+
 class QueryProcessor:
-    def __init__(self, llm : any, verbose : bool = False, maxRetry : int = 2, use_few_shot : bool = True, use_semantic_filtering : bool = True, use_metadata_filtering = True) -> None:
+    def __init__(self, llm : any, verbose : bool = False, maxRetry : int = 2, use_few_shot : bool = True, use_semantic_filtering : bool = True, use_metadata_filtering = True, use_answer_cache : bool = False, use_hybrid_search : bool = False, use_reranking : bool = False, startup_mode : Literal["eager", "lazy", "background"] = None, use_fan_out : bool = False, use_pre_router : bool = False, use_sql_validator : bool = False) -> None:
+        """
+        `llm` is a single chat model, or the per-role models of `llm_factory.create_llm_roles()`.
+
+        `startup_mode` (default `QUERY_PROCESSOR_STARTUP`, else "eager") controls when the agents
+        are built: "eager" builds them one after another here, "lazy" on the first question
+        routed to each, and "background" in parallel threads started here. The graph is
+        compiled up front in every mode.
+
+        With `use_fan_out`, the router may pick several agents at once. They run in parallel
+        and a merge node combines their answers before `generate`, instead of routing again
+        after each agent.
+
+        With `use_pre_router`, a local embedding classifier picks the first agent when it is
+        confident (`PRE_ROUTER_THRESHOLD`), saving the first routing LLM call. It picks a single
+        agent, so it is not used together with `use_fan_out`.
+
+        With `use_sql_validator`, generated SQL is checked statically against the schema snapshot
+        and only queries with problems are sent to the LLM query checker (needs `sqlglot`).
+        """
         load_dotenv()
+        start = time.perf_counter()
         self.verbose = verbose
         self.maxRetry = maxRetry
-        self.tries = 0
+        self.use_fan_out = use_fan_out
+        self.startup_mode = (startup_mode or os.getenv("QUERY_PROCESSOR_STARTUP", "eager")).strip().lower()
+        if self.startup_mode not in {"eager", "lazy", "background"}:
+            raise ValueError("Unsupported startup_mode. Use one of: 'eager', 'lazy', 'background'.")
         self.queryContextualizer = QueryContextualizer(llm, verbose = verbose)
-        self.llm = llm
-        sqlDBAgent = SQLDBAgent(llm, verbose = verbose, use_few_shot = use_few_shot)
-        vectorDBAgent = VectorDBAgent(llm, verbose = verbose, use_semantic_filtering = use_semantic_filtering, use_metadata_filtering = use_metadata_filtering)
-        webSearchAgent = WebSearchAgent(llm, verbose=verbose)
+        self.answerCache = AnswerCache.from_env() if use_answer_cache else None
+        self.pre_router = PreRouter(
+            sentence_transformer(PRE_ROUTER_MODEL),
+            threshold = float(os.getenv("PRE_ROUTER_THRESHOLD", "0.8"))
+        ) if use_pre_router and not use_fan_out else None
+        self.route_stats = {"pre_router" : 0, "llm" : 0}
+        self.route_stats_lock = Lock()
+        self.llm = resolve_llm(llm, "generator")
+        self.components = {
+            "sql_db_agent" : LazyComponent("sql_db_agent", lambda: SQLDBAgent(llm, verbose = verbose, use_few_shot = use_few_shot, use_sql_validator = use_sql_validator), verbose),
+            "vector_db_agent" : LazyComponent("vector_db_agent", lambda: VectorDBAgent(llm, verbose = verbose, use_semantic_filtering = use_semantic_filtering, use_metadata_filtering = use_metadata_filtering, use_hybrid_search = use_hybrid_search, use_reranking = use_reranking), verbose),
+            "web_search_agent" : LazyComponent("web_search_agent", lambda: WebSearchAgent(llm, verbose=verbose), verbose),
+        }
 
         route_prompt = ChatPromptTemplate.from_messages(
-            [("system", route_system_prompt), ("placeholder", "{messages}")]
+            [("system", fan_out_route_system_prompt if use_fan_out else route_system_prompt), ("placeholder", "{messages}")]
         )
 
-        self.route_chain = route_prompt | llm.with_structured_output(RouteDecision)
+        self.route_chain = route_prompt | resolve_llm(llm, "router").with_structured_output(FanOutRouteDecision if use_fan_out else RouteDecision)
+        self.rag_chain = self.build_rag_chain()
 
-        workflow = StateGraph(MessagesState)
+        workflow = StateGraph(QueryState)
 
         workflow.add_node("router", self.router)
-        workflow.add_node("sql_db_agent", sqlDBAgent.app)
-        workflow.add_node("vector_db_agent", vectorDBAgent.app)
-        workflow.add_node("web_search_agent", webSearchAgent.app)
-        workflow.add_node("generate", self.generate)
+        for name, component in self.components.items():
+            if self.startup_mode == "eager" and not use_fan_out:
+                workflow.add_node(name, component.get().app)
+            else:
+                if self.startup_mode == "eager":
+                    component.get()
+                workflow.add_node(name, self.agent_node(component, fan_out = use_fan_out))
+        workflow.add_node("generate", RunnableLambda(self.generate, afunc = self.agenerate))
 
 
         workflow.add_edge(START, "router")
-        workflow.add_conditional_edges("router", self.route)
-        workflow.add_edge("sql_db_agent", "router")
-        workflow.add_edge("vector_db_agent", "router")
-        workflow.add_edge("web_search_agent", "generate")
+        workflow.add_conditional_edges(
+            "router",
+            RunnableLambda(self.route, afunc = self.aroute),
+            ["sql_db_agent", "vector_db_agent", "web_search_agent", "generate"],
+        )
+        if use_fan_out:
+            # The branches chosen together finish in the same step, so merge runs once with all their answers.
+            workflow.add_node("merge", self.merge)
+            workflow.add_edge("sql_db_agent", "merge")
+            workflow.add_edge("vector_db_agent", "merge")
+            workflow.add_edge("web_search_agent", "merge")
+            workflow.add_edge("merge", "generate")
+        else:
+            workflow.add_edge("sql_db_agent", "router")
+            workflow.add_edge("vector_db_agent", "router")
+            workflow.add_edge("web_search_agent", "generate")
         workflow.add_edge("generate", END)
 
         self.app = workflow.compile()
+        if self.startup_mode == "background":
+            for component in self.components.values():
+                component.warm()
+        self.init_seconds = time.perf_counter() - start
+        if self.verbose:
+            print(self.startup_report())
+
+    def agent_node(self, component : LazyComponent, fan_out : bool = False) -> RunnableLambda:
+        """
+        Graph node running an agent that is built on first use. Only the messages are passed
+        on, as when the agent's graph is added as a subgraph node. As a fan-out branch, the
+        node returns only the agent's new messages, plus its answer in `contexts`.
+        """
+        def output(state : QueryState, result : Dict) -> QueryState:
+            if not fan_out:
+                return {"messages": result["messages"]}
+            answer = result["messages"][-1].content
+            return {"messages": result["messages"][len(state["messages"]):], "contexts": [f"From {component.name}:\n{answer}"]}
+
+        def invoke(state : QueryState, config : RunnableConfig) -> QueryState:
+            result = component.get().app.invoke({"messages": state["messages"]}, config)
+            return output(state, result)
+
+        async def ainvoke(state : QueryState, config : RunnableConfig) -> QueryState:
+            agent = await run_in_executor(None, component.get)
+            result = await agent.app.ainvoke({"messages": state["messages"]}, config)
+            return output(state, result)
+
+        return RunnableLambda(invoke, afunc = ainvoke, name = component.name)
+
+    def merge(self, state : QueryState) -> QueryState:
+        if self.verbose:
+            print("---MERGING AGENT CONTEXTS---")
+        contexts = "\n\n".join(state.get("contexts", []))
+        return {"messages": [HumanMessage(f"Retrieved context from previous agents:\n{contexts}")]}
+
+    def startup_report(self) -> str:
+        lines = [f"Startup ({self.startup_mode}) : QueryProcessor ready in {self.init_seconds:.2f} s"]
+        for name, component in self.components.items():
+            built = f"built in {component.seconds:.2f} s" if component.seconds is not None else "not built yet"
+            lines.append(f"  {name:<17} : {built}")
+        return "\n".join(lines)
+
+    def route(self, state: QueryState) -> str | List[str]:
+        route_messages = self._route_messages(state)
+        if route_messages is None:
+            return "web_search_agent"
+        destination = self._pre_route(route_messages)
+        if destination is not None:
+            return destination
+        return self._destination(self.route_chain.invoke({"messages": route_messages}))
+
+    async def aroute(self, state: QueryState) -> str | List[str]:
+        route_messages = self._route_messages(state)
+        if route_messages is None:
+            return "web_search_agent"
+        destination = await run_in_executor(None, self._pre_route, route_messages)
+        if destination is not None:
+            return destination
+        return self._destination(await self.route_chain.ainvoke({"messages": route_messages}))
+
+    def _pre_route(self, route_messages : List) -> str | None:
+        """First hop chosen by the local pre-router when it is confident, else None."""
+        # Later hops depend on the retrieved context, which only the LLM router reads.
+        destination = self.pre_router.route(route_messages[0].content) if self.pre_router is not None and len(route_messages) == 1 else None
+        with self.route_stats_lock:
+            self.route_stats["llm" if destination is None else "pre_router"] += 1
+        if destination is None:
+            return None
+        if self.verbose:
+            print("Pre-routed to", destination)
+        return destination
 
-    def route(self, state: MessagesState) -> Literal["sql_db_agent", "vector_db_agent", "web_search_agent", "generate"]:
+    def _route_messages(self, state: QueryState) -> List | None:
+        """Messages shown to the router, or None once the routing budget is spent."""
         if self.verbose:
             print("---ROUTING QUERY---")
-        self.tries = self.tries + 1
-        if self.tries > self.maxRetry:
+        if state.get("route_tries", 0) > self.maxRetry:
             if self.verbose:
                 print("---MAX RETRIES REACHED---")
                 print("Routed to web_search_agent")
-            return "web_search_agent"
+            return None
 
         # Give the router both the original question and latest retrieved context.
         # This preserves architecture (router decides) while improving generate decisions.
         first_message = state["messages"][0]
         last_message = state["messages"][-1]
         if first_message is last_message:
-            route_messages = [last_message]
-        else:
-            route_messages = [first_message, last_message]
+            return [last_message]
+        return [first_message, last_message]
 
-        destination = self.route_chain.invoke({"messages": route_messages}).destination
+    def _destination(self, decision : RouteDecision | FanOutRouteDecision) -> str | List[str]:
+        if isinstance(decision, FanOutRouteDecision):
+            destinations = list(dict.fromkeys(decision.destinations))
+            agents = [destination for destination in destinations if destination != "generate"]
+            # 'generate' only makes sense on its own; an empty choice falls back to the web search.
+            destination = agents or (["generate"] if destinations else ["web_search_agent"])
+        else:
+            destination = decision.destination
         if self.verbose:
             print("Routed to", destination)
         return destination
     
-    def router(self, state: MessagesState) -> MessagesState:
+    def router(self, state: QueryState) -> QueryState:
+        route_tries = state.get("route_tries", 0) + 1
         if isinstance(state["messages"][-1],HumanMessage):
-            return {"messages": []}
-        return {"messages" : [HumanMessage(f"Retrieved context from previous agent:\n{state['messages'][-1].content}")]}
+            return {"messages": [], "route_tries": route_tries}
+        return {"messages" : [HumanMessage(f"Retrieved context from previous agent:\n{state['messages'][-1].content}")], "route_tries": route_tries}
 
     def get_context(self, state : MessagesState) -> str:
         messages = state["messages"]
@@ -88,14 +316,22 @@ class QueryProcessor:
         return last_message.content
 
     def generate(self, state : MessagesState) -> MessagesState:
+        # The final answer is what the user waits for, so it is served first under the LLM rate limit.
+        with llm_priority("generate"):
+            response = self.rag_chain.invoke(self._generate_inputs(state))
+        return {"messages": [response]}
+
+    async def agenerate(self, state : MessagesState) -> MessagesState:
+        with llm_priority("generate"):
+            response = await self.rag_chain.ainvoke(self._generate_inputs(state))
+        return {"messages": [response]}
+
+    def _generate_inputs(self, state : MessagesState) -> Dict:
         if self.verbose:
             print("---GENERATING FINAL RESPONSE---")
-        self.tries = 0
-        messages = state["messages"]
-        question = messages[0].content
-
-        docs = self.get_context(state)
+        return {"context": self.get_context(state), "question": state["messages"][0].content}
 
+    def build_rag_chain(self):
         # Prompt
         prompt = PromptTemplate(
             template=rag_prompt,
@@ -103,11 +339,7 @@ class QueryProcessor:
         )
 
         # Chain
-        rag_chain = prompt | self.llm
-
-        # Run
-        response = rag_chain.invoke({"context": docs, "question": question})
-        return {"messages": [response]}
+        return prompt | self.llm
     
     def should_continue(self, state: MessagesState) -> Literal["tools", "__end__"]:
         messages = state['messages']
@@ -122,8 +354,149 @@ class QueryProcessor:
             print("Question :", question)
             print("---CONTEXTUALIZING QUESTION---")
         question = self.queryContextualizer.contextualize(question, chatHistory)
+        if self.answerCache is not None:
+            cached = self.answerCache.lookup(question)
+            if cached is not None:
+                return self._cached_answer(cached)
         response =  self.app.invoke({"messages": [HumanMessage(content = question)]})
-        return response["messages"][-1].content
+        answer = response["messages"][-1].content
+        if self.answerCache is not None:
+            self.cache_answer(question, answer, response)
+        return answer
+
+    async def aprocessQuery(self, question : str, chatHistory : List[Dict]) -> str:
+        """
+        Async counterpart of `processQuery`. LLM calls are awaited and blocking work (database
+        queries, vector search, embeddings, the answer cache) runs in the default executor, so
+        one event loop can serve many questions at once.
+        """
+        if self.verbose:
+            print("---PROCESSING QUESTION")
+            print("Question :", question)
+            print("---CONTEXTUALIZING QUESTION---")
+        question = await self.queryContextualizer.acontextualize(question, chatHistory)
+        if self.answerCache is not None:
+            cached = await run_in_executor(None, self.answerCache.lookup, question)
+            if cached is not None:
+                return self._cached_answer(cached)
+        response = await self.app.ainvoke({"messages": [HumanMessage(content = question)]})
+        answer = response["messages"][-1].content
+        if self.answerCache is not None:
+            await run_in_executor(None, self.cache_answer, question, answer, response)
+        return answer
+
+    def streamQuery(self, question : str, chatHistory : List[Dict]) -> Iterator[StreamEvent]:
+        """
+        Answer a question like `processQuery`, yielding progress events for each routing and
+        agent hop, then the tokens of the final `generate` step as they are produced, then
+        the complete answer.
+        """
+        if chatHistory:
+            yield StreamEvent("progress", "Reading the conversation")
+        question = self.queryContextualizer.contextualize(question, chatHistory)
+        if self.answerCache is not None:
+            cached = self.answerCache.lookup(question)
+            if cached is not None:
+                answer = self._cached_answer(cached)
+                yield StreamEvent("token", answer)
+                yield StreamEvent("answer", answer)
+                return
+        state, streamed = None, False
+        for namespace, mode, payload in self.app.stream(
+            {"messages": [HumanMessage(content = question)]},
+            stream_mode = ["tasks", "messages", "values"],
+            subgraphs = True,
+        ):
+            if mode == "values" and not namespace:
+                state = payload
+            event = self._stream_event(namespace, mode, payload)
+            if event is not None:
+                streamed = streamed or event.kind == "token"
+                yield event
+        answer = state["messages"][-1].content
+        if self.answerCache is not None:
+            self.cache_answer(question, answer, state)
+        yield from self._final_events(answer, streamed)
+
+    async def astreamQuery(self, question : str, chatHistory : List[Dict]) -> AsyncIterator[StreamEvent]:
+        """
+        Async counterpart of `streamQuery`.
+        """
+        if chatHistory:
+            yield StreamEvent("progress", "Reading the conversation")
+        question = await self.queryContextualizer.acontextualize(question, chatHistory)
+        if self.answerCache is not None:
+            cached = await run_in_executor(None, self.answerCache.lookup, question)
+            if cached is not None:
+                answer = self._cached_answer(cached)
+                yield StreamEvent("token", answer)
+                yield StreamEvent("answer", answer)
+                return
+        state, streamed = None, False
+        async for namespace, mode, payload in self.app.astream(
+            {"messages": [HumanMessage(content = question)]},
+            stream_mode = ["tasks", "messages", "values"],
+            subgraphs = True,
+        ):
+            if mode == "values" and not namespace:
+                state = payload
+            event = self._stream_event(namespace, mode, payload)
+            if event is not None:
+                streamed = streamed or event.kind == "token"
+                yield event
+        answer = state["messages"][-1].content
+        if self.answerCache is not None:
+            await run_in_executor(None, self.cache_answer, question, answer, state)
+        for event in self._final_events(answer, streamed):
+            yield event
+
+    def _stream_event(self, namespace : tuple, mode : str, payload : any) -> StreamEvent | None:
+        if mode == "tasks":
+            # Task start events carry the node's input, finish events its result.
+            if "result" in payload:
+                return None
+            label = (AGENT_PROGRESS_MESSAGES if namespace else PROGRESS_MESSAGES).get(payload["name"])
+            return StreamEvent("progress", label) if label else None
+        if mode == "messages":
+            chunk, metadata = payload
+            # Only tokens of the top-level generate node belong to the answer; agents have their own generate nodes.
+            if not namespace and metadata.get("langgraph_node") == "generate" and isinstance(chunk, AIMessage) and chunk.content:
+                return StreamEvent("token", chunk.content)
+        return None
+
+    def _final_events(self, answer : str, streamed : bool) -> List[StreamEvent]:
+        # A model that does not stream produces no token events; show its answer in one piece.
+        events = [] if streamed else [StreamEvent("token", answer)]
+        return events + [StreamEvent("answer", answer)]
+
+    def _cached_answer(self, cached : Dict) -> str:
+        if self.verbose:
+            print("---ANSWER CACHE HIT---")
+            print("Answered by :", cached["source"])
+        return cached["answer"]
+
+    def cache_answer(self, question : str, answer : str, state : QueryState) -> None:
+        """
+        Store an answer backed by an agent's output. Answers reporting a failure, answers without
+        any agent output and answers of the web search fallback after the routing budget ran out
+        are not stored, so a transient failure is not replayed until the TTL expires.
+        """
+        sources = self.answer_sources(state)
+        # An agent that gave up passes its failure answer on as the context of the final answer.
+        failed = any(phrase in answer.lower() for phrase in FAILURE_ANSWERS) or any(
+            isinstance(message.content, str) and NO_CONTEXT_ANSWER in message.content for message in state["messages"]
+        )
+        if not sources or failed or state.get("route_tries", 0) > self.maxRetry:
+            if self.verbose:
+                print("---ANSWER NOT CACHED---")
+            return
+        self.answerCache.store(question, answer, sources)
+
+    def answer_sources(self, state : MessagesState) -> List[str]:
+        return [
+            TOOL_AGENTS[message.name] for message in state["messages"]
+            if isinstance(message, ToolMessage) and message.name in TOOL_AGENTS
+        ]
 
 if __name__ == '__main__':
     from llm_factory import create_llm
@@ -0,0 +1,253 @@
+"""Process-wide client-side rate limiting of LLM requests.
+
+One `TokenBucketRateLimiter` is shared by every chat model created for the same provider and
+model, so separately created LLMs draw from one budget. Each limiter enforces requests per
+second with a burst capacity and, optionally, a tokens-per-minute budget that is debited with
+the usage reported by each response. Requests wait in priority lanes: answer generation is
+served before ordinary agent hops, and those before background (evaluation) traffic.
+
+python rate_limiter.py   # simulated provider: p50/p95 latency per lane under load
+"""
+import argparse
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, Iterator, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.rate_limiters import BaseRateLimiter
+
+
+# Lower numbers are served first.
+PRIORITIES = {"generate": 0, "interactive": 1, "background": 2}
+
+_priority: ContextVar[str] = ContextVar("llm_priority", default="interactive")
+
+
+@contextmanager
+def llm_priority(lane: str) -> Iterator[None]:
+    """Run the LLM calls made inside the block (in this thread or task) in the given lane."""
+    if lane not in PRIORITIES:
+        raise ValueError(f"Unsupported priority lane '{lane}'. Use one of: {', '.join(PRIORITIES)}.")
+    token = _priority.set(lane)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucketRateLimiter(BaseRateLimiter):
+    """Token buckets for requests and, optionally, tokens per minute, with priority lanes.
+
+    A request waits while a request of a higher-priority lane is waiting, so lanes are
+    served strictly in order. The token budget may go negative after a large response;
+    requests then wait until it has refilled.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float,
+        burst: float = 1.0,
+        tokens_per_minute: Optional[float] = None,
+        check_every_n_seconds: float = 0.1,
+    ) -> None:
+        self.requests_per_second = requests_per_second
+        self.burst = max(burst, 1.0)
+        self.tokens_per_minute = tokens_per_minute
+        self.check_every_n_seconds = check_every_n_seconds
+        self._lock = Lock()
+        self._requests = self.burst
+        self._tokens = float(tokens_per_minute) if tokens_per_minute else 0.0
+        self._last = time.monotonic()
+        self._waiting = {priority: 0 for priority in PRIORITIES.values()}
+        self._stats = {"requests": 0, "tokens": 0, "waits": 0}
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed, self._last = now - self._last, now
+        self._requests = min(self.burst, self._requests + elapsed * self.requests_per_second)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _try_acquire(self, priority: int) -> bool:
+        with self._lock:
+            self._refill()
+            if any(self._waiting[higher] for higher in range(priority)):
+                return False
+            if self._requests < 1 or (self.tokens_per_minute and self._tokens <= 0):
+                return False
+            self._requests -= 1
+            self._stats["requests"] += 1
+            return True
+
+    def _enter(self, priority: int, delta: int) -> None:
+        with self._lock:
+            self._waiting[priority] += delta
+            if delta > 0:
+                self._stats["waits"] += 1
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        priority = PRIORITIES[_priority.get()]
+        if self._try_acquire(priority):
+            return True
+        if not blocking:
+            return False
+        self._enter(priority, 1)
+        try:
+            while not self._try_acquire(priority):
+                time.sleep(self.check_every_n_seconds)
+        finally:
+            self._enter(priority, -1)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        priority = PRIORITIES[_priority.get()]
+        if self._try_acquire(priority):
+            return True
+        if not blocking:
+            return False
+        self._enter(priority, 1)
+        try:
+            while not self._try_acquire(priority):
+                await asyncio.sleep(self.check_every_n_seconds)
+        finally:
+            self._enter(priority, -1)
+        return True
+
+    def record_tokens(self, tokens: int) -> None:
+        with self._lock:
+            self._refill()
+            self._stats["tokens"] += tokens
+            if self.tokens_per_minute:
+                self._tokens -= tokens
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """Debits the tokens reported by each response from its model's rate limiter."""
+
+    def __init__(self, rate_limiter: TokenBucketRateLimiter) -> None:
+        self.rate_limiter = rate_limiter
+
+    def on_llm_end(self, response: LLMResult, **kwargs) -> None:
+        tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    tokens += usage.get("total_tokens", 0)
+        if not tokens:
+            # Providers that only report usage in llm_output.
+            tokens = ((response.llm_output or {}).get("token_usage") or {}).get("total_tokens", 0)
+        if tokens:
+            self.rate_limiter.record_tokens(tokens)
+
+
+_limiters: Dict[Tuple[str, str], TokenBucketRateLimiter] = {}
+_limiters_lock = Lock()
+
+
+def rate_limiter_for(provider: str, model: str) -> TokenBucketRateLimiter:
+    """The process-wide limiter of a provider and model, created from the environment on first use."""
+    key = (provider, model)
+    with _limiters_lock:
+        if key not in _limiters:
+            tokens_per_minute = os.getenv("LLM_TOKENS_PER_MINUTE")
+            _limiters[key] = TokenBucketRateLimiter(
+                requests_per_second=float(os.getenv("LLM_REQUESTS_PER_SECOND", "0.3")),
+                burst=float(os.getenv("LLM_BURST", "1")),
+                tokens_per_minute=float(tokens_per_minute) if tokens_per_minute else None,
+                check_every_n_seconds=float(os.getenv("LLM_RATE_LIMIT_CHECK_SECONDS", "0.1")),
+            )
+        return _limiters[key]
+
+
+def simulate(mode: str, args: argparse.Namespace) -> Dict[str, any]:
+    """Background requests submitted at once while interactive requests arrive at a steady pace.
+
+    The fake provider counts the requests that exceed its own limit (which a real provider
+    would reject with HTTP 429).
+    """
+    import statistics
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    from fake_backends import FakeChatModel
+
+    recent, rejected, provider_lock = deque(), [0], Lock()
+
+    def provider(messages, tool_names) -> AIMessage:
+        now = time.monotonic()
+        with provider_lock:
+            recent.append(now)
+            while recent and recent[0] <= now - 1.0:
+                recent.popleft()
+            if len(recent) > args.rps + args.burst:
+                rejected[0] += 1
+        return AIMessage(content="ok", usage_metadata={"input_tokens": args.tokens_per_request, "output_tokens": 0, "total_tokens": args.tokens_per_request})
+
+    def limiter() -> TokenBucketRateLimiter:
+        return TokenBucketRateLimiter(args.rps, args.burst, args.tokens_per_minute, check_every_n_seconds=0.005)
+
+    shared = limiter()
+    limiters = {"interactive": limiter() if mode == "per-llm" else shared, "background": limiter() if mode == "per-llm" else shared}
+    models = {
+        lane: FakeChatModel(responder=provider, latency=args.llm_latency, rate_limiter=rate_limiter, callbacks=[TokenUsageCallback(rate_limiter)])
+        for lane, rate_limiter in limiters.items()
+    }
+    lanes = {"interactive": "generate", "background": "background"} if mode == "lanes" else {"interactive": "interactive", "background": "interactive"}
+
+    def request(kind: str, submitted: float) -> Tuple[str, float]:
+        with llm_priority(lanes[kind]):
+            models[kind].invoke([HumanMessage(content=kind)])
+        return kind, time.monotonic() - submitted
+
+    with ThreadPoolExecutor(max_workers=args.background + args.interactive) as executor:
+        futures = [executor.submit(request, "background", time.monotonic()) for _ in range(args.background)]
+        for _ in range(args.interactive):
+            futures.append(executor.submit(request, "interactive", time.monotonic()))
+            time.sleep(args.interval)
+        results = [future.result() for future in futures]
+
+    latencies = {kind: sorted(latency for lane, latency in results if lane == kind) for kind in ("interactive", "background")}
+    summary = {"rejected": rejected[0]}
+    for kind, values in latencies.items():
+        summary[kind] = (statistics.median(values), statistics.quantiles(values, n=20)[-1])
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a rate-limited provider under mixed interactive and background load")
+    parser.add_argument("--rps", type=float, default=5.0, help="requests per second allowed by the provider")
+    parser.add_argument("--burst", type=float, default=2.0, help="burst capacity of the limiter")
+    parser.add_argument("--tokens-per-minute", type=float, default=None, help="optional token budget per minute")
+    parser.add_argument("--tokens-per-request", type=int, default=500, help="tokens reported by each fake response")
+    parser.add_argument("--background", type=int, default=40, help="background requests submitted at the start")
+    parser.add_argument("--interactive", type=int, default=20, help="interactive requests, one every --interval seconds")
+    parser.add_argument("--interval", type=float, default=0.25, help="seconds between interactive requests")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM call")
+    args = parser.parse_args()
+
+    descriptions = {
+        "per-llm": "one limiter per LLM instance",
+        "shared": "one shared limiter, first come first served",
+        "lanes": "one shared limiter, generation before background",
+    }
+    print(f"Provider limit : {args.rps:.0f} req/s (+{args.burst:.0f} burst) | {args.background} background requests at once | "
+          f"{args.interactive} interactive requests every {args.interval * 1000:.0f} ms")
+    print(f"{'limiter':>50} | {'interactive p50':>15} | {'p95':>7} | {'background p50':>14} | {'p95':>7} | {'over provider limit':>19}")
+    for mode, description in descriptions.items():
+        result = simulate(mode, args)
+        print(
+            f"{description:>50} | {result['interactive'][0]:14.2f}s | {result['interactive'][1]:6.2f}s | "
+            f"{result['background'][0]:13.2f}s | {result['background'][1]:6.2f}s | {result['rejected']:>19}"
+        )
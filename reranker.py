@@ -0,0 +1,126 @@
+import os
+import time
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from model_registry import cross_encoder
+
+
+RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+def returns_logits(model: any) -> bool:
+    """Whether the cross-encoder's `predict` returns raw logits, judged from its configured activation."""
+    num_labels = getattr(model, "num_labels", 1)
+    if num_labels != 1:
+        raise ValueError(f"The reranker needs a cross-encoder with a single relevance label, got {num_labels} labels.")
+    # `activation_fn` in sentence-transformers 4 and later, `activation_fct` before.
+    activation = getattr(model, "activation_fn", None) or getattr(model, "activation_fct", None)
+    # Without a known activation, assume the usual single-label head without a sigmoid.
+    return activation is None or type(activation).__name__ == "Identity"
+
+
+class CrossEncoderReranker:
+    """Scores (query, chunk) pairs with a cross-encoder.
+
+    Scores are relevance probabilities in [0, 1], so they can be compared against fixed
+    thresholds. Models whose configured activation returns raw logits get a sigmoid; pass
+    `apply_sigmoid` to override that decision. Only the first `max_candidates` chunks of each
+    query (already ordered by the bi-encoder) are scored, which bounds the cost per query.
+    """
+
+    def __init__(self, model: Optional[str] = None, max_candidates: Optional[int] = None, batch_size: int = 32, apply_sigmoid: Optional[bool] = None) -> None:
+        self.model = cross_encoder(model or os.getenv("RERANKER_MODEL", RERANKER_MODEL))
+        self.max_candidates = max_candidates or int(os.getenv("RERANKER_CANDIDATES", "12"))
+        self.batch_size = batch_size
+        self.apply_sigmoid = returns_logits(self.model) if apply_sigmoid is None else apply_sigmoid
+
+    def scores_many(self, queries: List[str], candidates: List[List[str]]) -> List[np.ndarray]:
+        """Scores of the bounded candidate pool of each query, computed in one batched pass."""
+        candidates = [query_candidates[: self.max_candidates] for query_candidates in candidates]
+        pairs = [(query, candidate) for query, query_candidates in zip(queries, candidates) for candidate in query_candidates]
+        if not pairs:
+            return [np.zeros(0) for _ in queries]
+
+        scores = np.asarray(self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False), dtype=np.float64)
+        if self.apply_sigmoid:
+            scores = 1 / (1 + np.exp(-scores))
+
+        splits = np.cumsum([len(query_candidates) for query_candidates in candidates])[:-1]
+        return np.split(scores, splits)
+
+    def rerank_many(self, queries: List[str], candidates: List[List[str]], top_k: int) -> List[List[Tuple[str, float]]]:
+        """Top `top_k` (chunk, score) pairs per query, best first."""
+        ranked = []
+        for query_candidates, scores in zip(candidates, self.scores_many(queries, candidates)):
+            top = np.argsort(-scores, kind="stable")[:top_k]
+            ranked.append([(query_candidates[i], float(scores[i])) for i in top])
+        return ranked
+
+
+class GradingStats:
+    """Counts how the vector DB agent's relevance decisions were made."""
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.counts = {"reranker_relevant": 0, "reranker_not_relevant": 0, "cache": 0, "llm": 0}
+
+    def record(self, outcome: str) -> None:
+        with self.lock:
+            self.counts[outcome] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counts)
+
+
+def llm_calls_saved(agents: Dict[str, any], queries: List[str]) -> None:
+    """LLM calls per question of each vector DB agent, and the grading calls the reranker answered instead."""
+    from langchain_core.callbacks import BaseCallbackHandler
+    from langchain_core.messages import HumanMessage
+
+    class LLMCallCounter(BaseCallbackHandler):
+        def __init__(self) -> None:
+            self.calls = 0
+
+        def on_chat_model_start(self, serialized, messages, **kwargs) -> None:
+            self.calls += 1
+
+        def on_llm_start(self, serialized, prompts, **kwargs) -> None:
+            self.calls += 1
+
+    results = {}
+    for name, agent in agents.items():
+        counter = LLMCallCounter()
+        before = agent.grading_stats.snapshot()
+        start = time.perf_counter()
+        for query in queries:
+            agent.app.invoke({"messages": [HumanMessage(content=query)]}, {"callbacks": [counter]})
+        seconds = (time.perf_counter() - start) / len(queries)
+        after = agent.grading_stats.snapshot()
+        grading = {outcome: after[outcome] - before[outcome] for outcome in after}
+        results[name] = counter.calls / len(queries)
+        print(
+            f"{name:>9} : {results[name]:.2f} LLM calls per question | {seconds:.1f} s per question | grading decisions "
+            f"{grading['llm']} by LLM, {grading['cache']} from cache, "
+            f"{grading['reranker_relevant']} relevant and {grading['reranker_not_relevant']} not relevant by reranker | "
+            f"grading cache hit rate {agent.grading_cache.stats()['hit_rate']:.1%}"
+        )
+    if "baseline" in results and "reranker" in results:
+        print(f"LLM calls saved per question : {results['baseline'] - results['reranker']:.2f}")
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from llm_factory import create_llm
+    from test_suite import textual_queries
+    from vector_db_agent import VectorDBAgent
+
+    load_dotenv()
+    llm = create_llm()
+    llm_calls_saved(
+        {"baseline": VectorDBAgent(llm), "reranker": VectorDBAgent(llm, use_reranking=True)},
+        textual_queries,
+    )
@@ -0,0 +1,126 @@
+import re
+import time
+from typing import Dict, List, Set
+
+from few_shots import few_shots
+
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "by", "did", "do", "does", "for", "from", "has", "have", "how",
+    "in", "is", "it", "many", "much", "name", "of", "on", "or", "the", "their", "there", "to", "was",
+    "were", "what", "when", "where", "which", "who", "whose", "with", "all", "any", "find", "list",
+    "retrieve", "give", "show", "most", "more", "than", "id",
+}
+
+
+def tokenize(text: str) -> Set[str]:
+    tokens = set()
+    for word in re.findall(r"[a-z0-9]+", text.lower().replace("_", " ")):
+        if word in STOP_WORDS or len(word) < 2:
+            continue
+        # Crude singularisation so "medals" matches "medal" and "countries" matches "country".
+        if word.endswith("ies") and len(word) > 4:
+            word = word[:-3] + "y"
+        elif word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+            word = word[:-1]
+        tokens.add(word)
+    return tokens
+
+
+def tables_in_query(query: str) -> Set[str]:
+    return {match.lower() for match in re.findall(r"\b(?:FROM|JOIN)\s+`?(\w+)`?", query, re.IGNORECASE)}
+
+
+class SchemaPruner:
+    """Chooses the tables relevant to a question locally instead of asking the LLM.
+
+    Tables are scored by keyword overlap between the question and the table and column
+    names; tables used by the most similar few-shot examples are always included.
+    """
+
+    def __init__(self, schema: Dict, examples: List[Dict] = few_shots, max_examples: int = 2, min_score: float = 2.0) -> None:
+        self.tables = list(schema["tables"])
+        self.max_examples = max_examples
+        self.min_score = min_score
+        self.table_name_tokens = {table: tokenize(table) for table in self.tables}
+        self.column_tokens = {
+            table: set().union(*[tokenize(column["name"]) for column in schema["columns"].get(table, [])])
+            for table in self.tables
+        }
+        known_tables = {table.lower(): table for table in self.tables}
+        self.examples = [
+            (tokenize(example["input"]), [known_tables[t] for t in tables_in_query(example["query"]) if t in known_tables])
+            for example in examples
+        ]
+
+    def score_tables(self, question: str) -> Dict[str, float]:
+        question_tokens = tokenize(question)
+        scores = {
+            table: 2 * len(question_tokens & self.table_name_tokens[table]) + len(question_tokens & self.column_tokens[table])
+            for table in self.tables
+        }
+
+        similarities = sorted(
+            (
+                (len(question_tokens & example_tokens) / len(question_tokens | example_tokens), tables)
+                for example_tokens, tables in self.examples
+                if question_tokens | example_tokens
+            ),
+            key=lambda item: item[0],
+            reverse=True,
+        )
+        for similarity, tables in similarities[: self.max_examples]:
+            if similarity <= 0:
+                break
+            for table in tables:
+                scores[table] = max(scores[table], self.min_score)
+        return scores
+
+    def select(self, question: str) -> List[str]:
+        scores = self.score_tables(question)
+        selected = [table for table in self.tables if scores[table] >= self.min_score]
+        # Nothing matched: fall back to the full schema rather than guessing.
+        return selected or list(self.tables)
+
+
+def evaluate(sqlDBAgent: any, queries: List[str]) -> None:
+    """Compare the pruner's tables with the tables the LLM picks in `model_get_schema`."""
+    from langchain_core.messages import HumanMessage, ToolMessage
+
+    pruner = sqlDBAgent.schema_pruner()
+    list_tables_call = sqlDBAgent.first_tool_call({"messages": []})["messages"][0]
+    tables = ", ".join(sqlDBAgent.sqlDB.get_usable_table_names())
+
+    recalls, sizes, pruner_time, llm_time = [], [], 0.0, 0.0
+    for query in queries:
+        start = time.perf_counter()
+        selected = set(pruner.select(query))
+        pruner_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = sqlDBAgent.model_get_schema.invoke([
+            HumanMessage(content=query),
+            list_tables_call,
+            ToolMessage(content=tables, tool_call_id=list_tables_call.tool_calls[0]["id"]),
+        ])
+        llm_time += time.perf_counter() - start
+
+        chosen = set()
+        for tool_call in response.tool_calls:
+            chosen.update(t.strip() for t in tool_call["args"].get("table_names", "").split(",") if t.strip())
+        if chosen:
+            recalls.append(len(chosen & selected) / len(chosen))
+        sizes.append(len(selected))
+
+    print(f"LLM calls saved : {len(queries)} ({len(queries)} queries, 1 per query)")
+    print(f"Table recall vs LLM selection : {sum(recalls) / max(len(recalls), 1):.1%} over {len(recalls)} queries")
+    print(f"Average tables selected : {sum(sizes) / len(sizes):.2f} of {len(pruner.tables)}")
+    print(f"Selection time : pruner {pruner_time * 1000 / len(queries):.2f} ms/query | LLM {llm_time * 1000 / len(queries):.0f} ms/query")
+
+
+if __name__ == "__main__":
+    from llm_factory import create_llm
+    from sql_db_agent import SQLDBAgent
+    from test_suite import analytical_queries
+
+    evaluate(SQLDBAgent(create_llm()), analytical_queries)
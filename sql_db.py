@@ -1,8 +1,16 @@
+import json
 import os
+import re
+import time
+from threading import Lock
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 from langchain_community.utilities import SQLDatabase
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
+from langchain_core.tools import StructuredTool
+from sqlalchemy import create_engine, inspect
 from sqlalchemy.engine import URL
+from cache import LRUCache
 
 
 def _clean_env_value(value: str) -> str:
@@ -41,28 +49,195 @@ def _get_sqlalchemy_url() -> URL:
         database=database,
     )
 
+# Quoted strings and identifiers, kept verbatim when normalizing queries.
+_QUOTED = re.compile(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`[^`]*`)""")
+_COMMENT = re.compile(r"(--[^\n]*|#[^\n]*|/\*.*?\*/)", re.DOTALL)
+_READ_ONLY_START = {"select", "with", "show", "describe", "desc", "explain"}
+_WRITE_KEYWORDS = {
+    "insert", "update", "delete", "replace", "drop", "alter", "create", "truncate", "grant", "revoke",
+    "rename", "lock", "unlock", "call", "load", "handler", "set", "into", "do",
+}
+
+
+def normalize_sql(query: str) -> str:
+    """Collapse whitespace and lowercase everything outside quoted literals."""
+    parts = _QUOTED.split(query.strip().rstrip(";").strip())
+    return "".join(
+        part if index % 2 else re.sub(r"\s+", " ", part).lower()
+        for index, part in enumerate(parts)
+    )
+
+
+def is_read_only(query: str) -> bool:
+    """Whether the query is a single statement that cannot modify data or session state."""
+    code = " ".join(_COMMENT.sub(" ", part) for index, part in enumerate(_QUOTED.split(query)) if index % 2 == 0)
+    code = code.strip().rstrip(";").lower()
+    if not code or ";" in code:
+        return False
+    words = re.findall(r"[a-z_]+", code)
+    return bool(words) and words[0] in _READ_ONLY_START and not _WRITE_KEYWORDS.intersection(words)
+
+
 class SQLDB:
-    def __init__(self, llm : any, verbose : bool = False) -> None:
+    def __init__(self, llm : any, verbose : bool = False, schema_cache_ttl : Optional[float] = None, schema_cache_path : Optional[str] = None, result_cache_size : Optional[int] = None, result_cache_ttl : Optional[float] = None) -> None:
         load_dotenv()
-        self.db = SQLDatabase.from_uri(
+        self.verbose = verbose
+        self.engine = create_engine(
             _get_sqlalchemy_url().render_as_string(hide_password=False),
-            sample_rows_in_table_info=3,
-            engine_args={
-                "pool_pre_ping": True,
-                "connect_args": {
-                    "charset": "utf8mb4",
-                    "connect_timeout": 10,
-                    "read_timeout": 10,
-                    "write_timeout": 10,
-                },
+            pool_pre_ping=True,
+            connect_args={
+                "charset": "utf8mb4",
+                "connect_timeout": 10,
+                "read_timeout": 10,
+                "write_timeout": 10,
             },
         )
+        # Tables are reflected on first use rather than here, so a loaded schema snapshot avoids it.
+        self.db = SQLDatabase(self.engine, sample_rows_in_table_info=3, lazy_table_reflection=True)
         
         self.toolkit = SQLDatabaseToolkit(db = self.db, llm = llm)
+
+        # Schema snapshot served instead of reflecting tables and sampling rows on every call.
+        # A non-positive TTL keeps the snapshot until refresh_schema() is called.
+        self.schema_cache_ttl = float(os.getenv("SQL_SCHEMA_CACHE_TTL", "86400")) if schema_cache_ttl is None else schema_cache_ttl
+        self.schema_cache_path = schema_cache_path or os.getenv("SQL_SCHEMA_CACHE_PATH") or None
+        self._schema = None
+        self._schema_lock = Lock()
+        self._schema_stats = {"snapshot_builds" : 0, "snapshot_loads" : 0, "metadata_calls_avoided" : 0}
+
+        # Results of read-only queries, keyed by the normalized SQL.
+        self.result_cache = LRUCache(
+            int(os.getenv("SQL_RESULT_CACHE_SIZE", "256")) if result_cache_size is None else result_cache_size,
+            ttl = float(os.getenv("SQL_RESULT_CACHE_TTL", "600")) if result_cache_ttl is None else result_cache_ttl,
+        )
+        self._result_cache_bypasses = 0
+        self._result_cache_lock = Lock()
     
-    
+    def _schema_expired(self, schema : Dict) -> bool:
+        return self.schema_cache_ttl > 0 and time.time() - schema["created_at"] > self.schema_cache_ttl
+
+    def _load_schema_file(self) -> Optional[Dict]:
+        if not self.schema_cache_path or not os.path.exists(self.schema_cache_path):
+            return None
+        with open(self.schema_cache_path, "r", encoding="utf-8") as f:
+            schema = json.load(f)
+        if self._schema_expired(schema):
+            return None
+        self._schema_stats["snapshot_loads"] += 1
+        return schema
+
+    def _build_schema(self) -> Dict:
+        if self.verbose:
+            print("---BUILDING SCHEMA SNAPSHOT---")
+        # Each table is reflected and sampled once; get_table_info() joins these in table name order.
+        tables = self.db.get_usable_table_names()
+        table_info = {table : self.db.get_table_info([table]) for table in tables}
+        inspector = inspect(self.engine)
+        columns = {
+            table : [
+                {"name" : column["name"], "nullable" : bool(column.get("nullable", True))}
+                for column in inspector.get_columns(table)
+            ]
+            for table in tables
+        }
+        schema = {
+            "created_at" : time.time(),
+            "tables" : tables,
+            "table_info" : table_info,
+            "columns" : columns,
+        }
+        self._schema_stats["snapshot_builds"] += 1
+        if self.schema_cache_path:
+            with open(self.schema_cache_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(schema, f)
+            os.replace(self.schema_cache_path + ".tmp", self.schema_cache_path)
+        return schema
+
+    def get_schema(self) -> Dict:
+        with self._schema_lock:
+            if self._schema is not None and not self._schema_expired(self._schema):
+                self._schema_stats["metadata_calls_avoided"] += 1
+                return self._schema
+            self._schema = self._load_schema_file()
+            if self._schema is not None:
+                self._schema_stats["metadata_calls_avoided"] += 1
+            else:
+                self._schema = self._build_schema()
+            return self._schema
+
+    def refresh_schema(self) -> None:
+        with self._schema_lock:
+            self._schema = self._build_schema()
+
+    def schema_cache_stats(self) -> Dict[str, int]:
+        with self._schema_lock:
+            return dict(self._schema_stats)
+
+    def get_usable_table_names(self) -> List[str]:
+        return list(self.get_schema()["tables"])
+
+    def get_table_info(self, table_names : Optional[List[str]] = None) -> str:
+        schema = self.get_schema()
+        if table_names is not None:
+            missing_tables = set(table_names).difference(schema["tables"])
+            if missing_tables:
+                raise ValueError(f"table_names {missing_tables} not found in database")
+        requested = schema["tables"] if table_names is None else [table for table in schema["tables"] if table in set(table_names)]
+        return "\n\n".join(schema["table_info"][table] for table in requested)
+
+    def get_table_info_no_throw(self, table_names : Optional[List[str]] = None) -> str:
+        try:
+            return self.get_table_info(table_names)
+        except ValueError as e:
+            return f"Error: {e}"
+
+    def run_query(self, query : str) -> str:
+        """
+        Run a query through the result cache. Anything that is not a read-only query bypasses the cache,
+        and errors are never cached.
+        """
+        if self.result_cache.max_size <= 0 or not is_read_only(query):
+            with self._result_cache_lock:
+                self._result_cache_bypasses += 1
+            return self.db.run_no_throw(query)
+
+        key = normalize_sql(query)
+        result = self.result_cache.get(key)
+        if result is not None:
+            if self.verbose:
+                print("---SQL RESULT CACHE HIT---")
+            return result
+
+        result = self.db.run_no_throw(query)
+        if isinstance(result, str) and not result.startswith("Error:"):
+            self.result_cache.set(key, result)
+        return result
+
+    def result_cache_stats(self) -> Dict:
+        with self._result_cache_lock:
+            bypasses = self._result_cache_bypasses
+        return {**self.result_cache.stats(), "bypasses" : bypasses}
+
     def get_tools(self):
-        return self.toolkit.get_tools()
+        tools = []
+        for toolkit_tool in self.toolkit.get_tools():
+            # Serve the metadata tools from the schema snapshot instead of the database.
+            if toolkit_tool.name == "sql_db_list_tables":
+                toolkit_tool = StructuredTool.from_function(
+                    func = lambda tool_input = "" : ", ".join(self.get_usable_table_names()),
+                    name = toolkit_tool.name,
+                    description = toolkit_tool.description,
+                    args_schema = toolkit_tool.args_schema,
+                )
+            elif toolkit_tool.name == "sql_db_schema":
+                toolkit_tool = StructuredTool.from_function(
+                    func = lambda table_names : self.get_table_info_no_throw([t.strip() for t in table_names.split(",")]),
+                    name = toolkit_tool.name,
+                    description = toolkit_tool.description,
+                    args_schema = toolkit_tool.args_schema,
+                )
+            tools.append(toolkit_tool)
+        return tools
 
 if __name__ == '__main__':
     from llm_factory import create_llm
@@ -72,3 +247,9 @@ if __name__ == '__main__':
         verbose = True
     )
     print(sqlDB.db.run("select full_name from athletes where name like '%Pol Amat%';"))
+    print(sqlDB.get_usable_table_names())
+    print(sqlDB.get_usable_table_names())
+    print(sqlDB.schema_cache_stats())
+    print(sqlDB.run_query("select count(*) from athletes;"))
+    print(sqlDB.run_query("SELECT COUNT(*)\n  FROM athletes"))
+    print(sqlDB.result_cache_stats())
@@ -1,9 +1,11 @@
-from typing import Any, Literal
+from typing import Any, Literal, Optional
 import re
+from threading import Lock
 from uuid import uuid4
 
 from langchain_core.messages import ToolMessage, HumanMessage, AIMessage
 from langchain_core.runnables import RunnableLambda, RunnableWithFallbacks
+from langchain_core.runnables.config import run_in_executor
 from langchain_core.prompts import ChatPromptTemplate,MessagesPlaceholder,SystemMessagePromptTemplate, PromptTemplate
 from langchain_core.tools import tool
 from langchain_core.runnables.graph import MermaidDrawMethod
@@ -12,16 +14,35 @@ from langgraph.prebuilt import ToolNode
 from pydantic import BaseModel, Field
 
 from sql_db import SQLDB
-from prompts import query_check_system_prompt, query_gen_system_prompt, query_gen_few_shot_system_prompt, sql_context_prompt
+from prompts import query_check_system_prompt, query_check_issues_prompt, query_gen_system_prompt, query_gen_few_shot_system_prompt, sql_context_prompt
 from few_shots import few_shots
+from few_shot_selector import FewShotSelector, EMBEDDING_MODEL
+from schema_pruner import SchemaPruner
+from sql_validator import SQLValidator, Validation
+from model_registry import sentence_transformer
+from llm_factory import resolve_llm
+
+# Answer of the agent when it runs out of query attempts.
+NO_CONTEXT_ANSWER = "Unable to find the required context"
+
+class SQLAgentState(MessagesState):
+    # Query generation attempts for this request; kept in the graph state so concurrent requests don't share it.
+    sql_tries : int
 
 class SQLDBAgent:
-    def __init__(self, llm: any, verbose: bool = False, maxRetry : int = 3, use_few_shot : bool = True):
-        self.llm = llm
+    def __init__(self, llm: any, verbose: bool = False, maxRetry : int = 3, use_few_shot : bool = True, use_schema_pruner : bool = False, few_shot_k : int = 5, use_sql_validator : bool = False):
+        self.llm = resolve_llm(llm, "sql_generator")
         self.verbose = verbose
-        self.tries = 0
         self.maxRetry = maxRetry
-        self.sqlDB = SQLDB(llm, verbose = verbose)
+        self.use_schema_pruner = use_schema_pruner
+        # Generated queries are checked statically first; only those with problems go to the LLM checker.
+        self.use_sql_validator = use_sql_validator
+        self.fewShotSelector = None
+        self._schema_pruner = None
+        self._sql_validator = None
+        self._stats_lock = Lock()
+        self._stats = {"llm_calls_saved" : 0, "llm_query_checks" : 0, "static_rejections" : 0}
+        self.sqlDB = SQLDB(resolve_llm(llm, "sql_checker"), verbose = verbose)
         tools = self.sqlDB.get_tools()
         list_tables_tool = next(tool for tool in tools if tool.name == "sql_db_list_tables")
         get_schema_tool = next(tool for tool in tools if tool.name == "sql_db_schema")
@@ -34,7 +55,7 @@ class SQLDBAgent:
             If an error is returned, rewrite the query, check the query, and try again.
             Only the query should be given as input to this tool, without any additional text. For example, if the query is "SELECT name FROM athletes", then only "SELECT name FROM athletes" should be given as input, without any additional text like "The query is: SELECT name FROM athletes".
             """
-            result = self.sqlDB.db.run_no_throw(query)
+            result = self.sqlDB.run_query(query)
             if self.verbose:
                 print(result)
             if not result:
@@ -44,9 +65,13 @@ class SQLDBAgent:
         query_check_prompt = ChatPromptTemplate.from_messages(
             [("system", query_check_system_prompt), ("human", "{query}")]
         )
-        self.query_check = query_check_prompt | llm
+        self.query_check = query_check_prompt | resolve_llm(llm, "sql_checker")
+        query_check_issues_template = ChatPromptTemplate.from_messages(
+            [("system", query_check_system_prompt), ("human", "{query}"), ("human", query_check_issues_prompt)]
+        )
+        self.query_check_issues = query_check_issues_template | resolve_llm(llm, "sql_checker")
 
-        workflow = StateGraph(MessagesState)
+        workflow = StateGraph(SQLAgentState)
         workflow.add_node("first_tool_call", self.first_tool_call)
 
         # Add nodes for the first two tools
@@ -54,13 +79,16 @@ class SQLDBAgent:
         workflow.add_node("get_schema_tool", self.create_tool_node_with_fallback([get_schema_tool]))
 
         # Add a node for a model to choose the relevant tables based on the question and available tables
-        model_get_schema = llm.bind_tools([get_schema_tool])
-        workflow.add_node(
-            "model_get_schema",
-            lambda state: {
-                "messages": [model_get_schema.invoke(state["messages"])],
-            },
-        )
+        # Picking tables is a tool-choosing hop, so it runs on the router model like the other agents' tool calls.
+        self.model_get_schema = resolve_llm(llm, "router").bind_tools([get_schema_tool])
+        if use_schema_pruner:
+            # Choose the tables locally; the node emits the same sql_db_schema tool call as the LLM would.
+            workflow.add_node("model_get_schema", self.prune_schema)
+        else:
+            workflow.add_node(
+                "model_get_schema",
+                RunnableLambda(self.call_model_get_schema, afunc = self.acall_model_get_schema),
+            )
 
         class SubmitFinalAnswer(BaseModel):
             """Submit the final answer to the user based on the query results."""
@@ -72,7 +100,17 @@ class SQLDBAgent:
             input_variables = ["tables", "schema", "query", "result"]
         )
         
-        if use_few_shot:
+        if use_few_shot and few_shot_k and few_shot_k < len(few_shots):
+            # Only the examples most similar to the question are sent with each query generation.
+            self.fewShotSelector = FewShotSelector(few_shots, sentence_transformer(EMBEDDING_MODEL), k = few_shot_k)
+            query_gen_prompt = ChatPromptTemplate.from_messages(
+                [
+                    SystemMessagePromptTemplate.from_template(query_gen_few_shot_system_prompt),
+                    MessagesPlaceholder(variable_name="examples"),
+                    MessagesPlaceholder(variable_name="messages"),
+                ]
+            )
+        elif use_few_shot:
             example_messages = [
                 SystemMessagePromptTemplate.from_template(
                     f"User input: {example['input']}\nSQL query: {example['query']}"
@@ -91,14 +129,14 @@ class SQLDBAgent:
                 [("system", query_gen_system_prompt), ("placeholder", "{messages}")]
             )
 
-        self.query_gen = query_gen_prompt | llm.bind_tools(
+        self.query_gen = query_gen_prompt | self.llm.bind_tools(
             [SubmitFinalAnswer]
         )
 
-        workflow.add_node("query_gen", self.query_gen_node)
+        workflow.add_node("query_gen", RunnableLambda(self.query_gen_node, afunc = self.aquery_gen_node))
 
         # Add a node for the model to check the query before executing it
-        workflow.add_node("correct_query", self.model_check_query)
+        workflow.add_node("correct_query", RunnableLambda(self.model_check_query, afunc = self.amodel_check_query))
 
         # Add node for executing the query
         workflow.add_node("execute_query", self.create_tool_node_with_fallback([db_query_tool]))
@@ -113,7 +151,7 @@ class SQLDBAgent:
             "query_gen",
             self.should_continue,
         )
-        workflow.add_edge("correct_query", "execute_query")
+        workflow.add_conditional_edges("correct_query", self.after_query_check)
         workflow.add_edge("execute_query", "query_gen")
 
         # Compile the workflow into a runnable
@@ -137,15 +175,64 @@ class SQLDBAgent:
             ]
         }
     
-    def query_gen_node(self, state: MessagesState):
+    def call_model_get_schema(self, state: MessagesState) -> dict[str, list[AIMessage]]:
+        return {"messages": [self.model_get_schema.invoke(state["messages"])]}
+
+    async def acall_model_get_schema(self, state: MessagesState) -> dict[str, list[AIMessage]]:
+        return {"messages": [await self.model_get_schema.ainvoke(state["messages"])]}
+
+    def schema_pruner(self) -> SchemaPruner:
+        if self._schema_pruner is None:
+            self._schema_pruner = SchemaPruner(self.sqlDB.get_schema())
+        return self._schema_pruner
+
+    def prune_schema(self, state: MessagesState) -> dict[str, list[AIMessage]]:
+        if self.verbose:
+            print("---SELECTING RELEVANT TABLES---")
+        tables = self.schema_pruner().select(state["messages"][0].content)
+        if self.verbose:
+            print("Selected Tables:", tables)
+        with self._stats_lock:
+            self._stats["llm_calls_saved"] += 1
+        return {
+            "messages": [
+                AIMessage(
+                    content="",
+                    tool_calls=[
+                        {
+                            "name": "sql_db_schema",
+                            "args": {"table_names": ", ".join(tables)},
+                            "id": f"sql_schema_{uuid4().hex}",
+                        }
+                    ],
+                )
+            ]
+        }
+
+    def stats(self) -> dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def query_gen_node(self, state: SQLAgentState):
         if self.verbose:
             print("---CALL SQL DB AGENT---")
-        message = self.query_gen.invoke(
-            {"messages": self._sanitize_messages_for_query_gen(state)}
-        )
+        inputs = {"messages": self._sanitize_messages_for_query_gen(state)}
+        if self.fewShotSelector is not None:
+            inputs["examples"] = self.fewShotSelector.render(state["messages"][0].content)
+        return self._handle_query_gen_message(state, self.query_gen.invoke(inputs))
+
+    async def aquery_gen_node(self, state: SQLAgentState):
+        if self.verbose:
+            print("---CALL SQL DB AGENT---")
+        inputs = {"messages": self._sanitize_messages_for_query_gen(state)}
+        if self.fewShotSelector is not None:
+            # Embedding the question is CPU-bound; keep it off the event loop.
+            inputs["examples"] = await run_in_executor(None, self.fewShotSelector.render, state["messages"][0].content)
+        return self._handle_query_gen_message(state, await self.query_gen.ainvoke(inputs))
+
+    def _handle_query_gen_message(self, state: SQLAgentState, message: AIMessage) -> dict:
         if self.verbose:
             print(message)
-        self.tries = self.tries + 1
 
         normalized_message = self._normalize_query_gen_message(message)
 
@@ -190,7 +277,7 @@ class SQLDBAgent:
                         "Output only the SQL query to execute."
                     )
                 )
-        return {"messages": [normalized_message] + tool_messages}
+        return {"messages": [normalized_message] + tool_messages, "sql_tries": state.get("sql_tries", 0) + 1}
     
     def _sanitize_messages_for_query_gen(self, state: MessagesState) -> list[HumanMessage | AIMessage]:
         """
@@ -252,6 +339,11 @@ class SQLDBAgent:
 
         return False
 
+    def sql_validator(self) -> SQLValidator:
+        if self._sql_validator is None:
+            self._sql_validator = SQLValidator(self.sqlDB.get_schema())
+        return self._sql_validator
+
     def model_check_query(self, state: MessagesState) -> dict[str, list[AIMessage]]:
         """
         Use this tool to double-check if your query is correct before executing it.
@@ -259,12 +351,69 @@ class SQLDBAgent:
         if self.verbose:
             print("---CHECKING QUERY---")
         original_query = state["messages"][-1].content
-        response = self.query_check.invoke({"query": original_query})
+        validation = self._validate(original_query)
+        settled = self._statically_checked(original_query, validation)
+        if settled is not None:
+            return settled
+        chain, inputs = self._query_check_call(original_query, validation)
+        response = chain.invoke(inputs)
+        return self._checked_query_call(original_query, response)
+
+    async def amodel_check_query(self, state: MessagesState) -> dict[str, list[AIMessage]]:
+        if self.verbose:
+            print("---CHECKING QUERY---")
+        original_query = state["messages"][-1].content
+        # The first validation loads the schema snapshot; keep it off the event loop.
+        validation = await run_in_executor(None, self._validate, original_query)
+        settled = self._statically_checked(original_query, validation)
+        if settled is not None:
+            return settled
+        chain, inputs = self._query_check_call(original_query, validation)
+        response = await chain.ainvoke(inputs)
+        return self._checked_query_call(original_query, response)
+
+    def _validate(self, query: str) -> Optional[Validation]:
+        if not self.use_sql_validator:
+            return None
+        validation = self.sql_validator().validate(query)
+        if self.verbose and not validation.clean:
+            print("Static SQL Check:", validation.rejected + validation.issues)
+        return validation
+
+    def _statically_checked(self, query: str, validation: Optional[Validation]) -> Optional[dict[str, list[AIMessage]]]:
+        """
+        The node's result when the static checks settle the query: clean queries are executed
+        as they are, and rejected ones go back to query generation. None when the LLM should check it.
+        """
+        if validation is None or (validation.issues and not validation.rejected):
+            return None
+        if validation.rejected:
+            with self._stats_lock:
+                self._stats["static_rejections"] += 1
+            return {"messages": [AIMessage(content="Error: " + " ".join(validation.rejected) + " Please rewrite the query.")]}
+        with self._stats_lock:
+            self._stats["llm_calls_saved"] += 1
+        return self._query_call(query)
+
+    def _query_check_call(self, query: str, validation: Optional[Validation]) -> tuple[Any, dict[str, str]]:
+        with self._stats_lock:
+            self._stats["llm_query_checks"] += 1
+        if validation is None:
+            return self.query_check, {"query": query}
+        return self.query_check_issues, {"query": query, "issues": "\n".join(f"- {issue}" for issue in validation.issues)}
+
+    def after_query_check(self, state: MessagesState) -> Literal["execute_query", "query_gen"]:
+        return "execute_query" if state["messages"][-1].tool_calls else "query_gen"
+
+    def _checked_query_call(self, original_query: str, response: AIMessage) -> dict[str, list[AIMessage]]:
         checked_query = self._extract_sql(response.content, fallback=original_query)
 
         if self.verbose:
             print("Checked Query:", checked_query)
 
+        return self._query_call(checked_query)
+
+    def _query_call(self, query: str) -> dict[str, list[AIMessage]]:
         return {
             "messages": [
                 AIMessage(
@@ -272,7 +421,7 @@ class SQLDBAgent:
                     tool_calls=[
                         {
                             "name": "sql_db_query",
-                            "args": {"query": checked_query},
+                            "args": {"query": query},
                             "id": f"sql_query_{uuid4().hex}",
                         }
                     ],
@@ -322,19 +471,17 @@ class SQLDBAgent:
         }
     
     # Define a conditional edge to decide whether to continue or end the workflow
-    def should_continue(self, state: MessagesState) -> Literal[END, "correct_query", "query_gen"]:
+    def should_continue(self, state: SQLAgentState) -> Literal[END, "correct_query", "query_gen"]:
         messages = state["messages"]
         last_message = messages[-1]
         # If there is a tool call, then we finish
         if last_message.content.startswith("Final_Answer:"):
             state["messages"][-1].content = last_message.content.removeprefix("Final_Answer:")
-            self.tries = 0
             return END
-        elif self.tries >= self.maxRetry:
+        elif state.get("sql_tries", 0) >= self.maxRetry:
             if self.verbose:
                 print("---MAX RETRIES REACHED---")
-            state["messages"][-1].content = "Unable to find the required context"
-            self.tries = 0
+            state["messages"][-1].content = NO_CONTEXT_ANSWER
             return END
         elif last_message.content.startswith("Error:"):
             return "query_gen"
@@ -342,8 +489,8 @@ class SQLDBAgent:
             return "correct_query"
     
     def get_context(self, state : MessagesState) -> str:
-        tables = self.sqlDB.db.get_usable_table_names()
-        schema = self.sqlDB.db.get_table_info()
+        tables = self.sqlDB.get_usable_table_names()
+        schema = self.sqlDB.get_table_info()
         query = None
         result = None
 
@@ -371,6 +518,10 @@ class SQLDBAgent:
     def processQuery(self, query : str) -> str:
         state = self.app.invoke({"messages": [HumanMessage(content = query)]})
         return state["messages"][-1].content
+
+    async def aprocessQuery(self, query : str) -> str:
+        state = await self.app.ainvoke({"messages": [HumanMessage(content = query)]})
+        return state["messages"][-1].content
     
     def visualize(self) -> None:
         image_data = self.app.get_graph().draw_mermaid_png(
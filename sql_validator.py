@@ -0,0 +1,181 @@
+"""Static checks of generated SQL against the schema snapshot, so clean queries skip the LLM query check.
+
+python sql_validator.py   # analytical test_suite questions: LLM checks saved and query failure rates
+"""
+import argparse
+from dataclasses import dataclass, field
+from importlib import import_module
+from typing import Dict, List, Optional, Set
+
+
+def _sqlglot() -> any:
+    try:
+        return import_module("sqlglot")
+    except ImportError as exc:
+        raise ImportError(
+            "Static SQL validation requires 'sqlglot'. Install it with: pip install \".[sql-validation]\" (or pip install sqlglot)"
+        ) from exc
+
+
+@dataclass
+class Validation:
+    # Reasons the query must not be executed at all.
+    rejected: List[str] = field(default_factory=list)
+    # Problems worth a second look by the LLM checker.
+    issues: List[str] = field(default_factory=list)
+
+    @property
+    def clean(self) -> bool:
+        return not self.rejected and not self.issues
+
+
+class SQLValidator:
+    """Parses a query in the MySQL dialect and checks it against the schema snapshot.
+
+    Anything but a single read-only query, or SQL that does not parse, is rejected. Tables and
+    columns missing from the schema are reported as issues, as is NOT IN over a nullable column
+    of a subquery without an IS NOT NULL filter (it matches no rows once the subquery returns a
+    NULL). Columns of derived tables and CTEs are not checked.
+    """
+
+    def __init__(self, schema: Dict, dialect: str = "mysql") -> None:
+        self.sqlglot = _sqlglot()
+        self.exp = import_module("sqlglot.expressions")
+        self.dialect = dialect
+        self.columns = {
+            table.lower(): {column["name"].lower(): column["nullable"] for column in schema["columns"].get(table, [])}
+            for table in schema["tables"]
+        }
+
+    def validate(self, query: str) -> Validation:
+        exp = self.exp
+        try:
+            statements = [statement for statement in self.sqlglot.parse(query, read=self.dialect) if statement is not None]
+        except self.sqlglot.errors.ParseError as error:
+            return Validation(rejected=[f"The query could not be parsed: {str(error).splitlines()[0]}"])
+        # Read-only is decided on the parse tree, so function names such as REPLACE() are allowed.
+        # Locking reads (FOR UPDATE, LOCK IN SHARE MODE) take row locks, so they do not count as read-only.
+        writes = (exp.Insert, exp.Update, exp.Delete, exp.Into, exp.Command, exp.Lock)
+        if len(statements) != 1 or not isinstance(statements[0], exp.Query) or statements[0].find(*writes) is not None:
+            return Validation(rejected=["Only a single read-only SELECT query may be executed."])
+
+        statement = statements[0]
+        issues = self._table_and_column_issues(statement) + self._not_in_issues(statement)
+        return Validation(issues=list(dict.fromkeys(issues)))
+
+    def _derived_names(self, statement: any) -> Set[str]:
+        exp = self.exp
+        names = {cte.alias.lower() for cte in statement.find_all(exp.CTE) if cte.alias}
+        names.update(subquery.alias.lower() for subquery in statement.find_all(exp.Subquery) if subquery.alias)
+        return names
+
+    def _table_aliases(self, statement: any, derived: Set[str]) -> Dict[str, str]:
+        """Alias (or name) of every schema table in the query, mapped to the table."""
+        return {
+            table.alias_or_name.lower(): table.name.lower()
+            for table in statement.find_all(self.exp.Table)
+            if table.name.lower() not in derived
+        }
+
+    def _table_and_column_issues(self, statement: any) -> List[str]:
+        exp = self.exp
+        derived = self._derived_names(statement)
+        aliases = self._table_aliases(statement, derived)
+        issues = [f"Unknown table `{table}`." for table in aliases.values() if table not in self.columns]
+        tables = [table for table in set(aliases.values()) if table in self.columns]
+        output_names = {alias.alias.lower() for alias in statement.find_all(exp.Alias)}
+
+        for column in statement.find_all(exp.Column):
+            if isinstance(column.this, exp.Star):
+                continue
+            name, qualifier = column.name.lower(), column.table.lower()
+            if qualifier:
+                if qualifier in derived:
+                    continue
+                table = aliases.get(qualifier)
+                if table is None:
+                    issues.append(f"Unknown table or alias `{qualifier}` in `{qualifier}.{name}`.")
+                elif table in self.columns and name not in self.columns[table]:
+                    issues.append(f"Unknown column `{name}` in table `{table}`.")
+            elif name not in output_names and not derived and not any(name in self.columns[table] for table in tables):
+                issues.append(f"Unknown column `{name}` in tables {', '.join(f'`{table}`' for table in sorted(tables))}.")
+        return issues
+
+    def _nullable_column(self, select: any, column: any) -> Optional[str]:
+        """`table.column` when the column selected by a subquery is nullable, else None."""
+        derived = self._derived_names(select)
+        aliases = self._table_aliases(select, derived)
+        name, qualifier = column.name.lower(), column.table.lower()
+        if qualifier:
+            tables = [aliases[qualifier]] if qualifier in aliases else []
+        else:
+            tables = list(aliases.values())
+        for table in tables:
+            if self.columns.get(table, {}).get(name):
+                return f"{table}.{name}"
+        return None
+
+    def _not_in_issues(self, statement: any) -> List[str]:
+        exp = self.exp
+        issues = []
+        for negation in statement.find_all(exp.Not):
+            condition = negation.this
+            subquery = condition.args.get("query") if isinstance(condition, exp.In) else None
+            if subquery is None:
+                continue
+            select = subquery.this if isinstance(subquery, exp.Subquery) else subquery
+            if not isinstance(select, exp.Select) or len(select.expressions) != 1:
+                continue
+            column = select.expressions[0].unalias()
+            if not isinstance(column, exp.Column):
+                continue
+            nullable = self._nullable_column(select, column)
+            where = select.args.get("where")
+            filtered = where is not None and any(
+                isinstance(node.this, exp.Is) and isinstance(node.this.this, exp.Column) and node.this.this.name.lower() == column.name.lower()
+                for node in where.find_all(exp.Not)
+            )
+            if nullable and not filtered:
+                issues.append(
+                    f"NOT IN over the nullable column `{nullable}` matches no rows if the subquery returns a NULL; "
+                    "filter it with IS NOT NULL or use NOT EXISTS."
+                )
+        return issues
+
+
+def evaluate(queries: List[str]) -> None:
+    """Answer the questions with and without static validation; report LLM checks and failed query executions."""
+    from dotenv import load_dotenv
+    from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+    from llm_factory import create_llm
+    from sql_db_agent import NO_CONTEXT_ANSWER, SQLDBAgent
+
+    load_dotenv()
+    llm = create_llm()
+    print(f"Questions : {len(queries)}")
+    print(f"{'query check':>17} | {'executions':>10} | {'failed':>6} | {'unanswered':>10} | {'LLM checks':>10} | {'LLM calls saved':>15}")
+    for name, use_sql_validator in (("LLM only", False), ("static, then LLM", True)):
+        agent = SQLDBAgent(llm, use_sql_validator = use_sql_validator)
+        executions = failures = unanswered = 0
+        for query in queries:
+            messages = agent.app.invoke({"messages": [HumanMessage(content = query)]})["messages"]
+            for previous, message in zip(messages, messages[1:]):
+                if isinstance(message, ToolMessage) and isinstance(previous, AIMessage) and any(call["name"] == "sql_db_query" for call in previous.tool_calls):
+                    executions += 1
+                    failures += message.content.startswith("Error")
+            unanswered += messages[-1].content == NO_CONTEXT_ANSWER
+        stats = agent.stats()
+        print(
+            f"{name:>17} | {executions:>10} | {failures / max(executions, 1):>6.1%} | {unanswered:>10} | "
+            f"{stats['llm_query_checks']:>10} | {stats['llm_calls_saved']:>15}"
+        )
+
+
+if __name__ == "__main__":
+    from test_suite import analytical_queries
+
+    parser = argparse.ArgumentParser(description="LLM query checks saved by static SQL validation on the analytical test_suite questions")
+    parser.add_argument("--queries", type=int, default=len(analytical_queries), help="number of analytical questions")
+    args = parser.parse_args()
+    evaluate(analytical_queries[: args.queries])
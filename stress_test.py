@@ -0,0 +1,92 @@
+import argparse
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from fake_backends import FakeChatModel, expected_agent, olympics_responder, stubbed_backends
+
+
+QUESTION_TEMPLATES = [
+    "How many gold medals has athlete {n} won",
+    "Explain the scoring rules of event {n}",
+    "Who won the most medals in the 2024 Olympics in event {n}?",
+    "List the unanswerable statistic number {n}",
+    "Describe the obscure rules of event {n}",
+]
+
+
+def build_questions(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [rng.choice(QUESTION_TEMPLATES).format(n=index) for index in range(count)]
+
+
+def trace(state: dict) -> Tuple:
+    """Route taken by a request: message types, tool calls and tool outputs, then the answer."""
+    steps = []
+    for message in state["messages"]:
+        if isinstance(message, AIMessage) and message.tool_calls:
+            steps.append("call:" + ",".join(tool_call["name"] for tool_call in message.tool_calls))
+        else:
+            steps.append(message.type)
+    return tuple(steps), state["messages"][-1].content
+
+
+def run(num_queries: int, workers: int, llm_latency: float, backend_latency: float) -> bool:
+    """
+    Answer the same questions sequentially and in parallel through one shared QueryProcessor
+    and check that every parallel request takes the same route, with the same number of
+    retries, and gives the same answer as its sequential run.
+    """
+    from query_processor import QueryProcessor
+
+    llm = FakeChatModel(responder=olympics_responder, latency=llm_latency)
+    with stubbed_backends(backend_latency):
+        queryProcessor = QueryProcessor(llm, startup_mode="eager")
+
+    questions = build_questions(num_queries)
+
+    def answer(question: str) -> Tuple:
+        return trace(queryProcessor.app.invoke({"messages": [HumanMessage(content=question)]}))
+
+    start = time.perf_counter()
+    expected = [answer(question) for question in questions]
+    sequential_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        actual = list(executor.map(answer, questions))
+    parallel_time = time.perf_counter() - start
+
+    mismatches = [
+        (question, want, got) for question, want, got in zip(questions, expected, actual) if want != got
+    ]
+    routed = {}
+    for question in questions:
+        routed[expected_agent(question)] = routed.get(expected_agent(question), 0) + 1
+
+    print(f"Queries : {num_queries} ({', '.join(f'{agent}: {count}' for agent, count in sorted(routed.items()))})")
+    print(f"Sequential : {sequential_time:.2f} s | Parallel ({workers} workers) : {parallel_time:.2f} s")
+    print(f"Requests with a different route or answer : {len(mismatches)}")
+    for question, want, got in mismatches[:5]:
+        print(f"  {question!r}\n    expected: {want!r}\n    got:      {got!r}")
+    return not mismatches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run many queries concurrently through one QueryProcessor against stubbed backends")
+    parser.add_argument("--queries", type=int, default=200, help="number of questions")
+    parser.add_argument("--workers", type=int, default=32, help="concurrent requests")
+    parser.add_argument("--llm-latency", type=float, default=0.005, help="seconds per fake LLM call")
+    parser.add_argument("--backend-latency", type=float, default=0.002, help="seconds per stubbed database or search call")
+    args = parser.parse_args()
+
+    if not run(args.queries, args.workers, args.llm_latency, args.backend_latency):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
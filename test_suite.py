@@ -1,5 +1,4 @@
-queries = [
-    # Textual Queries
+textual_queries = [
     "What are the dimensions of a badminton court?",
     "Describe the serving rules in doubles badminton.",
     "How is a judo match scored?",
@@ -50,8 +49,9 @@ queries = [
     "What is required for a gymnast to earn bonus points?",
     "Explain the concept of 'passive play' in handball.",
     "What is the judging process in Olympic breaking?",
+]
 
-    # Analytical Queries
+analytical_queries = [
     "When and where did Dhyan Chand die",
     "Name all the female athletes who are alive and played for Papua New Guinea",
     "Which country has the highest number of gold medals?",
@@ -103,8 +103,9 @@ queries = [
     "Name the members of the mens hockey team who won Gold medal in 1956 Summer Olympics",
     "How many times did athletes from Japan participate in karate events?",
     "What were the position of India athletes in Badminton sport in the last 2 editions of Olympics",
+]
 
-    # Web-based Queries
+web_queries = [
     "Who won the most gold medals in the 2024 Olympics?",
     "What new sports were introduced in the 2024 Olympics?",
     "Who was the flag bearer for the United States in the opening ceremony of the 2024 Olympics?",
@@ -126,3 +127,5 @@ queries = [
     "Who performed at the 2024 Olympics closing ceremony?",
     "How many countries won at least one medal in the 2024 Olympics?"
 ]
+
+queries = textual_queries + analytical_queries + web_queries
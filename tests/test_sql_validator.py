@@ -0,0 +1,61 @@
+import pytest
+
+pytest.importorskip("sqlglot")
+
+from sql_validator import SQLValidator
+
+
+SCHEMA = {
+    "tables": ["athletes", "medals"],
+    "columns": {
+        "athletes": [{"name": "athlete_id", "nullable": False}, {"name": "name", "nullable": True}],
+        "medals": [{"name": "athlete_id", "nullable": True}, {"name": "medal", "nullable": False}],
+    },
+}
+
+
+@pytest.fixture
+def validator() -> SQLValidator:
+    return SQLValidator(SCHEMA)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "SELECT name FROM athletes",
+        "SELECT REPLACE(name, 'a', 'b') FROM athletes",
+        "WITH named AS (SELECT name FROM athletes) SELECT * FROM named",
+    ],
+)
+def test_read_only_queries_are_clean(validator: SQLValidator, query: str) -> None:
+    assert validator.validate(query).clean
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "DELETE FROM athletes",
+        "UPDATE athletes SET name = 'x'",
+        "INSERT INTO athletes (name) VALUES ('x')",
+        "SELECT name INTO copied FROM athletes",
+        "SELECT name FROM athletes FOR UPDATE",
+        "SELECT name FROM athletes LOCK IN SHARE MODE",
+        "SELECT 1; DROP TABLE athletes",
+        "SHOW TABLES",
+    ],
+)
+def test_writes_and_locking_reads_are_rejected(validator: SQLValidator, query: str) -> None:
+    assert validator.validate(query).rejected
+
+
+def test_unknown_column_is_an_issue(validator: SQLValidator) -> None:
+    validation = validator.validate("SELECT height FROM athletes")
+    assert not validation.rejected
+    assert validation.issues
+
+
+def test_not_in_over_nullable_column_is_an_issue(validator: SQLValidator) -> None:
+    query = "SELECT name FROM athletes WHERE athlete_id NOT IN (SELECT athlete_id FROM medals)"
+    assert validator.validate(query).issues
+    filtered = query[:-1] + " WHERE athlete_id IS NOT NULL)"
+    assert validator.validate(filtered).clean
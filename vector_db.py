@@ -1,67 +1,289 @@
+import os
+from typing import List, Optional, Tuple
+import numpy as np
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
 from langchain_core.tools import StructuredTool
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer, util
-from transformers import pipeline
+from bm25_index import BM25Index, collection_fingerprint, read_collection_ids, read_collection_metadata, reciprocal_rank_fusion
+from cache import LRUCache
+from chunk_index import ChunkIndex, read_collection
+from label_classifier import DATA_TYPE_LABELS, LabelClassifier, EmbeddingLabelClassifier, ZeroShotLabelClassifier
+from model_registry import sentence_transformer
+from reranker import CrossEncoderReranker
+
+SEMANTIC_FILTERING_MODEL = 'all-MiniLM-L6-v2'
 
 class VectorDB:
-    def __init__(self, persist_directory : str, embedding_function : any, verbose : bool = False, use_semantic_filtering : bool = True, use_metadata_filtering = True) -> None:
+    def __init__(self, persist_directory : str, embedding_function : any, verbose : bool = False, use_semantic_filtering : bool = True, use_metadata_filtering = True, chunk_index_directory : str = None, label_classifier : LabelClassifier = None, use_hybrid_search : bool = False, bm25_index_directory : str = None, use_reranking : bool = False, reranker : CrossEncoderReranker = None) -> None:
         self.vectorstore = Chroma(persist_directory = persist_directory, embedding_function = embedding_function)
-        if not use_metadata_filtering:
-            self.retriever = self.vectorstore.as_retriever()
+        # Number of documents retrieved per query, the retriever default.
+        self.k = 4
+        # Prefetched responses, keyed on the normalized query. Entries expire so results for queries
+        # the agent never searches with (it often rephrases them) do not accumulate.
+        self.prefetched = LRUCache(int(os.getenv('PREFETCH_CACHE_SIZE', '256')), ttl = float(os.getenv('PREFETCH_CACHE_TTL', '600')))
         self.verbose = verbose
         self.use_metadata_filtering = use_metadata_filtering
         self.use_semantic_filtering = use_semantic_filtering
+        self.chunk_index = None
+        self.bm25_index = None
+        self.reranker = (reranker or CrossEncoderReranker()) if use_reranking else None
+        if use_hybrid_search:
+            # Candidates taken from each ranking before the fused list is cut back to k.
+            self.fusion_candidates = 2 * self.k
+            self.bm25_index = self.load_bm25_index(bm25_index_directory or os.path.join(persist_directory, 'bm25_index'))
+        self.embedding_model = None
+        if use_semantic_filtering:
+            # Shared with Chroma's embedding function when both use the same model.
+            self.embedding_model = sentence_transformer(SEMANTIC_FILTERING_MODEL)
         if use_metadata_filtering:
-            self.classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
-
-            self.labels = ["Badminton Rules", "Basketball Rules", "Boxing Rules", "Breaking Rules", "Fencing Rules", 
-            "Gymnastics Rules", "Handball Rules", "Judo Rules", "Table Tennis Rules", "Taekwondo Rules",
-            "Weightlifting Rules", "Wrestling Rules", "Olympic News", "Olympic Term Definition", "Player Data"]
+            self.labels = list(DATA_TYPE_LABELS)
+            self.label_classifier = label_classifier or self.build_label_classifier(os.getenv('VECTOR_DB_LABEL_CLASSIFIER', 'embedding'))
         if use_semantic_filtering:
             self.splitter = RecursiveCharacterTextSplitter(chunk_size=250, chunk_overlap=50)
-            self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+            if ChunkIndex.exists(chunk_index_directory):
+                self.chunk_index = ChunkIndex.load(chunk_index_directory, SEMANTIC_FILTERING_MODEL)
+            elif chunk_index_directory and verbose:
+                print(f"---NO CHUNK INDEX AT {chunk_index_directory}, CHUNKING RETRIEVED DOCUMENTS PER QUERY---")
 
     def search(self, query : str) -> str:
+        return self.search_many([query])[0]
+
+    def search_many(self, queries : List[str]) -> List[str]:
+        return [response for response, _ in self.search_many_scored(queries)]
+
+    def search_many_scored(self, queries : List[str]) -> List[Tuple[str, Optional[float]]]:
+        """
+        Search the vector database for several queries at once. Query embedding, label
+        classification, the Chroma similarity queries and the chunk encoding are batched
+        across queries; each result is identical to calling `search` on that query alone.
+
+        Each response comes with the best cross-encoder score of the returned passages,
+        or None when reranking is off.
+        """
         if self.verbose:
             print("---RETRIEVING CONTEXT---")
+        responses = {}
+        if len(self.prefetched):
+            for query in queries:
+                response = self.prefetched.get(self._prefetch_key(query))
+                if response is not None:
+                    responses[query] = response
+        pending = list(dict.fromkeys(query for query in queries if query not in responses))
+        if pending:
+            retrieved = self.retrieve_many(pending)
+            if self.use_semantic_filtering:
+                # With reranking, the bi-encoder only narrows the chunks down to the cross-encoder's candidate pool.
+                top_k = self.reranker.max_candidates if self.reranker is not None else 3
+                docs = self.semantic_filter_many(pending, retrieved, top_k = top_k)
+            else:
+                docs = [[doc.page_content for doc in query_docs] for query_docs in retrieved]
+            if self.reranker is not None:
+                ranked = self.reranker.rerank_many(pending, docs, top_k = 3 if self.use_semantic_filtering else self.k)
+                scored = [([passage for passage, _ in passages], max((score for _, score in passages), default = 0.0)) for passages in ranked]
+            else:
+                scored = [(query_docs, None) for query_docs in docs]
+            responses.update({query : ("\n\n".join(query_docs), score) for query, (query_docs, score) in zip(pending, scored)})
+        if self.verbose:
+            for query in queries:
+                print("Vector Database Response :", responses[query][0])
+                if responses[query][1] is not None:
+                    print("Reranker Relevance :", responses[query][1])
+        return [responses[query] for query in queries]
+
+    def search_scored(self, query : str) -> Tuple[str, dict]:
+        response, score = self.search_many_scored([query])[0]
+        return response, {"relevance" : score}
+
+    def search_batch(self, queries : List[str]) -> str:
+        return self.search_batch_scored(queries)[0]
+
+    def search_batch_scored(self, queries : List[str]) -> Tuple[str, dict]:
+        results = self.search_many_scored(queries)
+        response = "\n\n".join(
+            f"Results for '{query}':\n{query_response}" for query, (query_response, _) in zip(queries, results)
+        )
+        scores = [score for _, score in results]
+        return response, {"relevance" : None if None in scores else max(scores, default = 0.0)}
+
+    def prefetch(self, queries : List[str]) -> None:
+        """
+        Run a batched search ahead of time; the next `search` for each query is served from the results.
+        """
+        responses = self.search_many_scored(queries)
+        for query, response in zip(queries, responses):
+            self.prefetched.set(self._prefetch_key(query), response)
+
+    @staticmethod
+    def _prefetch_key(query : str) -> str:
+        return " ".join(query.lower().split())
+
+    def prefetch_stats(self) -> dict:
+        return self.prefetched.stats()
+
+    def clear_prefetched(self) -> None:
+        self.prefetched.clear()
+
+    def retrieve_many(self, queries : List[str]) -> List[List[Document]]:
+        query_embeddings = self.vectorstore.embeddings.embed_documents(queries)
         if self.use_metadata_filtering:
-            threshold = 0.15
-            classifier_results = self.classifier(query, candidate_labels = self.labels)
-            classifier_labels = classifier_results['labels']
-            clssifier_scores = classifier_results['scores']
-            query_labels = [classifier_labels[i] for i in range(len(clssifier_scores)) if clssifier_scores[i] > threshold]
-            retriever = self.vectorstore.as_retriever(search_kwargs = {"filter" : {"data-type" : {"$in" : query_labels}}})
-            docs = list(map(lambda x : x.page_content, retriever.invoke(query)))
+            # Queries without any label are searched unfiltered; an empty `$in` would match nothing.
+            filters = [
+                {"data-type" : {"$in" : query_labels}} if query_labels else None
+                for query_labels in self.label_classifier.classify_many(queries)
+            ]
         else:
-            docs = list(map(lambda x : x.page_content, self.retriever.invoke(query)))
-        if self.use_semantic_filtering:
-            docs = sum(map(self.splitter.split_text, docs), [])
-            query_embedding = self.embedding_model.encode(query)
-            chunk_embeddings = self.embedding_model.encode(docs)
-            scores = util.semantic_search(query_embedding, chunk_embeddings, top_k = 3)
-
-            docs = [docs[hit['corpus_id']] for hit in scores[0]]
-        response = "\n\n".join(docs)
-        if self.verbose:
-            print("Vector Database Response :", response)
-        return response
+            filters = [None] * len(queries)
+
+        # Queries sharing a filter are sent to Chroma as a single request.
+        groups = {}
+        for index, where in enumerate(filters):
+            key = None if where is None else tuple(sorted(where["data-type"]["$in"]))
+            groups.setdefault(key, []).append(index)
+
+        retrieved = [None] * len(queries)
+        for indices in groups.values():
+            results = self.query_by_vectors(
+                [query_embeddings[i] for i in indices],
+                k = self.k if self.bm25_index is None else self.fusion_candidates,
+                where = filters[indices[0]],
+            )
+            for index, query_docs in zip(indices, results):
+                retrieved[index] = query_docs
+        if self.bm25_index is not None:
+            retrieved = self.fuse_sparse_results(queries, filters, retrieved)
+        return retrieved
+
+    def query_by_vectors(self, query_embeddings : List[List[float]], k : int, where : Optional[dict] = None) -> List[List[Document]]:
+        """
+        Top k documents for each query embedding in one Chroma request. LangChain's Chroma wrapper
+        only searches one embedding per call, so this goes to the underlying collection.
+        """
+        results = self.vectorstore._collection.query(
+            query_embeddings = query_embeddings,
+            n_results = k,
+            where = where,
+            include = ["documents", "metadatas"]
+        )
+        return [
+            [
+                Document(page_content = document, metadata = metadata or {}, id = doc_id)
+                for doc_id, document, metadata in zip(ids, documents, metadatas)
+            ]
+            for ids, documents, metadatas in zip(results["ids"], results["documents"], results["metadatas"])
+        ]
+
+    def fuse_sparse_results(self, queries : List[str], filters : List[dict], dense : List[List[Document]]) -> List[List[Document]]:
+        """
+        Merge the dense results with BM25 results for the same queries and label filters by
+        reciprocal rank fusion, keeping the top k of each fused ranking.
+        """
+        fused_ids = []
+        for query, where, query_docs in zip(queries, filters, dense):
+            labels = None if where is None else where["data-type"]["$in"]
+            sparse = [doc_id for doc_id, _ in self.bm25_index.search(query, self.fusion_candidates, labels)]
+            fused_ids.append(reciprocal_rank_fusion([[doc.id for doc in query_docs], sparse])[:self.k])
+
+        # Documents found only by BM25 are read from Chroma in one request.
+        documents = {doc.id : doc for query_docs in dense for doc in query_docs}
+        missing = list(dict.fromkeys(doc_id for ids in fused_ids for doc_id in ids if doc_id not in documents))
+        if missing:
+            results = self.vectorstore.get(ids = missing, include = ["documents", "metadatas"])
+            for doc_id, document, metadata in zip(results["ids"], results["documents"], results["metadatas"]):
+                documents[doc_id] = Document(page_content = document, metadata = metadata or {}, id = doc_id)
+        return [[documents[doc_id] for doc_id in ids if doc_id in documents] for ids in fused_ids]
+
+    def semantic_filter_many(self, queries : List[str], retrieved : List[List[Document]], top_k : int = 3) -> List[List[str]]:
+        candidates = []
+        unindexed_chunks = {}
+        for query_docs in retrieved:
+            if self.chunk_index is not None:
+                chunks, chunk_embeddings, missing = self.chunk_index.gather([doc.id for doc in query_docs])
+            else:
+                chunks, chunk_embeddings, missing = [], None, [doc.id for doc in query_docs]
+            # Documents not covered by the chunk index are chunked on the fly.
+            missing_chunks = sum([self.splitter.split_text(doc.page_content) for doc in query_docs if doc.id in missing], [])
+            unindexed_chunks.update(dict.fromkeys(missing_chunks))
+            candidates.append((chunks, chunk_embeddings, missing_chunks))
+
+        query_embeddings = self.embedding_model.encode(queries, normalize_embeddings = True)
+        if unindexed_chunks:
+            encoded = self.embedding_model.encode(list(unindexed_chunks), normalize_embeddings = True)
+            unindexed_chunks = dict(zip(unindexed_chunks, encoded))
+
+        docs = []
+        for query_embedding, (chunks, chunk_embeddings, missing_chunks) in zip(query_embeddings, candidates):
+            if missing_chunks:
+                missing_embeddings = np.stack([unindexed_chunks[chunk] for chunk in missing_chunks])
+                chunk_embeddings = np.concatenate([chunk_embeddings, missing_embeddings]) if chunks else missing_embeddings
+                chunks = chunks + missing_chunks
+            if not chunks:
+                docs.append([])
+                continue
+            scores = chunk_embeddings @ query_embedding
+            top = np.argsort(-scores, kind = 'stable')[:top_k]
+            docs.append([chunks[i] for i in top])
+        return docs
     
+    def build_label_classifier(self, kind : str) -> LabelClassifier:
+        kind = kind.strip().lower()
+        if kind == 'embedding':
+            # Only loaded here for the embedding classifier; the zero-shot path does not need it.
+            return EmbeddingLabelClassifier(self.embedding_model or sentence_transformer(SEMANTIC_FILTERING_MODEL))
+        if kind in {'zero_shot', 'bart'}:
+            return ZeroShotLabelClassifier(self.labels)
+        raise ValueError("Unsupported VECTOR_DB_LABEL_CLASSIFIER. Use one of: 'embedding', 'zero_shot'.")
+
+    def load_bm25_index(self, directory : str) -> BM25Index:
+        if BM25Index.exists(directory):
+            index = BM25Index.load(directory)
+            # Documents added to or removed from the collection since the index was built make it stale.
+            if index.fingerprint == collection_fingerprint(read_collection_ids(self.vectorstore)):
+                return index
+            if self.verbose:
+                print(f"---BM25 INDEX AT {directory} IS STALE---")
+        # Building the sparse index is a single tokenizing pass, so it is done on first use.
+        if self.verbose:
+            print(f"---BUILDING BM25 INDEX AT {directory}---")
+        index = BM25Index(directory)
+        index.build(*read_collection_metadata(self.vectorstore))
+        return index
+
+    def update_chunk_index(self, directory : str, rebuild : bool = False) -> dict:
+        if not self.use_semantic_filtering:
+            raise ValueError("The chunk index is only used with use_semantic_filtering=True")
+        if rebuild or not ChunkIndex.exists(directory):
+            self.chunk_index = ChunkIndex(directory, SEMANTIC_FILTERING_MODEL)
+        elif self.chunk_index is None or self.chunk_index.directory != directory:
+            # Incremental updates start from the saved index so only new or changed documents are encoded.
+            self.chunk_index = ChunkIndex.load(directory, SEMANTIC_FILTERING_MODEL)
+        ids, documents = read_collection(self.vectorstore)
+        return self.chunk_index.update(ids, documents, self.splitter, self.embedding_model, rebuild = rebuild)
+
     def as_tool(self) -> StructuredTool:
+        # The reranker score travels as the tool message artifact, so the agent can grade without the LLM.
         return StructuredTool.from_function(
-            func = self.search,
+            func = self.search_scored,
+            response_format = "content_and_artifact",
             name = "search_vector_db",
             description = "Search a vector database created by adding information about various aspects of Olympics for relevant documents"
         )
 
+    def as_batch_tool(self) -> StructuredTool:
+        return StructuredTool.from_function(
+            func = self.search_batch_scored,
+            response_format = "content_and_artifact",
+            name = "search_vector_db_batch",
+            description = "Search a vector database created by adding information about various aspects of Olympics for relevant documents, for several search queries at once"
+        )
+
 if __name__ == '__main__':
-    from langchain_huggingface import HuggingFaceEmbeddings
+    from model_registry import SharedEmbeddings
     from dotenv import load_dotenv
-    import os
     load_dotenv()
     vectorDB = VectorDB(
         os.environ['VECTOR_DB_DIRECTORY'], 
-        HuggingFaceEmbeddings(model_name=os.environ['EMBEDDINGS_MODEL']), 
+        SharedEmbeddings(os.environ['EMBEDDINGS_MODEL']), 
         verbose = True
         )
     question = 'How to score a 3 pointer in Basketball'
@@ -1,45 +1,77 @@
-from typing import Literal
+from typing import List, Literal, Optional, Tuple
 from langgraph.graph import END, START, StateGraph, MessagesState
 from langgraph.prebuilt import tools_condition, ToolNode
 from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.runnables import RunnableLambda
 from langchain_core.runnables.graph import MermaidDrawMethod
-from langchain_huggingface import HuggingFaceEmbeddings
+from model_registry import SharedEmbeddings
+from reranker import GradingStats
 from vector_db import VectorDB
 from prompts import grade_document_prompt, rag_prompt
 from pydantic import BaseModel, Field
+import hashlib
 import os
 from dotenv import load_dotenv
+from cache import LRUCache
+from llm_factory import resolve_llm
+
+class VectorDBAgentState(MessagesState):
+    # Retrieval attempts for this request; kept in the graph state so concurrent requests don't share it.
+    retrieval_tries : int
+
+# Data model
+class grade(BaseModel):
+    """Binary score for relevance check."""
+
+    binary_score: str = Field(description="Relevance score 'yes' or 'no'")
 
 class VectorDBAgent:
-    def __init__(self, llm : any, verbose : bool = False, maxRetry : int = 3, use_semantic_filtering : bool = True, use_metadata_filtering = True) -> None:
+    def __init__(self, llm : any, verbose : bool = False, maxRetry : int = 3, use_semantic_filtering : bool = True, use_metadata_filtering = True, use_hybrid_search : bool = False, use_reranking : bool = False) -> None:
         load_dotenv()
-        self.llm = llm
+        self.llm = resolve_llm(llm, "generator")
+        self.grader_llm = resolve_llm(llm, "grader")
+        self.rewrite_llm = resolve_llm(llm, "contextualizer")
         self.verbose = verbose
         self.maxRetry = maxRetry
-        self.tries = 0
-        vectorDB = VectorDB(
+        # Reranker scores at or above the first threshold count as relevant and at or below the
+        # second as not relevant without asking the LLM; scores in between go to the LLM grader.
+        self.relevant_threshold = float(os.getenv('RERANKER_RELEVANT_THRESHOLD', '0.8'))
+        self.not_relevant_threshold = float(os.getenv('RERANKER_NOT_RELEVANT_THRESHOLD', '0.05'))
+        self.grading_stats = GradingStats()
+        # Relevance decisions keyed on a hash of the question and the retrieved context; the same
+        # pairs come back on retries and from other users asking the same question.
+        self.grading_cache = LRUCache(int(os.getenv('GRADING_CACHE_SIZE', '1024')))
+        self.vectorDB = VectorDB(
             os.environ['VECTOR_DB_DIRECTORY'], 
-            HuggingFaceEmbeddings(model_name=os.environ['EMBEDDINGS_MODEL']), 
+            SharedEmbeddings(os.environ['EMBEDDINGS_MODEL']), 
             verbose = verbose,
             use_semantic_filtering = use_semantic_filtering,
-            use_metadata_filtering = use_metadata_filtering
+            use_metadata_filtering = use_metadata_filtering,
+            chunk_index_directory = os.getenv('CHUNK_INDEX_DIRECTORY', os.path.join(os.environ['VECTOR_DB_DIRECTORY'], 'chunk_index')),
+            use_hybrid_search = use_hybrid_search,
+            bm25_index_directory = os.getenv('BM25_INDEX_DIRECTORY', os.path.join(os.environ['VECTOR_DB_DIRECTORY'], 'bm25_index')),
+            use_reranking = use_reranking
             )
-        self.tools = [vectorDB.as_tool()]
+        self.tools = [self.vectorDB.as_tool(), self.vectorDB.as_batch_tool()]
+        # Chains are built once and shared by all requests.
+        self.llm_with_tools = resolve_llm(llm, "router").bind_tools(self.tools)
+        self.grade_chain = self.build_grade_chain()
+        self.rag_chain = self.build_rag_chain()
 
         # Define a new graph
-        workflow = StateGraph(MessagesState)
+        workflow = StateGraph(VectorDBAgentState)
 
         # Define the nodes we will cycle between
         # agent
-        workflow.add_node("agent", self.agent)  
+        workflow.add_node("agent", RunnableLambda(self.agent, afunc = self.aagent))  
         retrieve = ToolNode(self.tools)
         # retrieval
         workflow.add_node("retrieve", retrieve) 
         # Re-writing the question 
-        workflow.add_node("rewrite", self.rewrite)  
+        workflow.add_node("rewrite", RunnableLambda(self.rewrite, afunc = self.arewrite))  
         # # Generating a response after we know the documents are relevant
-        workflow.add_node("generate", self.generate)  
+        workflow.add_node("generate", RunnableLambda(self.generate, afunc = self.agenerate))  
         # Call agent node to decide to retrieve or not
         workflow.add_edge(START, "agent")
 
@@ -59,7 +91,8 @@ class VectorDBAgent:
         workflow.add_conditional_edges(
             "retrieve",
             # Assess agent decision
-            self.grade_documents,
+            RunnableLambda(self.grade_documents, afunc = self.agrade_documents),
+            ["generate", "rewrite"],
         )
         workflow.add_edge("generate", END)
         workflow.add_edge("rewrite", "agent")
@@ -67,7 +100,7 @@ class VectorDBAgent:
         # Compile
         self.app = workflow.compile()
 
-    def grade_documents(self, state: MessagesState) -> Literal["generate", "rewrite"]:
+    def grade_documents(self, state: VectorDBAgentState) -> Literal["generate", "rewrite"]:
         """
         Determines whether the retrieved documents are relevant to the question.
 
@@ -77,18 +110,55 @@ class VectorDBAgent:
         Returns:
             str: A decision for whether the documents are relevant or not
         """
+        score = self._reranker_score(state)
+        if score is None:
+            inputs = self._grade_inputs(state)
+            key, score = self._cached_grade(inputs)
+            if score is None:
+                score = self.grade_chain.invoke(inputs).binary_score
+                self.grading_cache.set(key, score)
+        return self._grade_decision(state, score)
+
+    async def agrade_documents(self, state: VectorDBAgentState) -> Literal["generate", "rewrite"]:
+        score = self._reranker_score(state)
+        if score is None:
+            inputs = self._grade_inputs(state)
+            key, score = self._cached_grade(inputs)
+            if score is None:
+                score = (await self.grade_chain.ainvoke(inputs)).binary_score
+                self.grading_cache.set(key, score)
+        return self._grade_decision(state, score)
+
+    def _cached_grade(self, inputs: dict) -> Tuple[str, Optional[str]]:
+        key = hashlib.sha256(f"{inputs['question']}\0{inputs['context']}".encode("utf-8")).hexdigest()
+        score = self.grading_cache.get(key)
+        if score is not None:
+            if self.verbose:
+                print("---GRADING CACHE HIT---")
+            self.grading_stats.record("cache")
+        else:
+            self.grading_stats.record("llm")
+        return key, score
+
+    def _reranker_score(self, state: VectorDBAgentState) -> Optional[str]:
+        """'yes' or 'no' when the reranker is confident about the retrieved documents, else None."""
+        artifact = getattr(state["messages"][-1], "artifact", None)
+        relevance = artifact.get("relevance") if isinstance(artifact, dict) else None
+        if relevance is not None and relevance >= self.relevant_threshold:
+            if self.verbose:
+                print(f"---RERANKER: RELEVANT ({relevance:.3f})---")
+            self.grading_stats.record("reranker_relevant")
+            return "yes"
+        if relevance is not None and relevance <= self.not_relevant_threshold:
+            if self.verbose:
+                print(f"---RERANKER: NOT RELEVANT ({relevance:.3f})---")
+            self.grading_stats.record("reranker_not_relevant")
+            return "no"
+        return None
 
-        if self.verbose:
-            print("---CHECK RELEVANCE---")
-
-        # Data model
-        class grade(BaseModel):
-            """Binary score for relevance check."""
-
-            binary_score: str = Field(description="Relevance score 'yes' or 'no'")
-
+    def build_grade_chain(self):
         # LLM with tool and validation
-        llm_with_tool = self.llm.with_structured_output(grade)
+        llm_with_tool = self.grader_llm.with_structured_output(grade)
 
         # Prompt
         prompt = PromptTemplate(
@@ -97,24 +167,21 @@ class VectorDBAgent:
         )
 
         # Chain
-        chain = prompt | llm_with_tool
+        return prompt | llm_with_tool
 
+    def _grade_inputs(self, state: VectorDBAgentState) -> dict:
+        if self.verbose:
+            print("---CHECK RELEVANCE---")
         messages = state["messages"]
-        last_message = messages[-1]
-
-        question = messages[0].content
-        docs = last_message.content
-
-        scored_result = chain.invoke({"question": question, "context": docs})
-
-        score = scored_result.binary_score
+        return {"question": messages[0].content, "context": messages[-1].content}
 
+    def _grade_decision(self, state: VectorDBAgentState, score: str) -> Literal["generate", "rewrite"]:
         if score == "yes":
             if self.verbose:
                 print("---DECISION: DOCS RELEVANT---")
             return "generate"
         
-        elif self.tries >= self.maxRetry:
+        elif state.get("retrieval_tries", 0) >= self.maxRetry:
             if self.verbose:
                 print("---MAX RETRIES REACHED---")
             return "generate"
@@ -125,7 +192,7 @@ class VectorDBAgent:
                 print(score)
             return "rewrite"
     
-    def agent(self, state : MessagesState) -> MessagesState:
+    def agent(self, state : VectorDBAgentState) -> VectorDBAgentState:
         """
         Invokes the agent model to generate a response based on the current state. Given
         the question, it will decide to retrieve using the retriever tool, or simply end.
@@ -136,15 +203,20 @@ class VectorDBAgent:
         Returns:
             dict: The updated state with the agent response appended to messages
         """
+        response = self.llm_with_tools.invoke(self._agent_messages(state))
+        return {"messages": [response], "retrieval_tries": state.get("retrieval_tries", 0) + 1}
+
+    async def aagent(self, state : VectorDBAgentState) -> VectorDBAgentState:
+        response = await self.llm_with_tools.ainvoke(self._agent_messages(state))
+        return {"messages": [response], "retrieval_tries": state.get("retrieval_tries", 0) + 1}
+
+    def _agent_messages(self, state : VectorDBAgentState) -> list:
         if self.verbose:
             print("---CALL VECTOR DB AGENT---")
         messages = state["messages"]
-        self.tries = self.tries + 1
         if isinstance(messages[-1], AIMessage):
             messages.append(HumanMessage(messages[-1].content))
-        model = self.llm.bind_tools(self.tools)
-        response = model.invoke(messages)
-        return {"messages": [response]}
+        return messages
     
     def rewrite(self, state : MessagesState) -> MessagesState:
         """
@@ -157,12 +229,24 @@ class VectorDBAgent:
             dict: The updated state with re-phrased question
         """
 
+        response = self.rewrite_llm.invoke(self._rewrite_messages(state))
+        if self.verbose:
+            print("Transformed Query :", response.content)
+        return {"messages": [response]}
+
+    async def arewrite(self, state : MessagesState) -> MessagesState:
+        response = await self.rewrite_llm.ainvoke(self._rewrite_messages(state))
+        if self.verbose:
+            print("Transformed Query :", response.content)
+        return {"messages": [response]}
+
+    def _rewrite_messages(self, state : MessagesState) -> list:
         if self.verbose:
             print("---TRANSFORM QUERY---")
         messages = state["messages"]
         question = messages[0].content
 
-        msg = [
+        return [
             HumanMessage(
                 content=f""" \n 
         Look at the input and try to reason about the underlying semantic intent / meaning. \n 
@@ -174,11 +258,6 @@ class VectorDBAgent:
         Only return the new question and no additional context.""",
             )
         ]
-
-        response = self.llm.invoke(msg)
-        if self.verbose:
-            print("Transformed Query :", response.content)
-        return {"messages": [response]}
     
     def generate(self, state : MessagesState) -> MessagesState:
         """
@@ -190,15 +269,20 @@ class VectorDBAgent:
         Returns:
             dict: The updated state with re-phrased question
         """
+        response = self.rag_chain.invoke(self._generate_inputs(state))
+        return {"messages": [response]}
+
+    async def agenerate(self, state : MessagesState) -> MessagesState:
+        response = await self.rag_chain.ainvoke(self._generate_inputs(state))
+        return {"messages": [response]}
+
+    def _generate_inputs(self, state : MessagesState) -> dict:
         if self.verbose:
             print("---GENERATE---")
         messages = state["messages"]
-        self.tries = 0
-        question = messages[0].content
-        last_message = messages[-1]
-
-        docs = last_message.content
+        return {"context": messages[-1].content, "question": messages[0].content}
 
+    def build_rag_chain(self):
         # Prompt
         prompt = PromptTemplate(
             template=rag_prompt,
@@ -206,19 +290,28 @@ class VectorDBAgent:
         )
 
         # Chain
-        rag_chain = prompt | self.llm
-
-        # Run
-        response = rag_chain.invoke({"context": docs, "question": question})
-        return {"messages": [response]}
+        return prompt | self.llm
     
     def get_context(self, state : MessagesState) -> str:
         return state["messages"][-2].content
     
+    def prefetch(self, queries : List[str]) -> None:
+        self.vectorDB.prefetch(queries)
+
+    def prefetch_stats(self) -> dict:
+        return self.vectorDB.prefetch_stats()
+
+    def clear_prefetched(self) -> None:
+        self.vectorDB.clear_prefetched()
+
     def processQuery(self, query : str) -> str:
         state = self.app.invoke({"messages": [HumanMessage(content = query)]})
         self.get_context(state)
         return state["messages"][-1].content
+
+    async def aprocessQuery(self, query : str) -> str:
+        state = await self.app.ainvoke({"messages": [HumanMessage(content = query)]})
+        return state["messages"][-1].content
     
     def visualize(self) -> None:
         image_data = self.app.get_graph().draw_mermaid_png(
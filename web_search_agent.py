@@ -5,20 +5,23 @@ from langgraph.graph import END, START, StateGraph, MessagesState
 from langgraph.prebuilt import ToolNode
 from dotenv import load_dotenv
 from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableLambda
 from prompts import rag_prompt
+from llm_factory import resolve_llm
 
 class WebSearchAgent:
     def __init__(self, llm : any, verbose : bool = False) -> None:
         self.verbose = verbose
         load_dotenv()
         tool = TavilySearchResults(max_results = 2)
-        self.llm = llm
-        self.llm_with_tool = llm.bind_tools([tool], tool_choice = 'required')
+        self.llm = resolve_llm(llm, "generator")
+        self.llm_with_tool = resolve_llm(llm, "router").bind_tools([tool], tool_choice = 'required')
+        self.rag_chain = self.build_rag_chain()
         tool_node = ToolNode([tool], name = "search")
 
         workflow = StateGraph(MessagesState)
 
-        workflow.add_node("agent", self.call_tool)
+        workflow.add_node("agent", RunnableLambda(self.call_tool, afunc = self.acall_tool))
         workflow.add_node("search", tool_node)
 
         workflow.add_edge(START, "agent")
@@ -33,6 +36,12 @@ class WebSearchAgent:
             print("---CALL WEB SEARCH AGENT---")
         response = self.llm_with_tool.invoke(state['messages'])
         return {"messages" : [response]}
+
+    async def acall_tool(self, state : MessagesState) -> MessagesState:
+        if self.verbose:
+            print("---CALL WEB SEARCH AGENT---")
+        response = await self.llm_with_tool.ainvoke(state['messages'])
+        return {"messages" : [response]}
     
     def get_context(self, state : MessagesState) -> str:
         return state["messages"][-1].content
@@ -41,6 +50,17 @@ class WebSearchAgent:
         state = self.app.invoke({"messages": [HumanMessage(content = query)]})
         context = self.get_context(state)
 
+        # Run
+        response = self.rag_chain.invoke({"context": context, "question": query})
+
+        return response
+
+    async def aprocessQuery(self, query : str) -> str:
+        state = await self.app.ainvoke({"messages": [HumanMessage(content = query)]})
+        context = self.get_context(state)
+        return await self.rag_chain.ainvoke({"context": context, "question": query})
+
+    def build_rag_chain(self):
         # Prompt
         prompt = PromptTemplate(
             template=rag_prompt,
@@ -48,12 +68,7 @@ class WebSearchAgent:
         )
 
         # Chain
-        rag_chain = prompt | self.llm
-
-        # Run
-        response = rag_chain.invoke({"context": context, "question": query})
-
-        return response
+        return prompt | self.llm
     
     def visualize(self) -> None:
         image_data = self.app.get_graph().draw_mermaid_png(